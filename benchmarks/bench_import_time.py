@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: cumulative `python -X importtime` cost of importing
+promptbuilder_node in a fresh interpreter. Exits non-zero when the median
+exceeds the budget, so it can gate CI.
+
+    python benchmarks/bench_import_time.py [budget_ms]
+"""
+
+import sys
+import os
+import subprocess
+import statistics
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = 'promptbuilder_node'
+# The node imported in ~120 ms while it loaded requests and tags_db.json eagerly
+IMPORT_TIME_BUDGET_MS = 60.0
+
+
+def measure_import_time(module: str = MODULE):
+    """
+    Cumulative import time of module in microseconds and the slowest
+    (self time) modules it pulled in, from one fresh interpreter
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PACKAGE_DIR, capture_output=True, text=True, check=True
+    )
+    total = None
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((int(self_us), name.strip()))
+        if name.strip() == module:
+            total = int(cumulative_us)
+    if total is None:
+        raise Exception(f"{module} did not show up in the importtime output:\n{result.stderr}")
+    return total, sorted(modules, reverse=True)[:8]
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_TIME_BUDGET_MS
+    runs = [measure_import_time() for _ in range(5)]
+    median_ms = statistics.median(total for total, _ in runs) / 1000
+    print(f"{MODULE} import: median {median_ms:.1f} ms over {len(runs)} runs (budget {budget_ms:.0f} ms)")
+    for self_us, name in runs[-1][1]:
+        print(f"  {self_us / 1000:>7.2f} ms  {name}")
+    if median_ms > budget_ms:
+        print(f"❌ Import time {median_ms:.1f} ms exceeds the {budget_ms:.0f} ms budget")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: single-pass parse_llama_json_response against the previous
+five-regex implementation, on typical and adversarial LLM output
+"""
+
+import sys
+import os
+import re
+import json
+import timeit
+from typing import Dict, Any, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from promptbuilder_node import parse_llama_json_response
+
+
+def legacy_parse_llama_json_response(text: str) -> Optional[Dict[str, Any]]:
+    """
+    The regex cascade parse_llama_json_response used before the scanner
+    """
+    if not text or not isinstance(text, str):
+        return None
+    
+    cleaned_text = text.strip()
+    
+    try:
+        parsed = json.loads(cleaned_text)
+        if parsed and isinstance(parsed, dict):
+            return parsed
+    except json.JSONDecodeError:
+        pass
+    
+    json_block_match = re.search(r'```(?:json)?\s*([\s\S]*?)```', cleaned_text)
+    if json_block_match:
+        try:
+            parsed = json.loads(json_block_match.group(1).strip())
+            if parsed and isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+    
+    json_object_match = re.search(r'\{[\s\S]*?\}(?=\s*$|\s*[^\s\w\d\{\}\[\]"\',])', cleaned_text)
+    if json_object_match:
+        try:
+            json_str = json_object_match.group(0)
+            json_str = re.sub(r',\s*\}', '}', json_str)
+            json_str = re.sub(r',\s*\]', ']', json_str)
+            json_str = re.sub(r"'", '"', json_str)
+            json_str = re.sub(r'\n', ' ', json_str)
+            json_str = re.sub(r'\s+', ' ', json_str)
+            
+            parsed = json.loads(json_str)
+            if parsed and isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+    
+    json_array_match = re.search(r'\[[\s\S]*?\]', cleaned_text)
+    if json_array_match:
+        try:
+            parsed = json.loads(json_array_match.group(0))
+            if isinstance(parsed, list):
+                return {"structuredPrompts": parsed}
+        except json.JSONDecodeError:
+            pass
+    
+    potential_json_match = re.search(r'\{[\s\S]{20,1000}\}', cleaned_text)
+    if potential_json_match:
+        try:
+            fixed_json = potential_json_match.group(0)
+            fixed_json = re.sub(r'([\{\,])\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*:', r'\1"\2":', fixed_json)
+            fixed_json = re.sub(r"'", '"', fixed_json)
+            fixed_json = re.sub(r',\s*\}', '}', fixed_json)
+            fixed_json = re.sub(r',\s*\]', ']', fixed_json)
+            
+            parsed = json.loads(fixed_json)
+            if parsed and isinstance(parsed, dict):
+                return parsed
+        except json.JSONDecodeError:
+            pass
+    
+    return None
+
+
+PROMPT = json.dumps({
+    "positive": "a woman in a garden, golden hour lighting, 85mm f/1.8, shallow depth of field, " * 4,
+    "negative": "blurry, low quality, distorted",
+    "enhanced_description": "A serene garden scene at golden hour with soft backlighting. " * 3
+}, indent=2)
+
+CASES = {
+    'clean JSON': PROMPT,
+    'code fence + prose': f"Sure! Here is your prompt:\n```json\n{PROMPT}\n```\nLet me know if you want changes.",
+    'trailing comma': PROMPT[:-2] + ",\n}",
+    'bare keys + single quotes': "{positive: 'a red fox in snow', negative: 'blurry', enhanced_description: 'winter scene',}",
+    'brace-heavy prose': "Notes: " + "{x} [y] " * 500 + PROMPT,
+    'adversarial unclosed braces': "{" * 3000,
+    'adversarial open object run': '{"a": ' * 1000,
+    'adversarial deep nesting': '[' * 3000 + ']' * 3000,
+}
+
+
+def main():
+    print(f"{'case':<30} {'legacy µs':>12} {'scanner µs':>12} {'speedup':>8}")
+    for name, text in CASES.items():
+        number = 5 if len(text) > 2000 else 500
+        new_result = parse_llama_json_response(text)
+        new_time = min(timeit.repeat(lambda: parse_llama_json_response(text), number=number, repeat=3)) / number
+        try:
+            legacy_result = legacy_parse_llama_json_response(text)
+        except RecursionError:
+            print(f"{name:<30} {'crashed':>12} {new_time * 1e6:>12.1f}")
+            continue
+        legacy_time = min(timeit.repeat(lambda: legacy_parse_llama_json_response(text), number=number, repeat=3)) / number
+        marker = '' if legacy_result == new_result else '  (results differ)'
+        print(f"{name:<30} {legacy_time * 1e6:>12.1f} {new_time * 1e6:>12.1f} {legacy_time / new_time:>7.1f}x{marker}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: element extraction in enhance_prompt_advanced, the
+original per-category regex passes against the single-pass KeywordMatcher,
+on short and long descriptions and on a batch
+"""
+
+import sys
+import os
+import re
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from promptbuilder_node import extract_prompt_elements
+
+
+def legacy_extract_elements(description):
+    """
+    Element extraction as enhance_prompt_advanced did it before the keyword matcher
+    """
+    elements = {
+        'subject': [],
+        'attributes': [],
+        'clothing': [],
+        'pose': [],
+        'action': [],
+        'location': [],
+        'background': [],
+        'lighting': [],
+        'mood': [],
+        'details': []
+    }
+    
+    patterns = {
+        'subject': r'(young woman|woman|man|person|girl|boy|female|male|figure|character)(?: with|,| who| that| \(|\s+|$)',
+        'clothing': r'(string thong|string top|nipple tape|shoulder strap|clothing|wearing|dressed in|outfit|attire|garment|bikini|lingerie|swimsuit)',
+        'pose': r'(squats|squatting|reclines|leaning|standing|sitting|lying|kneeling|bending|stretching|posing|position|posture|gesture)',
+        'location': r'(campfire|sauna|wood-paneled|cozy scene|environment|setting|background|behind her|room|place|location|setting|surroundings)',
+        'lighting': r'(warm golden light|golden light|lighting|light|shadows|highlighting|sheen|illuminated|glow|sunlight|moonlight|ambient light|dramatic lighting)',
+        'mood': r'(joyful|playful|relaxed|confident|sensual|intimate|comfortable|warmth|laughter|enjoyment|happiness|pleasure|content|serene|peaceful|excited)',
+        'details': r'(radiating|playful|provocatively|subtle|sensuality|cozy|delicate|sweet|realistic|intimate|vivid|dynamic|expressive|natural|organic|fluid)'
+    }
+    
+    for category, pattern in patterns.items():
+        matches = re.findall(pattern, description, re.IGNORECASE)
+        if matches:
+            elements[category].extend([match.lower() for match in matches if match])
+    
+    words = description.lower().split()
+    
+    descriptive_words = [
+        'radiating', 'playful', 'provocatively', 'relaxed', 'subtle', 'confident', 
+        'sensuality', 'cozy', 'delicate', 'sweet', 'realistic', 'intimate', 'comfortable',
+        'vivid', 'dynamic', 'expressive', 'natural', 'organic', 'fluid', 'graceful',
+        'elegant', 'powerful', 'soft', 'gentle', 'strong', 'feminine', 'masculine',
+        'youthful', 'mature', 'energetic', 'calm', 'serene', 'peaceful', 'intense'
+    ]
+    
+    for word in descriptive_words:
+        if word in words and word not in elements['details']:
+            elements['details'].append(word)
+    
+    detail_patterns = {
+        'squatting': r'(squats|squatting|low position|crouching)',
+        'campfire': r'(campfire|firelight|fire glow|bonfire)',
+        'sauna': r'(sauna|steam room|hot room|wooden sauna)',
+        'golden_light': r'(golden light|warm light|sunset glow|golden hour)',
+        'skin': r'(skin texture|skin details|pore details|skin sheen|skin glow)',
+        'hair': r'(hair flow|hair details|strands of hair|hair movement)',
+        'eyes': r'(eye details|sparkling eyes|expressive eyes|eye color)',
+        'environment': r'(wood-paneled|cozy|warm|intimate|comfortable|relaxing)'
+    }
+    
+    for detail_type, pattern in detail_patterns.items():
+        matches = re.findall(pattern, description, re.IGNORECASE)
+        if matches:
+            if detail_type == 'squatting':
+                elements['pose'].append('squatting pose')
+            elif detail_type == 'campfire':
+                elements['location'].append('around campfire')
+                elements['lighting'].append('firelight glow')
+            elif detail_type == 'sauna':
+                elements['location'].append('in sauna')
+                elements['background'].append('steamy atmosphere')
+            elif detail_type == 'golden_light':
+                elements['lighting'].append('golden hour lighting')
+                elements['mood'].append('warm atmosphere')
+            elif detail_type == 'skin':
+                elements['details'].append('detailed skin texture')
+                elements['details'].append('skin pores visible')
+            elif detail_type == 'hair':
+                elements['details'].append('detailed hair strands')
+                elements['details'].append('hair movement')
+            elif detail_type == 'eyes':
+                elements['details'].append('expressive eyes')
+                elements['details'].append('detailed eye reflection')
+            elif detail_type == 'environment':
+                for match in matches:
+                    if match not in elements['location']:
+                        elements['location'].append(match)
+    
+    if not elements['subject'] and len(words) > 2:
+        potential_subject = ' '.join(words[:3])
+        elements['subject'].append(potential_subject)
+    
+    return elements
+
+
+SAMPLE = ("A joyful young woman with long hair squats beside a crackling campfire in a wood-paneled sauna, "
+          "warm golden light highlighting the sheen of her skin texture, sparkling eyes, relaxed and playful "
+          "posture, steam room haze in the background, cozy intimate setting, natural expressive gesture. ")
+FILLER = "The scene continues with more narrative prose about the evening and the people around the fire. "
+
+
+def main():
+    rng = random.Random(7)
+    words = (SAMPLE + FILLER).split()
+    batch = [' '.join(rng.choice(words) for _ in range(rng.randint(10, 80))) for _ in range(200)]
+    cases = {
+        'short (1 sentence)': [SAMPLE],
+        'long (~10 KB)': [(SAMPLE + FILLER) * 25],
+        'batch of 200': batch,
+    }
+    print(f"{'description':<22} {'regex µs':>10} {'matcher µs':>12} {'speedup':>8}")
+    for name, texts in cases.items():
+        assert [legacy_extract_elements(text) for text in texts] == [extract_prompt_elements(text) for text in texts]
+        number = max(1, 2000 // len(texts) // (10 if len(texts[0]) > 1000 else 1))
+        legacy = min(timeit.repeat(lambda: [legacy_extract_elements(text) for text in texts],
+                                   number=number, repeat=3)) / number
+        matcher = min(timeit.repeat(lambda: [extract_prompt_elements(text) for text in texts],
+                                    number=number, repeat=3)) / number
+        print(f"{name:<22} {legacy * 1e6:>10.1f} {matcher * 1e6:>12.1f} {legacy / matcher:>7.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-call overhead of the PromptBuilderOnlineNode helpers,
+delegating to the shared PROMPT_ENGINE against the old delegates that built
+a throwaway PromptBuilderLocalNode (and with it a requests.Session) on every
+call. Reports time and peak traced allocation per call.
+"""
+
+import sys
+import os
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from promptbuilder_node import PromptBuilderLocalNode, PromptBuilderOnlineNode
+
+SETTINGS = {'gender': 'female', 'age_range': '25s', 'ethnicity': 'japanese', 'body_type': 'athletic'}
+
+
+def helper_calls(node):
+    """The helper calls generate_prompts makes, bound to node"""
+    return [
+        ('get_quality_tags', lambda: node.get_quality_tags('SDXL', 'realistic', 'professional')),
+        ('build_character_description', lambda: node.build_character_description(**SETTINGS)),
+        ('apply_presets', lambda: node.apply_presets('close-up, studio', node.shot_presets)),
+        ('create_system_prompt', lambda: node.create_system_prompt('SDXL', 'realistic', 'professional', 'off')),
+        ('format_for_model', lambda: node.format_for_model('a red fox in the snow', 'MidJourney', {})),
+    ]
+
+
+class ThrowawayNodeDelegates:
+    """The helpers as they were: a new PromptBuilderLocalNode per call"""
+    shot_presets = PromptBuilderOnlineNode().shot_presets
+
+    def get_quality_tags(self, *args):
+        return PromptBuilderLocalNode().get_quality_tags(*args)
+
+    def build_character_description(self, **kwargs):
+        return PromptBuilderLocalNode().build_character_description(**kwargs)
+
+    def apply_presets(self, *args):
+        return PromptBuilderLocalNode().apply_presets(*args)
+
+    def create_system_prompt(self, *args, **kwargs):
+        return PromptBuilderLocalNode().create_system_prompt(*args, **kwargs)
+
+    def format_for_model(self, *args):
+        return PromptBuilderLocalNode().format_for_model(*args)
+
+
+def peak_allocation(fn) -> int:
+    """Peak traced bytes allocated by one warmed-up call"""
+    fn()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def per_call_us(fn, number: int = 2000) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print(f"{'helper':<28} {'old µs':>9} {'engine µs':>10} {'old bytes':>10} {'engine bytes':>13}")
+    old_calls = helper_calls(ThrowawayNodeDelegates())
+    new_calls = helper_calls(PromptBuilderOnlineNode())
+    for (name, old), (_, new) in zip(old_calls, new_calls):
+        print(f"{name:<28} {per_call_us(old, 200):>9.2f} {per_call_us(new):>10.2f} "
+              f"{peak_allocation(old):>10} {peak_allocation(new):>13}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: offline enhancement of a large batch, one
+enhance_prompt_advanced call per description against enhance_prompts_batch
+in this process and spread over worker processes
+"""
+
+import sys
+import os
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from promptbuilder_node import PromptBuilderLocalNode, enhance_prompts_batch
+
+WORDS = ("joyful young woman with long hair squats beside a crackling campfire in a wood-paneled sauna, warm golden "
+         "light highlighting the sheen of her skin texture, sparkling eyes, relaxed playful posture, steam room haze "
+         "in the background, cozy intimate setting, natural expressive gesture, city street at night").split()
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - started
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(11)
+    descriptions = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 60))) for _ in range(count)]
+    node = PromptBuilderLocalNode()
+    
+    looped, looped_s = timed(lambda: [node.enhance_prompt_advanced(text, 'realistic', 'any') for text in descriptions])
+    batched, batched_s = timed(lambda: enhance_prompts_batch(descriptions, 'realistic', 'any'))
+    pooled, pooled_s = timed(lambda: enhance_prompts_batch(descriptions, 'realistic', 'any', processes=0))
+    assert looped == batched == pooled
+    
+    print(f"{count} descriptions, {os.cpu_count()} CPUs")
+    print(f"{'per-call loop':<28} {looped_s * 1000:>9.1f} ms")
+    print(f"{'enhance_prompts_batch':<28} {batched_s * 1000:>9.1f} ms  {looped_s / batched_s:>5.1f}x")
+    print(f"{'enhance_prompts_batch (pool)':<28} {pooled_s * 1000:>9.1f} ms  {looped_s / pooled_s:>5.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-call cost of building the system prompt from scratch
+(what every call paid before memoization) against the memoized
+create_system_prompt
+"""
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import promptbuilder_node
+from promptbuilder_node import PromptBuilderLocalNode
+
+CASES = {
+    'realistic, defaults': ('SDXL', 'realistic', 'any', 'off', {}),
+    'anime, nsfw, female': ('Pony', 'anime', 'any', 'nsfw', {
+        'anime_style': 'naruto', 'gender': 'female', 'breast_size': 'large', 'nsfw_level': 7,
+        'scene_type': 'couple', 'roleplay': 'maid_master'
+    }),
+    'realistic, random mode': ('Flux', 'realistic', 'any', 'off', {
+        'enable_random_generation': True, 'random_intensity': 0.8, 'gender': 'male', 'facial_hair': 'beard'
+    }),
+}
+
+
+def main():
+    node = PromptBuilderLocalNode()
+    uncached = promptbuilder_node._compile_system_prompt.__wrapped__
+    number = 2000
+    print(f"{'case':<26} {'rebuild µs':>12} {'memoized µs':>12} {'speedup':>8}")
+    for name, (target_model, style_main, style_sub, nsfw_mode, kwargs) in CASES.items():
+        options = tuple((key, kwargs[key]) for key in promptbuilder_node.SYSTEM_PROMPT_OPTIONS if key in kwargs)
+        rebuild = min(timeit.repeat(
+            lambda: uncached('full', target_model, style_main, style_sub, nsfw_mode, options, id(promptbuilder_node.TAGS_DB)),
+            number=number, repeat=3)) / number
+        memoized = min(timeit.repeat(
+            lambda: node.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs),
+            number=number, repeat=3)) / number
+        print(f"{name:<26} {rebuild * 1e6:>12.2f} {memoized * 1e6:>12.2f} {rebuild / memoized:>7.1f}x")
+    print(promptbuilder_node._compile_system_prompt.cache_info())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: "which category is this tag in" and prefix autocomplete
+as a scan over the tags_db.json lists against the compiled, memory-mapped
+tags index, on the shipped database and on a 50x larger synthetic one
+"""
+
+import sys
+import os
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from promptbuilder_node import CompiledTagsIndex, compile_tags_index, get_tags_db
+
+
+def scan_categories(tags_db, tag):
+    return [category for category, values in tags_db.items() if isinstance(values, list) and tag in values]
+
+
+def scan_complete(tags_db, prefix, limit=10):
+    found = sorted({tag for values in tags_db.values() if isinstance(values, list)
+                    for tag in values if isinstance(tag, str) and tag.lower().startswith(prefix)})
+    return found[:limit]
+
+
+def bench(name, tags_db, tag, prefix):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tags_db.idx')
+        with open(path, 'wb') as f:
+            f.write(compile_tags_index(tags_db))
+        index = CompiledTagsIndex.open(path)
+        assert scan_categories(tags_db, tag) == index.categories_of(tag)
+        number = 2000
+        rows = [
+            ('category lookup', lambda: scan_categories(tags_db, tag), lambda: index.categories_of(tag)),
+            ('autocomplete', lambda: scan_complete(tags_db, prefix), lambda: index.complete(prefix)),
+        ]
+        for label, scan, compiled in rows:
+            scan_us = min(timeit.repeat(scan, number=number, repeat=3)) / number * 1e6
+            compiled_us = min(timeit.repeat(compiled, number=number, repeat=3)) / number * 1e6
+            print(f"{name:<22} {label:<16} {scan_us:>10.2f} {compiled_us:>12.2f} {scan_us / compiled_us:>7.1f}x")
+        del index
+
+
+def main():
+    tags_db = get_tags_db()
+    large = {f"{category}_{copy}": [f"{tag} {copy}" for tag in values]
+             for copy in range(50) for category, values in tags_db.items() if isinstance(values, list)}
+    large['hair_color'] = tags_db.get('hair_color', []) + ['blonde hair']
+    print(f"{'database':<22} {'operation':<16} {'scan µs':>10} {'compiled µs':>12} {'speedup':>8}")
+    bench(f"shipped ({sum(len(v) for v in tags_db.values() if isinstance(v, list))} tags)",
+          tags_db, 'blonde hair', 'blo')
+    bench(f"50x ({sum(len(v) for v in large.values())} tags)", large, 'blonde hair', 'blo')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: BM25 tag retrieval on the shipped tags database, one
+lookup at a time and as a batch
+"""
+
+import sys
+import os
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from promptbuilder_node import get_tags_index, tag_retrieval_exclusions
+
+QUERY = "young woman with long hair in a red dress at a cafe, soft window light"
+TEXTS = [QUERY, "girl with a ribbon at the beach at sunset", "cyberpunk city at night, rain", "portrait, smiling"]
+
+
+def main():
+    index = get_tags_index()
+    exclude = tag_retrieval_exclusions('off')
+    number = 200
+    single_ms = min(timeit.repeat(lambda: index.search(QUERY, 5, exclude), number=number, repeat=3)) / number * 1e3
+    batch_ms = min(timeit.repeat(lambda: index.search_batch(TEXTS, 5, exclude), number=number, repeat=3)) / number * 1e3
+    print(f"single lookup: {single_ms:.3f} ms")
+    print(f"batch of {len(TEXTS)}:    {batch_ms:.3f} ms ({batch_ms / len(TEXTS):.3f} ms per text)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI-compatible /v1/chat/completions server shared by the LLM client
+tests. Concurrency is checked with counters and gates instead of timings.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from promptbuilder_node import PromptBuilderLocalNode
+
+# Upper bound for how long a gated or held request waits, only hit when a test fails
+GATE_TIMEOUT = 10.0
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    # Room for a few hundred simultaneous connects
+    request_queue_size = 512
+    daemon_threads = True
+
+
+class MockLLMServer:
+    """
+    Minimal /v1/chat/completions server that echoes the user message back.
+    With gate=N every request waits until N requests are in flight at once;
+    with hold=True responses wait until release is set. An ssl_context
+    serves over HTTPS.
+    """
+
+    def __init__(self, keep_alive: bool = False, gate: int = 0, hold: bool = False, ssl_context=None):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.gate = gate
+        self.gate_timeouts = 0
+        self.hold = hold
+        self.release = threading.Event()
+        self.release_timeouts = 0
+        self.condition = threading.Condition()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps connections open between requests
+            protocol_version = 'HTTP/1.1' if keep_alive else 'HTTP/1.0'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                payload = json.loads(body)
+                with server.condition:
+                    server.requests.append(payload)
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                    server.condition.notify_all()
+                    if not server.condition.wait_for(lambda: server.max_in_flight >= server.gate, GATE_TIMEOUT):
+                        server.gate_timeouts += 1
+                try:
+                    if server.hold and not server.release.wait(GATE_TIMEOUT):
+                        server.release_timeouts += 1
+                    server.respond(self, payload)
+                finally:
+                    with server.condition:
+                        server.in_flight -= 1
+
+        self.httpd = MockHTTPServer(('127.0.0.1', 0), Handler)
+        scheme = 'http'
+        if ssl_context is not None:
+            self.httpd.socket = ssl_context.wrap_socket(self.httpd.socket, server_side=True)
+            scheme = 'https'
+        self.url = f"{scheme}://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def respond(self, handler, payload):
+        user_content = payload['messages'][-1]['content']
+        content = json.dumps({
+            "positive": user_content,
+            "negative": "blurry",
+            "enhanced_description": user_content
+        })
+        if payload.get('stream'):
+            self.respond_stream(handler, content)
+            return
+        self.respond_content(handler, content)
+
+    def respond_content(self, handler, content, **extra):
+        body = json.dumps(dict({"choices": [{"message": {"content": content}}]}, **extra)).encode()
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def respond_stream(self, handler, content, chunk_size=16, done=True):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/event-stream')
+        handler.send_header('Connection', 'close')
+        handler.end_headers()
+        self.stream_chunks(handler, content, chunk_size)
+        if done:
+            handler.wfile.write(b"data: [DONE]\n\n")
+        handler.close_connection = True
+
+    def stream_chunks(self, handler, content, chunk_size=16):
+        for start in range(0, len(content), chunk_size):
+            event = {"choices": [{"delta": {"content": content[start:start + chunk_size]}}]}
+            handler.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            handler.wfile.flush()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.release.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def run_batch(url: str, **kwargs):
+    node = PromptBuilderLocalNode()
+    return node.generate_prompts(
+        "a woman in a garden", url, "mock-model", "SDXL", "realistic", "professional", 1,
+        enable_batch=True, quality_tags=False, **kwargs
+    )
@@ -1,154 +1,3142 @@
 import json
-import requests
 import re
-from typing import Dict, Any, List, Tuple, Optional
+from typing import Dict, Any, List, Tuple, Optional, Callable
 import random
 import os
+import sys
+import threading
+import time
+import functools
+import contextlib
+import contextvars
+import collections
+import types
+import heapq
+import math
+import struct
 
 # ========================= Tags Database Loading =========================
-def load_tags_database() -> Dict[str, Any]:
+TAGS_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tags_db.json')
+# tags_db.json is checked for changes (mtime and size) at most this often, in seconds
+TAGS_DB_RELOAD_INTERVAL = 2.0
+
+def load_tags_database(tags_db_path: Optional[str] = None) -> Dict[str, Any]:
     """
     Load the tags database from tags_db.json for LLM reference
     """
     try:
-        # Get the directory where this script is located
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        tags_db_path = os.path.join(script_dir, 'tags_db.json')
-        
-        with open(tags_db_path, 'r', encoding='utf-8') as f:
+        with open(tags_db_path or TAGS_DB_PATH, 'r', encoding='utf-8') as f:
             tags_db = json.load(f)
         return tags_db
     except (FileNotFoundError, json.JSONDecodeError) as e:
         print(f"Warning: Could not load tags_db.json: {e}")
         return {}
 
-# Load tags database once at module level
-TAGS_DB = load_tags_database()
+_tags_db_lock = threading.Lock()
+# The database read from TAGS_DB_PATH and that file's (mtime_ns, size) at the time
+_tags_db_file: Tuple[Optional[Dict[str, Any]], Optional[Tuple[int, int]]] = (None, None)
+_tags_db_next_check = 0.0
+# Database pinned by tags_db_snapshot(), per thread and per asyncio task
+_tags_db_snapshot: 'contextvars.ContextVar[Optional[Dict[str, Any]]]' = contextvars.ContextVar('tags_db_snapshot',
+                                                                                              default=None)
+# Functions clearing caches derived from TAGS_DB, called when it is reloaded
+_tags_db_reload_hooks: List[Callable[[], None]] = []
 
-# ========================= Advanced JSON Parsing Functions =========================
-def parse_llama_json_response(text: str) -> Optional[Dict[str, Any]]:
+def _tags_db_signature() -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(TAGS_DB_PATH)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def reload_tags_database() -> Dict[str, Any]:
     """
-    Advanced JSON parsing with multiple fallback strategies for LLM responses
+    Read tags_db.json again and swap it in as TAGS_DB. A file that cannot be
+    parsed (e.g. one that is still being written) keeps the current database.
     """
-    if not text or not isinstance(text, str):
-        return None
+    global TAGS_DB, _tags_db_file, _tags_db_next_check
+    with _tags_db_lock:
+        signature = _tags_db_signature()
+        current = globals().get('TAGS_DB')
+        try:
+            with open(TAGS_DB_PATH, 'r', encoding='utf-8') as f:
+                tags_db = json.load(f)
+        except (OSError, ValueError) as e:
+            if current is not None:
+                print(f"Warning: Keeping the loaded tags database, could not reload tags_db.json: {e}")
+                _tags_db_file = (_tags_db_file[0], signature)
+                return current
+            print(f"Warning: Could not load tags_db.json: {e}")
+            tags_db = {}
+        TAGS_DB = tags_db
+        _tags_db_file = (tags_db, signature)
+        _tags_db_next_check = time.monotonic() + TAGS_DB_RELOAD_INTERVAL
+        if current is not None:
+            for hook in _tags_db_reload_hooks:
+                hook()
+            print(f"🔄 Reloaded tags_db.json ({sum(len(v) for v in tags_db.values() if isinstance(v, list))} tags)")
+        return tags_db
+
+def get_tags_db() -> Dict[str, Any]:
+    """
+    The tags database, loaded on first use so importing the node stays cheap.
+    tags_db.json is reloaded when it changes on disk; inside tags_db_snapshot()
+    the snapshot is returned instead. Assigning TAGS_DB on the module
+    replaces it and stops the reloading until reload_tags_database().
+    """
+    global _tags_db_next_check
+    snapshot = _tags_db_snapshot.get()
+    if snapshot is not None:
+        return snapshot
+    tags_db = globals().get('TAGS_DB')
+    if tags_db is None:
+        return reload_tags_database()
+    if tags_db is _tags_db_file[0] and time.monotonic() >= _tags_db_next_check:
+        _tags_db_next_check = time.monotonic() + TAGS_DB_RELOAD_INTERVAL
+        if _tags_db_signature() != _tags_db_file[1]:
+            return reload_tags_database()
+    return tags_db
+
+@contextlib.contextmanager
+def tags_db_snapshot():
+    """
+    Pin the current tags database for this thread or asyncio task, so a
+    request keeps one consistent database even if tags_db.json is reloaded
+    while it runs. Nested uses share the outer snapshot.
+    """
+    outer = _tags_db_snapshot.get()
+    if outer is not None:
+        yield outer
+        return
+    snapshot = get_tags_db()
+    token = _tags_db_snapshot.set(snapshot)
+    try:
+        yield snapshot
+    finally:
+        _tags_db_snapshot.reset(token)
+
+def __getattr__(name: str) -> Any:
+    # TAGS_DB is only read from disk when something asks for it
+    if name == 'TAGS_DB':
+        return get_tags_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Per-request trace output; concurrent batch items would interleave it, so it is off unless PROMPTBUILDER_DEBUG=1
+DEBUG_LOGGING = os.environ.get('PROMPTBUILDER_DEBUG') == '1'
+
+def debug_log(message: str):
+    if DEBUG_LOGGING:
+        print(message)
+
+# Upper bound for concurrent LLM requests issued by batch mode
+MAX_BATCH_CONCURRENCY = 32
+
+# Seconds to wait for a connection, for a full response, and for each streamed chunk
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+STREAM_IDLE_TIMEOUT = 30
+# Streams longer than max_tokens * this many characters are treated as runaway output
+STREAM_MAX_CHARS_PER_TOKEN = 8
+
+# ========================= Compiled Tags Index =========================
+TAGS_INDEX_PATH = os.environ.get(
+    'PROMPTBUILDER_TAGS_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'tags_db.idx')
+)
+_TAGS_INDEX_MAGIC = b'PBTAGIX1'
+# magic, source mtime_ns, source size, category count, string count, trie node count, trie edge count
+_TAGS_INDEX_HEADER = struct.Struct('<8sqqIIII')
+# Trie nodes are five int32s: first edge, edge count, first and past-the-end
+# string id of the subtree, string id ending at the node (-1 if none)
+_SINGLE_BYTES = [bytes((i,)) for i in range(256)]
+
+def normalize_tag_key(tag: str) -> str:
+    """
+    Lookup key of a tag: lowercase with single spaces
+    """
+    return ' '.join(tag.lower().split())
+
+def _pad4(data: bytes) -> bytes:
+    # Sections start on 4-byte boundaries so they can be read as int arrays
+    return data + b'\0' * (-len(data) % 4)
+
+def _pack_string_table(strings: List[str]) -> bytes:
+    encoded = [text.encode('utf-8') for text in strings]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+    return struct.pack(f'<{len(offsets)}I', *offsets) + _pad4(b''.join(encoded))
+
+def compile_tags_index(tags_db: Dict[str, Any], source_mtime_ns: int = 0, source_size: int = 0) -> bytes:
+    """
+    Serialize the tags database into the binary index read by
+    CompiledTagsIndex: a category table, every distinct tag once (sorted by
+    lookup key) with the ids of the categories it appears in, and a byte
+    trie over the lookup keys whose nodes cover contiguous string id ranges.
+    """
+    categories = [name for name, values in tags_db.items() if isinstance(values, list)]
+    members: Dict[str, Tuple[str, List[int]]] = {}
+    for category_id, name in enumerate(categories):
+        for tag in tags_db[name]:
+            if not isinstance(tag, str) or not tag.strip():
+                continue
+            key = normalize_tag_key(tag)
+            entry = members.setdefault(key, (tag.strip(), []))
+            if category_id not in entry[1]:
+                entry[1].append(category_id)
+    keys = sorted(members, key=lambda key: key.encode('utf-8'))
+    
+    # Byte trie; keys are sorted, so every subtree spans a contiguous id range
+    root: Dict[str, Any] = {'children': {}, 'lo': 0, 'hi': len(keys), 'terminal': -1}
+    for string_id, key in enumerate(keys):
+        node = root
+        for byte in key.encode('utf-8'):
+            child = node['children'].get(byte)
+            if child is None:
+                child = node['children'][byte] = {'children': {}, 'lo': string_id, 'hi': string_id, 'terminal': -1}
+            child['hi'] = string_id + 1
+            node = child
+        node['terminal'] = string_id
+    
+    # Breadth-first numbering keeps each node's edges contiguous
+    nodes = [root]
+    labels = bytearray()
+    targets = []
+    records = []
+    for node in nodes:
+        children = sorted(node['children'].items())
+        records.extend((len(labels), len(children), node['lo'], node['hi'], node['terminal']))
+        for byte, child in children:
+            labels.append(byte)
+            targets.append(len(nodes))
+            nodes.append(child)
+    
+    membership = [0]
+    member_ids: List[int] = []
+    for key in keys:
+        member_ids.extend(members[key][1])
+        membership.append(len(member_ids))
+    
+    return b''.join([
+        _TAGS_INDEX_HEADER.pack(_TAGS_INDEX_MAGIC, source_mtime_ns, source_size,
+                                len(categories), len(keys), len(nodes), len(labels)),
+        _pack_string_table(categories),
+        _pack_string_table([members[key][0] for key in keys]),
+        struct.pack(f'<{len(membership)}I', *membership),
+        _pad4(struct.pack(f'<{len(member_ids)}H', *member_ids)),
+        struct.pack(f'<{len(records)}i', *records),
+        _pad4(bytes(labels)),
+        struct.pack(f'<{len(targets)}I', *targets)
+    ])
+
+class CompiledTagsIndex:
+    """
+    Read-only view of a compiled tags index. Opened from a file it is
+    memory-mapped, so every process using the same file shares one copy in
+    the page cache. Exact and category lookups walk the trie once per byte
+    of the tag; autocomplete walks the prefix and reads the node's id range.
+    """
+    
+    def __init__(self, data: Any):
+        if sys.byteorder != 'little':
+            raise Exception("Compiled tags index requires a little-endian platform")
+        (magic, self.source_mtime_ns, self.source_size, category_count,
+         self.string_count, node_count, edge_count) = _TAGS_INDEX_HEADER.unpack_from(data, 0)
+        if magic != _TAGS_INDEX_MAGIC:
+            raise Exception("Not a compiled tags index")
+        self._data = data
+        view = memoryview(data)
+        
+        def section(start: int, size: int, fmt: str) -> memoryview:
+            if start + size > len(view):
+                raise Exception("Truncated compiled tags index")
+            return view[start:start + size].cast(fmt)
+        
+        offset = _TAGS_INDEX_HEADER.size
+        tables = []
+        for count in (category_count, self.string_count):
+            offsets = section(offset, 4 * (count + 1), 'I')
+            offset += 4 * (count + 1)
+            blob_size = offsets[-1] + (-offsets[-1] % 4)
+            tables.append((offsets, section(offset, offsets[-1], 'B')))
+            offset += blob_size
+        (category_offsets, category_blob), (self._string_offsets, self._string_blob) = tables
+        self._membership = section(offset, 4 * (self.string_count + 1), 'I')
+        offset += 4 * (self.string_count + 1)
+        member_count = self._membership[-1]
+        self._members = section(offset, 2 * member_count, 'H')
+        offset += 2 * member_count + (-2 * member_count % 4)
+        self._nodes = section(offset, 20 * node_count, 'i')
+        offset += 20 * node_count
+        self._labels_at = offset
+        offset += edge_count + (-edge_count % 4)
+        self._targets = section(offset, 4 * edge_count, 'I')
+        self.categories = [
+            bytes(category_blob[category_offsets[i]:category_offsets[i + 1]]).decode('utf-8')
+            for i in range(category_count)
+        ]
+    
+    @classmethod
+    def open(cls, path: str) -> 'CompiledTagsIndex':
+        import mmap
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    
+    def _string(self, string_id: int) -> str:
+        return bytes(self._string_blob[self._string_offsets[string_id]:self._string_offsets[string_id + 1]]).decode('utf-8')
+    
+    def _walk(self, key: str) -> int:
+        """
+        Trie node reached by key, or -1
+        """
+        data, nodes, labels_at = self._data, self._nodes, self._labels_at
+        node = 0
+        for byte in key.encode('utf-8'):
+            edge_start = nodes[5 * node]
+            start = labels_at + edge_start
+            position = data.find(_SINGLE_BYTES[byte], start, start + nodes[5 * node + 1])
+            if position < 0:
+                return -1
+            node = self._targets[edge_start + position - start]
+        return node
+    
+    def _string_id(self, tag: str) -> int:
+        node = self._walk(normalize_tag_key(tag))
+        return self._nodes[5 * node + 4] if node >= 0 else -1
+    
+    def __len__(self) -> int:
+        return self.string_count
+    
+    def __contains__(self, tag: str) -> bool:
+        return self._string_id(tag) >= 0
+    
+    def lookup(self, tag: str) -> Optional[str]:
+        """
+        The tag as spelled in the database, or None
+        """
+        string_id = self._string_id(tag)
+        return self._string(string_id) if string_id >= 0 else None
+    
+    def categories_of(self, tag: str) -> List[str]:
+        """
+        Categories the tag appears in, in database order
+        """
+        string_id = self._string_id(tag)
+        if string_id < 0:
+            return []
+        members = self._members[self._membership[string_id]:self._membership[string_id + 1]]
+        return [self.categories[category_id] for category_id in members]
+    
+    def complete(self, prefix: str, limit: int = 10) -> List[str]:
+        """
+        Up to limit tags starting with prefix, in lookup-key order
+        """
+        key = normalize_tag_key(prefix)
+        if key and prefix[-1:].isspace():
+            # "long " completes to "long hair" but not to "longer"
+            key += ' '
+        node = self._walk(key)
+        if node < 0:
+            return []
+        lo, hi = self._nodes[5 * node + 2], self._nodes[5 * node + 3]
+        return [self._string(i) for i in range(lo, min(hi, lo + limit))]
+
+_compiled_tags_index: Tuple[Optional[Tuple[Any, ...]], Optional[CompiledTagsIndex]] = (None, None)
+_compiled_tags_index_lock = threading.Lock()
+
+def _write_compiled_tags_index(data: bytes, path: str) -> bool:
+    """
+    Atomically replace the index file; processes that still map the old
+    file keep reading it until they reopen
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return True
+    except OSError as e:
+        print(f"Warning: Could not write compiled tags index ({path}): {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+
+def get_compiled_tags_index(tags_db_path: Optional[str] = None, index_path: Optional[str] = None) -> CompiledTagsIndex:
+    """
+    Compiled index of tags_db.json, rebuilt whenever the JSON's mtime or
+    size no longer match the ones recorded in the index file
+    """
+    global _compiled_tags_index
+    tags_db_path = tags_db_path or TAGS_DB_PATH
+    index_path = index_path or TAGS_INDEX_PATH
+    try:
+        stat = os.stat(tags_db_path)
+        source = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        source = (0, 0)
+    cache_key = (tags_db_path, index_path) + source
+    with _compiled_tags_index_lock:
+        if _compiled_tags_index[0] == cache_key and _compiled_tags_index[1] is not None:
+            return _compiled_tags_index[1]
+        index = None
+        try:
+            index = CompiledTagsIndex.open(index_path)
+            if (index.source_mtime_ns, index.source_size) != source:
+                index = None
+        except Exception:
+            # Missing, truncated or from another format version
+            index = None
+        if index is None:
+            tags_db = load_tags_database(tags_db_path) if source != (0, 0) else {}
+            data = compile_tags_index(tags_db, *source)
+            if _write_compiled_tags_index(data, index_path):
+                try:
+                    index = CompiledTagsIndex.open(index_path)
+                except Exception:
+                    index = None
+            if index is None:
+                index = CompiledTagsIndex(data)
+        _compiled_tags_index = (cache_key, index)
+        return index
+
+# Compiled in memory for a TAGS_DB that did not come from tags_db.json as it is on disk
+_memory_tags_index: Tuple[Optional[Dict[str, Any]], Optional[CompiledTagsIndex]] = (None, None)
+
+def current_compiled_tags_index() -> CompiledTagsIndex:
+    """
+    Compiled index of the database get_tags_db() returns: the shared file
+    index while TAGS_DB is tags_db.json as loaded, otherwise (an assigned
+    TAGS_DB, or a snapshot of a file that has changed since) one compiled
+    in memory, once per database
+    """
+    global _memory_tags_index
+    tags_db = get_tags_db()
+    file_db, signature = _tags_db_file
+    if tags_db is file_db and signature is not None:
+        index = get_compiled_tags_index()
+        if (index.source_mtime_ns, index.source_size) == signature:
+            return index
+    with _compiled_tags_index_lock:
+        if _memory_tags_index[0] is not tags_db or _memory_tags_index[1] is None:
+            _memory_tags_index = (tags_db, CompiledTagsIndex(compile_tags_index(tags_db or {})))
+        return _memory_tags_index[1]
+
+def _reset_memory_tags_index():
+    global _memory_tags_index
+    _memory_tags_index = (None, None)
+
+_tags_db_reload_hooks.append(_reset_memory_tags_index)
+
+# ========================= Tags Retrieval =========================
+# Categories never offered to the LLM as vocabulary, and those only offered in NSFW modes
+TAG_RETRIEVAL_EXCLUDED_CATEGORIES = ('negative_prompts', 'quality_tags', 'scene_types', 'roleplay_scenarios')
+TAG_RETRIEVAL_NSFW_CATEGORIES = (
+    'sexual_acts', 'bodily_fluids', 'intimate_details', 'clothing_nude', 'clothing_lingerie',
+    'narrative_elements', 'sensory_details', 'emotional_atmosphere'
+)
+# A category's best tag must score this fraction of the overall best match, and each
+# listed tag this fraction of the best match in its category
+TAG_RETRIEVAL_MIN_CATEGORY_SCORE = 0.5
+TAG_RETRIEVAL_MIN_RELATIVE_SCORE = 0.6
+
+_TAG_TOKEN_PATTERN = re.compile(r"[^\W_]+")
+_TAG_STOPWORDS = frozenset(
+    "a an and as at by for from in into of on or the to with without her his their its is are be very "
+    "who that this wearing".split()
+)
+
+def tokenize_tag_text(text: str) -> List[str]:
+    """
+    Lowercase word tokens with a light plural fold ("poses" -> "pose")
+    """
+    tokens = []
+    for token in _TAG_TOKEN_PATTERN.findall(text.lower()):
+        if token in _TAG_STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+class TagsIndex:
+    """
+    BM25 index over every tag in the tags database. The document side of
+    the BM25 formula is precomputed per posting, so scoring a query is a
+    sum over its terms' posting lists.
+    """
+    
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self, tags_db: Dict[str, Any]):
+        self.tags: List[Tuple[str, str]] = []
+        documents = []
+        for category, values in tags_db.items():
+            if not isinstance(values, list):
+                continue
+            for tag in values:
+                if isinstance(tag, str):
+                    self.tags.append((category, tag))
+                    # The category name helps queries such as "hair" or "lighting"
+                    documents.append(tokenize_tag_text(f"{tag} {category}"))
+        
+        count = len(documents)
+        avg_length = sum(len(doc) for doc in documents) / count if count else 1.0
+        frequencies: List[Dict[str, int]] = []
+        document_frequency: Dict[str, int] = {}
+        for doc in documents:
+            tf: Dict[str, int] = {}
+            for token in doc:
+                tf[token] = tf.get(token, 0) + 1
+            frequencies.append(tf)
+            for token in tf:
+                document_frequency[token] = document_frequency.get(token, 0) + 1
+        
+        self.postings: Dict[str, List[Tuple[int, float]]] = {}
+        for doc_id, tf in enumerate(frequencies):
+            norm = self.K1 * (1 - self.B + self.B * len(documents[doc_id]) / avg_length)
+            for token, freq in tf.items():
+                df = document_frequency[token]
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                self.postings.setdefault(token, []).append((doc_id, idf * freq * (self.K1 + 1) / (freq + norm)))
+    
+    def search(self, text: str, top_k: int = 5, exclude: Tuple[str, ...] = ()) -> Dict[str, List[str]]:
+        return self.search_batch([text], top_k, exclude)[0]
+    
+    def search_batch(self, texts: List[str], top_k: int = 5,
+                     exclude: Tuple[str, ...] = ()) -> List[Dict[str, List[str]]]:
+        """
+        Top-k tags per category for each text. Posting lists are looked up
+        once for the whole batch.
+        """
+        queries = [set(tokenize_tag_text(text)) for text in texts]
+        postings = {token: self.postings.get(token, ()) for token in set().union(*queries)} if queries else {}
+        
+        results = []
+        for query in queries:
+            scores: Dict[int, float] = {}
+            for token in query:
+                for doc_id, weight in postings[token]:
+                    scores[doc_id] = scores.get(doc_id, 0.0) + weight
+            
+            by_category: Dict[str, List[Tuple[float, int]]] = {}
+            for doc_id, score in scores.items():
+                category = self.tags[doc_id][0]
+                if category not in exclude:
+                    by_category.setdefault(category, []).append((score, -doc_id))
+            
+            # Weak categories (matched only on common words) are dropped entirely
+            top_score = max(scores.values()) if scores else 0.0
+            ranked = {}
+            for category, scored in by_category.items():
+                best = heapq.nlargest(top_k, scored)
+                if best[0][0] < top_score * TAG_RETRIEVAL_MIN_CATEGORY_SCORE:
+                    continue
+                cutoff = best[0][0] * TAG_RETRIEVAL_MIN_RELATIVE_SCORE
+                ranked[category] = [self.tags[-doc_id][1] for score, doc_id in best if score >= cutoff]
+            results.append(ranked)
+        return results
+
+_tags_index: Tuple[Optional[Dict[str, Any]], Optional[TagsIndex]] = (None, None)
+_tags_index_lock = threading.Lock()
+
+def get_tags_index() -> TagsIndex:
+    """
+    TagsIndex for the current TAGS_DB, built once per database
+    """
+    global _tags_index
+    tags_db = get_tags_db()
+    with _tags_index_lock:
+        if _tags_index[0] is not tags_db or _tags_index[1] is None:
+            _tags_index = (tags_db, TagsIndex(tags_db or {}))
+        return _tags_index[1]
+
+def _reset_tags_index():
+    global _tags_index
+    _tags_index = (None, None)
+
+_tags_db_reload_hooks.append(_reset_tags_index)
+
+def tag_retrieval_exclusions(nsfw_mode: str) -> Tuple[str, ...]:
+    if nsfw_mode in ('nsfw', 'hardcore'):
+        return TAG_RETRIEVAL_EXCLUDED_CATEGORIES
+    return TAG_RETRIEVAL_EXCLUDED_CATEGORIES + TAG_RETRIEVAL_NSFW_CATEGORIES
+
+def exact_tag_matches(text: str, index: CompiledTagsIndex, exclude: Tuple[str, ...] = ()) -> Dict[str, List[str]]:
+    """
+    Phrases of the text (split on commas, semicolons and line breaks) that
+    are tags in the database, per category, in the order they appear
+    """
+    matches: Dict[str, List[str]] = {}
+    for phrase in re.split(r'[,;\n]', text):
+        tag = index.lookup(phrase) if phrase.strip() else None
+        if tag is None:
+            continue
+        for category in index.categories_of(tag):
+            if category not in exclude and tag not in matches.get(category, ()):
+                matches.setdefault(category, []).append(tag)
+    return matches
+
+def merge_exact_tags(ranked: Dict[str, List[str]], exact: Dict[str, List[str]], top_k: int) -> Dict[str, List[str]]:
+    """
+    Put the tags named verbatim in the text ahead of the ranked ones, top_k per category
+    """
+    merged = dict(ranked)
+    for category, tags in exact.items():
+        named = {normalize_tag_key(tag) for tag in tags}
+        merged[category] = (tags + [tag for tag in ranked.get(category, []) if normalize_tag_key(tag) not in named])[:top_k]
+    return merged
+
+def format_relevant_tags(relevant_tags: Dict[str, List[str]]) -> str:
+    """
+    System prompt section listing the retrieved tags, empty when none matched
+    """
+    if not relevant_tags:
+        return ""
+    lines = [f"- {category.replace('_', ' ')}: {', '.join(tags)}" for category, tags in sorted(relevant_tags.items())]
+    return "\n\nRELEVANT TAGS (from the tags database; use them where they fit the description):\n" + "\n".join(lines)
+
+# ========================= Seeded Randomness =========================
+def item_rng(seed: int, index: int = 0) -> random.Random:
+    """
+    Private random stream for batch item index. A fixed seed gives every
+    (seed, index) pair the same stream in any process, whatever order the
+    items are built in; seed -1 gives a fresh unseeded stream. The global
+    random module is never reseeded.
+    """
+    if seed == -1:
+        return random.Random()
+    # str seeds are hashed with SHA-512, independent of PYTHONHASHSEED
+    return random.Random(f"{seed}:{index}")
+
+# ========================= Endpoint Resilience =========================
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 30.0
+DEFAULT_MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+# Answers that count against the circuit breaker; the 5xx ones are also retried
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Private generator so retry jitter never disturbs seeded prompt randomization
+_retry_rng = random.Random()
+
+class TransientAPIError(Exception):
+    """
+    Failure of the server rather than of the request: it counts against the
+    endpoint's circuit breaker. Only retryable ones (the connection could not
+    be made, or a 5xx answer) are sent again; a request the server may
+    already be working on (read timeout, broken response) is not.
+    """
+    
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+def retry_backoff_delay(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff for the given retry attempt
+    """
+    return _retry_rng.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker. After failure_threshold consecutive failed
+    calls it opens and rejects calls for cooldown seconds, then lets a single
+    probe through (half-open) to decide whether to close again.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, cooldown: float = CIRCUIT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    def allow_request(self) -> bool:
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                # Let exactly one probe through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+    
+    def remaining_cooldown(self) -> float:
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+    
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (0 < self.failure_threshold <= self.failures):
+                if self.state != self.OPEN:
+                    print(f"⚠️ Circuit opened after {self.failures} failures, using offline enhancement for {self.cooldown:.0f}s")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def is_available(self) -> bool:
+        """
+        Whether a call would currently be let through, without claiming the probe
+        """
+        with self._lock:
+            return (self.failure_threshold <= 0 or self.state == self.CLOSED or
+                    (self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown))
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(endpoint: str, failure_threshold: Optional[int] = None,
+                        cooldown: Optional[float] = None) -> CircuitBreaker:
+    """
+    Shared breaker for an endpoint URL, updated with any settings passed in
+    """
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(endpoint)
+        if breaker is None:
+            breaker = _circuit_breakers[endpoint] = CircuitBreaker()
+        if failure_threshold is not None:
+            breaker.failure_threshold = failure_threshold
+        if cooldown is not None:
+            breaker.cooldown = cooldown
+        return breaker
+
+def parse_endpoint_list(api_url: str) -> List[str]:
+    """
+    Split a comma, semicolon or whitespace separated list of server URLs
+    """
+    endpoints = []
+    for endpoint in re.split(r'[\s,;]+', api_url or ''):
+        endpoint = endpoint.strip().rstrip('/')
+        if endpoint and endpoint not in endpoints:
+            endpoints.append(endpoint)
+    return endpoints
+
+class EndpointBalancer:
+    """
+    Client-side load balancer over several LLM servers. Picks the healthy
+    endpoint with the fewest outstanding requests, breaking ties by the
+    smoothed response latency. Endpoints whose circuit breaker is open are
+    ejected until their cool-down ends.
+    """
+    LATENCY_SMOOTHING = 0.3
+    
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+    
+    def _entry(self, endpoint: str) -> Dict[str, Any]:
+        entry = self._stats.get(endpoint)
+        if entry is None:
+            entry = self._stats[endpoint] = {'outstanding': 0, 'latency': 0.0, 'requests': 0, 'failures': 0}
+        return entry
+    
+    def acquire(self, endpoints: List[str], exclude: List[str] = ()) -> Optional[str]:
+        """
+        Reserve the best endpoint for one request, or None if none is healthy
+        """
+        candidates = [e for e in endpoints if e not in exclude and get_circuit_breaker(e).is_available()]
+        if not candidates:
+            return None
+        with self._lock:
+            best = min(candidates, key=lambda e: (self._entry(e)['outstanding'], self._entry(e)['latency']))
+            self._entry(best)['outstanding'] += 1
+            return best
+    
+    def release(self, endpoint: str, latency: Optional[float] = None, failed: bool = False):
+        with self._lock:
+            entry = self._entry(endpoint)
+            entry['outstanding'] = max(0, entry['outstanding'] - 1)
+            entry['requests'] += 1
+            if failed:
+                entry['failures'] += 1
+            elif latency is not None:
+                if entry['latency']:
+                    entry['latency'] += self.LATENCY_SMOOTHING * (latency - entry['latency'])
+                else:
+                    entry['latency'] = latency
+    
+    def healthy_count(self, endpoints: List[str]) -> int:
+        return sum(1 for e in endpoints if get_circuit_breaker(e).is_available())
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {endpoint: dict(entry) for endpoint, entry in self._stats.items()}
+
+_endpoint_balancer = EndpointBalancer()
+
+# ========================= Request Coalescing =========================
+class SingleFlight:
+    """
+    Lets concurrent callers with the same request key share one upstream
+    call: the first caller runs it, the others await its result. Callers
+    all run on the AsyncRuntime loop.
+    """
+    
+    def __init__(self):
+        self._calls: Dict[str, 'asyncio.Future'] = {}
+        self.executed = 0
+        self.coalesced = 0
+    
+    async def do(self, key: str, fn):
+        import asyncio
+        call = self._calls.get(key)
+        if call is not None:
+            self.coalesced += 1
+            # A follower giving up must not cancel the leader's call
+            return await asyncio.shield(call)
+        
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.executed += 1
+        try:
+            result = await fn()
+            call.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except Exception as e:
+            call.set_exception(e)
+            # Mark the error as retrieved when nobody was waiting for it
+            call.exception()
+            raise
+        finally:
+            del self._calls[key]
+    
+    def stats(self) -> Dict[str, int]:
+        return {'executed': self.executed, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
+
+_single_flight = SingleFlight()
+
+def single_flight_key(endpoints: List[str], headers: Dict[str, str], payload: Dict[str, Any]) -> str:
+    """
+    Digest of the exact request: the endpoint list, the headers and the full
+    payload, so only requests that would go to the same servers with the same
+    body are coalesced
+    """
+    canonical = json.dumps({"endpoints": list(endpoints), "headers": headers, "payload": payload},
+                           sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    import hashlib
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+# ========================= Async Runtime =========================
+class AsyncRuntime:
+    """
+    One asyncio event loop on a daemon thread that runs every LLM request.
+    Sync code submits coroutines with run(), coroutines on another event
+    loop (ComfyUI's) await them with run_async(). However many requests are
+    in flight, they all share this one thread.
+    """
+    
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    @property
+    def loop(self) -> 'asyncio.AbstractEventLoop':
+        with self._lock:
+            if self._loop is None:
+                import asyncio
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='promptbuilder-asyncio', daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+            return self._loop
+    
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+    
+    @staticmethod
+    async def _in_context(context: contextvars.Context, coro) -> Any:
+        # Carry the caller's context variables (e.g. the tags snapshot) over to the task
+        for var, value in context.items():
+            var.set(value)
+        return await coro
+    
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """
+        Run coro on the runtime loop and block until it is done
+        """
+        if self.in_loop_thread():
+            coro.close()
+            raise Exception("AsyncRuntime.run() would deadlock on the event loop thread, await the coroutine instead")
+        import asyncio
+        task = self._in_context(contextvars.copy_context(), coro)
+        return asyncio.run_coroutine_threadsafe(task, self.loop).result(timeout)
+    
+    async def run_async(self, coro) -> Any:
+        """
+        Await coro from any event loop; it runs on the runtime loop, which
+        owns the pooled connections, so the calling loop stays free
+        """
+        if self.in_loop_thread():
+            return await coro
+        import asyncio
+        task = self._in_context(contextvars.copy_context(), coro)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(task, self.loop))
+    
+    def call(self, fn: Callable, *args) -> Any:
+        """
+        Run a plain function on the loop thread
+        """
+        if self._loop is None or self.in_loop_thread():
+            return fn(*args)
+        
+        async def invoke():
+            return fn(*args)
+        return self.run(invoke())
+
+_async_runtime = AsyncRuntime()
+
+def get_async_runtime() -> AsyncRuntime:
+    """
+    Event loop shared by all nodes, started on first use
+    """
+    return _async_runtime
+
+def on_async_runtime(fn: Callable) -> Callable:
+    """
+    Decorator for coroutine methods that can be awaited from any event loop
+    (e.g. ComfyUI's): the call is moved onto the runtime loop
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await _async_runtime.run_async(fn(*args, **kwargs))
+    return wrapper
+
+def host_awaits_node_functions() -> bool:
+    """
+    Whether the ComfyUI executor loading us awaits coroutine node functions,
+    as newer versions do. PROMPTBUILDER_ASYNC_NODES=1/0 overrides the check.
+    """
+    override = os.environ.get('PROMPTBUILDER_ASYNC_NODES')
+    if override:
+        return override == '1'
+    execution = sys.modules.get('execution')
+    return execution is not None and hasattr(execution, '_async_map_node_over_list')
+
+# Nodes point FUNCTION at their async entry points on hosts that await them
+ASYNC_NODES = host_awaits_node_functions()
+
+# ========================= HTTP Connection Pools =========================
+# Keep-alive connections kept per host, and seconds an unused one stays open
+def env_number(name: str, default: float, cast: Callable = float) -> Any:
+    """
+    Numeric setting from the environment; a value that does not parse falls
+    back to the default instead of breaking the import
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"Warning: Ignoring {name}={value!r}, expected a number; using {default}")
+        return default
+
+HTTP_POOL_MAXSIZE = env_number('PROMPTBUILDER_HTTP_POOL_SIZE', MAX_BATCH_CONCURRENCY, int)
+HTTP_KEEPALIVE = env_number('PROMPTBUILDER_HTTP_KEEPALIVE', 90.0)
+HTTP_USER_AGENT = 'ComfyUI-PromptBuilder/2.0'
+
+def http_origin(url: str) -> str:
+    """
+    scheme://host[:port] of a URL, the key connection stats are kept under
+    """
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+class ConnectionPoolRegistry:
+    """
+    The aiohttp client session every node sends its requests through, so
+    TCP/TLS connections to a host are reused across requests and graph
+    executions. Its TCPConnector keeps at most maxsize connections per host
+    and closes them after keepalive idle seconds; proxies are taken from
+    HTTP(S)_PROXY/NO_PROXY. Per-host counters come from aiohttp's request
+    tracing. The session belongs to the AsyncRuntime loop. ssl is handed to
+    the connector (an SSLContext to trust a private CA); None verifies
+    against the system CAs.
+    """
+    
+    def __init__(self, maxsize: int = HTTP_POOL_MAXSIZE, keepalive: float = HTTP_KEEPALIVE, ssl: Any = None):
+        self.maxsize = maxsize
+        self.keepalive = keepalive
+        self.ssl = ssl
+        self._session = None
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+    
+    def session(self) -> 'aiohttp.ClientSession':
+        """
+        The shared session, created on first use from the runtime loop
+        """
+        if self._session is None or self._session.closed:
+            import aiohttp
+            tracing = aiohttp.TraceConfig()
+            tracing.on_request_start.append(self._on_request_start)
+            tracing.on_request_exception.append(self._on_request_exception)
+            tracing.on_connection_create_end.append(self._on_connection_created)
+            tracing.on_connection_reuseconn.append(self._on_connection_reused)
+            tls = {} if self.ssl is None else {'ssl': self.ssl}
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.maxsize, keepalive_timeout=self.keepalive, **tls)
+            self._session = aiohttp.ClientSession(connector=connector, trust_env=True, trace_configs=[tracing],
+                                                  headers={'User-Agent': HTTP_USER_AGENT})
+        return self._session
+    
+    def _count(self, origin: str, name: str):
+        with self._lock:
+            host = self._stats.setdefault(origin, {'requests': 0, 'opened': 0, 'reused': 0, 'failed': 0})
+            host[name] += 1
+    
+    # aiohttp passes one context object to every callback of the same request
+    async def _on_request_start(self, session, context, params):
+        context.origin = http_origin(str(params.url))
+        self._count(context.origin, 'requests')
+    
+    async def _on_request_exception(self, session, context, params):
+        self._count(context.origin, 'failed')
+    
+    async def _on_connection_created(self, session, context, params):
+        self._count(context.origin, 'opened')
+    
+    async def _on_connection_reused(self, session, context, params):
+        self._count(context.origin, 'reused')
+    
+    def configure(self, maxsize: Optional[int] = None, keepalive: Optional[float] = None):
+        """
+        Change the per-host limit and keep-alive; the session is rebuilt with them
+        """
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if keepalive is not None:
+            self.keepalive = keepalive
+        self.close()
+    
+    def _connector_state(self) -> Dict[str, Dict[str, int]]:
+        """
+        Connections the connector holds right now per origin: in use by a
+        request, and idle (kept alive, still connected). Runs on the loop
+        thread, which owns the connector.
+        """
+        state: Dict[str, Dict[str, int]] = {}
+        connector = self._session.connector if self._session is not None and not self._session.closed else None
+        if connector is None:
+            return state
+        
+        def origin(key) -> str:
+            scheme = 'https' if key.is_ssl else 'http'
+            host = f"[{key.host}]" if ':' in key.host else key.host
+            default_port = 443 if key.is_ssl else 80
+            return f"{scheme}://{host.lower()}" + ('' if key.port in (None, default_port) else f":{key.port}")
+        
+        # aiohttp keeps no public per-host counts, these are its pool bookkeeping
+        for key, idle in list(getattr(connector, '_conns', {}).items()):
+            host = state.setdefault(origin(key), {'in_use': 0, 'idle': 0})
+            host['idle'] += sum(1 for protocol, _ in idle if protocol.is_connected())
+        for key, acquired in list(getattr(connector, '_acquired_per_host', {}).items()):
+            state.setdefault(origin(key), {'in_use': 0, 'idle': 0})['in_use'] += len(acquired)
+        return state
+    
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Per-origin counters: requests, opened (new connections, i.e. TCP/TLS
+        handshakes), reused (requests sent on a kept-alive connection), failed;
+        and the connections held now: open = in_use + idle
+        """
+        state = get_async_runtime().call(self._connector_state)
+        with self._lock:
+            stats = {origin: dict(host) for origin, host in self._stats.items()}
+        for origin in set(stats) | set(state):
+            host = stats.setdefault(origin, {'requests': 0, 'opened': 0, 'reused': 0, 'failed': 0})
+            host.update(state.get(origin, {'in_use': 0, 'idle': 0}))
+            host['open'] = host['in_use'] + host['idle']
+        return stats
+    
+    def totals(self) -> Dict[str, int]:
+        totals = {'requests': 0, 'opened': 0, 'reused': 0, 'failed': 0, 'open': 0, 'in_use': 0, 'idle': 0}
+        for host_stats in self.stats().values():
+            for name in totals:
+                totals[name] += host_stats[name]
+        return totals
+    
+    def close(self):
+        """
+        Close the session and its connections
+        """
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            get_async_runtime().run(session.close())
+
+_connection_pools = ConnectionPoolRegistry()
+
+def get_connection_pools() -> ConnectionPoolRegistry:
+    """
+    Connection pool registry shared by all nodes
+    """
+    return _connection_pools
+
+# ========================= Prompt Prefix Caching =========================
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (about four characters per token for English text)
+    """
+    return (len(text) + 3) // 4
+
+def describe_system_prompt(system_prompt: str, budget: int = 0) -> str:
+    """
+    One-line size report for a system prompt
+    """
+    info = f"🧮 System prompt: {len(system_prompt)} chars, ~{estimate_tokens(system_prompt)} tokens"
+    return f"{info} (budget {budget})" if budget > 0 else info
+
+def extract_cached_tokens(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Number of prompt tokens the server reused from its KV cache, if reported.
+    llama.cpp returns timings.cache_n, OpenAI-style servers
+    usage.prompt_tokens_details.cached_tokens.
+    """
+    timings = data.get('timings')
+    if isinstance(timings, dict) and isinstance(timings.get('cache_n'), int):
+        return timings['cache_n']
+    usage = data.get('usage')
+    if isinstance(usage, dict):
+        details = usage.get('prompt_tokens_details')
+        if isinstance(details, dict) and isinstance(details.get('cached_tokens'), int):
+            return details['cached_tokens']
+    return None
+
+class PrefixCacheStats:
+    """
+    Running totals of the prompt tokens servers reported as served from cache
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.responses = 0
+        self.cached_tokens = 0
+    
+    def record(self, data: Dict[str, Any]):
+        cached = extract_cached_tokens(data)
+        if cached is None:
+            return
+        with self._lock:
+            self.responses += 1
+            self.cached_tokens += cached
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'responses': self.responses, 'cached_tokens': self.cached_tokens}
+
+_prefix_cache_stats = PrefixCacheStats()
+
+# ========================= Persistent LLM Response Cache =========================
+RESPONSE_CACHE_PATH = os.environ.get(
+    'PROMPTBUILDER_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'llm_responses.sqlite3')
+)
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+RESPONSE_CACHE_DEFAULT_TTL = 86400
+
+def canonical_request_key(namespace: str, model: str, messages: List[Dict[str, str]],
+                          temperature: float, max_tokens: int) -> str:
+    """
+    Stable digest of everything that determines an LLM response
+    """
+    canonical = json.dumps({
+        "namespace": namespace,
+        "model": model,
+        "messages": [{"role": m.get("role", ""), "content": m.get("content", "")} for m in messages],
+        "temperature": round(float(temperature), 4),
+        "max_tokens": int(max_tokens)
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    import hashlib
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class LLMResponseCache:
+    """
+    SQLite (WAL) response cache shared by every ComfyUI process on the host.
+    Entries expire after their TTL; the least recently used entries are
+    evicted once the cache grows past max_entries.
+    """
+    
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.enabled = True
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+    
+    def _connection(self) -> 'sqlite3.Connection':
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL, expires REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+            self._local.conn = conn
+        return conn
+    
+    def _disable(self, error: Exception):
+        print(f"Warning: LLM response cache disabled ({self.path}): {error}")
+        self.enabled = False
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return the cached response for key, or None on a miss
+        """
+        if not self.enabled:
+            return None
+        import sqlite3
+        now = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT response, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and (row[1] is None or row[1] > now):
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                with self._lock:
+                    self.hits += 1
+                return row[0]
+            if row:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key: str, response: str, ttl: Optional[float] = RESPONSE_CACHE_DEFAULT_TTL):
+        """
+        Store a response; ttl of None or 0 keeps it until evicted
+        """
+        if not self.enabled:
+            return
+        import sqlite3
+        now = time.time()
+        expires = now + ttl if ttl else None
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, last_access, expires) VALUES (?, ?, ?, ?, ?)",
+                (key, response, now, now, expires)
+            )
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % 50 == 1
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            self._disable(e)
+    
+    async def get_async(self, key: str) -> Optional[str]:
+        """
+        get() on a worker thread, so a busy database (another process
+        holding the write lock) never stalls the event loop
+        """
+        import asyncio
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+    
+    async def put_async(self, key: str, response: str, ttl: Optional[float] = RESPONSE_CACHE_DEFAULT_TTL):
+        """
+        put() on a worker thread
+        """
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(None, self.put, key, response, ttl)
+    
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones over the size bound
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+    
+    def clear(self):
+        if self.enabled:
+            self._connection().execute("DELETE FROM responses")
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss counters for this process plus the shared entry count
+        """
+        entries = 0
+        if self.enabled:
+            import sqlite3
+            try:
+                entries = self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            except sqlite3.Error:
+                pass
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'path': self.path
+        }
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache() -> LLMResponseCache:
+    """
+    Process-wide response cache, created on first use
+    """
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = LLMResponseCache()
+        return _response_cache
+
+# ========================= In-Memory Result Cache =========================
+RESULT_CACHE_MAX_ENTRIES = 1024
+RESULT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+RESULT_CACHE_DEFAULT_TTL = None
+# Options that change how a result is fetched, never what it is
+RESULT_CACHE_IGNORED_OPTIONS = frozenset({
+    'api_key', 'use_cache', 'result_cache', 'response_cache', 'response_cache_ttl', 'coalesce_requests',
+    'stream_response', 'stream_early_stop', 'connect_timeout', 'read_timeout', 'max_retries',
+    'circuit_breaker_threshold', 'circuit_breaker_cooldown', 'max_concurrency', 'parallel_processing'
+})
+
+def _canonical_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(k): _canonical_value(v) for k, v in value.items() if k not in RESULT_CACHE_IGNORED_OPTIONS}
+    if isinstance(value, (list, tuple)):
+        return [_canonical_value(v) for v in value]
+    if isinstance(value, float):
+        return round(value, 6)
+    if value is None or isinstance(value, (str, int, bool)):
+        return value
+    return repr(value)
+
+def canonical_result_key(namespace: str, inputs: Dict[str, Any]) -> str:
+    """
+    Stable digest of a generation request: keys sorted, floats rounded,
+    transport-only options dropped, so equivalent requests share a key in
+    any process
+    """
+    canonical = json.dumps({"namespace": namespace, "inputs": _canonical_value(inputs)},
+                           sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    import hashlib
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _result_nbytes(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (list, tuple)):
+        return sum(_result_nbytes(v) for v in value)
+    return len(repr(value))
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of finished prompts, bounded by entry count and
+    by the UTF-8 size of keys and values. Entries may carry a TTL.
+    """
+    
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 ttl: Optional[float] = RESULT_CACHE_DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        # key -> (value, size, expires)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Any:
+        """
+        Return the cached value for key, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Store a value; ttl defaults to the cache TTL, None or 0 keeps it until evicted
+        """
+        ttl = self.ttl if ttl is None else ttl
+        size = len(key) + _result_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self._entries[key] = (value, size, time.monotonic() + ttl if ttl else None)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def _discard(self, key: str):
+        self.bytes -= self._entries.pop(key)[1]
+    
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Size, bounds and hit/miss counters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions
+            }
+
+_result_cache = ResultCache()
+
+def get_result_cache() -> ResultCache:
+    """
+    Result cache shared by every node and generation path in the process
+    """
+    return _result_cache
+
+# Marks prompts built without the LLM, see complete_prompt_request
+LLM_OFFLINE_PREFIX = "⚠️ LLM Offline - Advanced Enhancement: "
+
+def is_cacheable_result(result: Tuple[str, ...]) -> bool:
+    """
+    Errors and offline fallbacks are not cached, so the next call tries the LLM again
+    """
+    return not (result[0].startswith("❌") or result[2].startswith(LLM_OFFLINE_PREFIX))
+
+# ========================= Advanced JSON Parsing Functions =========================
+_JSON_CONTAINER_START = re.compile(r'[\{\[]')
+_JSON_STRUCTURE = re.compile(r'[\{\}\[\]"\',]')
+_BARE_JSON_KEY = re.compile(r'\s*([A-Za-z_][A-Za-z0-9_]*)\s*:')
+
+def scan_json_candidates(text: str) -> Tuple[List[Tuple[str, str]], int]:
+    """
+    Single linear pass over text that collects every balanced top-level
+    JSON object or array as (raw, repaired). Strings (double or single
+    quoted) are skipped as a whole, so brackets inside them do not count.
+    The repaired copy is built during the same pass: single-quoted strings
+    become double-quoted, bare keys get quotes and trailing commas before
+    a closing bracket are dropped.
+    Also returns the offset of a top-level container that never closes
+    (truncated output), or -1.
+    """
+    candidates = []
+    n = len(text)
+    i = 0
+    stack = []
+    out = []
+    start = -1
+    
+    while i < n:
+        if not stack:
+            match = _JSON_CONTAINER_START.search(text, i)
+            if not match:
+                break
+            i = start = match.start()
+            out = []
+        
+        match = _JSON_STRUCTURE.search(text, i)
+        if not match:
+            break
+        if match.start() > i:
+            out.append(text[i:match.start()])
+            i = match.start()
+        ch = text[i]
+        i += 1
+        
+        if ch == '{' or ch == '[':
+            stack.append(ch)
+            out.append(ch)
+        elif ch == '}' or ch == ']':
+            # Drop a trailing comma (and the whitespace after it)
+            j = len(out)
+            while j and out[j - 1].isspace():
+                j -= 1
+            if j and out[j - 1] == ',':
+                del out[j - 1:]
+            out.append(ch)
+            stack.pop()
+            if not stack:
+                candidates.append((text[start:i], ''.join(out)))
+            continue
+        elif ch == ',':
+            out.append(ch)
+        else:
+            # Jump to the closing quote that is not escaped
+            j = i
+            while True:
+                j = text.find(ch, j)
+                if j == -1:
+                    j = n
+                    break
+                k = j - 1
+                while k >= i and text[k] == '\\':
+                    k -= 1
+                if (j - 1 - k) % 2 == 0:
+                    break
+                j += 1
+            body = text[i:j]
+            if ch == "'":
+                body = body.replace("\\'", "'").replace('"', '\\"')
+            out.append(f'"{body}"')
+            i = j + 1
+            continue
+        
+        # Quote a bare key at the start of an object member
+        if stack[-1] == '{':
+            match = _BARE_JSON_KEY.match(text, i)
+            if match:
+                out.append(f'"{match.group(1)}":')
+                i = match.end()
+    
+    return candidates, (start if stack else -1)
+
+def _load_json_candidate(raw: str, repaired: str) -> Any:
+    # Without a single quoted string this cannot be a useful object or array
+    if '"' not in repaired:
+        return None
+    for candidate in ((raw, repaired) if raw != repaired else (raw,)):
+        try:
+            # strict=False accepts raw newlines inside strings
+            return json.loads(candidate, strict=False)
+        except (ValueError, RecursionError):
+            continue
+    return None
+
+def parse_llama_json_response(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Extract the prompt object from an LLM response: the whole text if it is
+    JSON, otherwise the first JSON object found by scan_json_candidates
+    (code fences and surrounding prose are skipped naturally). A bare JSON
+    array comes back as {"structuredPrompts": [...]}.
+    """
+    if not text or not isinstance(text, str):
+        return None
+    
+    cleaned_text = text.strip()
+    
+    try:
+        parsed = json.loads(cleaned_text)
+        if parsed and isinstance(parsed, dict):
+            return parsed
+    except (ValueError, RecursionError):
+        pass
+    
+    candidates, unclosed = scan_json_candidates(cleaned_text)
+    if unclosed >= 0:
+        # Truncated outer container: look for complete objects inside it
+        candidates += scan_json_candidates(cleaned_text[unclosed + 1:])[0]
+    
+    first_array = None
+    for raw, repaired in candidates:
+        parsed = _load_json_candidate(raw, repaired)
+        if parsed and isinstance(parsed, dict):
+            return parsed
+        if isinstance(parsed, list) and first_array is None:
+            first_array = parsed
+    
+    if first_array is not None:
+        return {"structuredPrompts": first_array}
+    return None
+
+class PartialResponse(str):
+    """
+    Text of a stream that ended early (cut off without [DONE], interrupted
+    or aborted as runaway). It is used like any answer but never stored in
+    the response cache.
+    """
+
+class StreamingPromptParser:
+    """
+    Incremental parser for a streamed prompt object. feed() takes text
+    chunks as they arrive and returns the top-level string fields
+    (positive, negative, enhanced_description, ...) whose values closed in
+    that chunk. Once the outer object closes, complete is set so the caller
+    can stop reading the stream. Text before the object (prose, code
+    fences) is skipped; a response that starts with an array is ignored.
+    """
+    
+    def __init__(self, on_field: Optional[Callable[[str, str], None]] = None):
+        self.on_field = on_field
+        self.fields: Dict[str, str] = {}
+        self.complete = False
+        self.ignored = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+        self._key: Optional[str] = None
+        self._expect = 'key'
+    
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        closed = []
+        for ch in chunk:
+            if self.complete or self.ignored:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._close_string(closed)
+                    continue
+                if self._depth == 1:
+                    self._buffer.append(ch)
+                continue
+            
+            if self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                    self._expect = 'key'
+                elif ch == '[':
+                    self.ignored = True
+                continue
+            
+            if ch == '"':
+                self._in_string = True
+                self._buffer = []
+            elif ch == '{' or ch == '[':
+                self._depth += 1
+            elif ch == '}' or ch == ']':
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = True
+            elif self._depth == 1:
+                if ch == ':':
+                    self._expect = 'value'
+                elif ch == ',':
+                    self._expect = 'key'
+        return closed
+    
+    def _close_string(self, closed: List[Tuple[str, str]]):
+        raw = ''.join(self._buffer)
+        try:
+            text = json.loads(f'"{raw}"', strict=False)
+        except ValueError:
+            text = raw
+        if self._expect == 'key':
+            self._key = text
+            return
+        if self._key is not None:
+            self.fields[self._key] = text
+            closed.append((self._key, text))
+            if self.on_field:
+                self.on_field(self._key, text)
+        self._key = None
+        self._expect = 'done'
+
+# ========================= Structured Output =========================
+PROMPT_FIELDS = ('positive', 'negative', 'enhanced_description')
+
+PROMPT_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {field: {"type": "string", "minLength": 1} for field in PROMPT_FIELDS},
+    "required": list(PROMPT_FIELDS),
+    "additionalProperties": False
+}
+
+PROMPT_GBNF_RULES = r"""prompt ::= "{" ws "\"positive\"" ws ":" ws string "," ws "\"negative\"" ws ":" ws string "," ws "\"enhanced_description\"" ws ":" ws string ws "}"
+string ::= "\"" char+ "\""
+char ::= [^"\\\x00-\x1f] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F])
+ws ::= [ \t\n]{0,20}"""
+
+def build_prompt_grammar(count: int = 1) -> str:
+    """
+    GBNF grammar (llama.cpp) for one prompt object, or an array of exactly
+    count prompt objects
+    """
+    if count <= 1:
+        root = "root ::= ws prompt ws"
+    else:
+        root = 'root ::= ws "[" ws prompt' + ' "," ws prompt' * (count - 1) + ' ws "]" ws'
+    return f"{root}\n{PROMPT_GBNF_RULES}"
+
+def build_prompt_response_format(count: int = 1) -> Dict[str, Any]:
+    """
+    OpenAI-style json_schema response_format for one prompt object, or an
+    object wrapping an array of exactly count prompt objects
+    """
+    schema = PROMPT_JSON_SCHEMA
+    if count > 1:
+        schema = {
+            "type": "object",
+            "properties": {
+                "prompts": {"type": "array", "items": PROMPT_JSON_SCHEMA, "minItems": count, "maxItems": count}
+            },
+            "required": ["prompts"],
+            "additionalProperties": False
+        }
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "image_prompts" if count > 1 else "image_prompt", "strict": True, "schema": schema}
+    }
+
+def structured_output_payload(mode: str, count: int = 1) -> Dict[str, Any]:
+    """
+    Extra request fields that constrain the model to the prompt JSON shape
+    """
+    if mode == 'json_schema':
+        return {"response_format": build_prompt_response_format(count)}
+    if mode == 'gbnf':
+        return {"grammar": build_prompt_grammar(count)}
+    return {}
+
+def parse_structured_prompt_response(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a schema-constrained response with a single json.loads.
+    Returns None unless all prompt fields are present as strings.
+    """
+    try:
+        parsed = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(parsed, dict) or not all(isinstance(parsed.get(field), str) for field in PROMPT_FIELDS):
+        return None
+    if not parsed['positive'].strip():
+        return None
+    return parsed
+
+# Largest max_tokens sent with one packed request
+MULTI_PROMPT_MAX_TOKENS = 8192
+
+MULTI_PROMPT_INSTRUCTIONS = """
+
+BATCH MODE: The user message contains {count} numbered descriptions. Return a JSON array with exactly {count} objects, in the same order, each shaped like the object above ("positive", "negative", "enhanced_description"). Return only the array."""
+
+def parse_multi_prompt_response(text: str, count: int) -> List[Optional[Dict[str, Any]]]:
+    """
+    Extract up to count prompt objects from a JSON array response.
+    Entries that are missing or malformed come back as None.
+    """
+    entries = None
+    if text and isinstance(text, str):
+        candidates = [text.strip()]
+        json_block_match = re.search(r'```(?:json)?\s*([\s\S]*?)```', text)
+        if json_block_match:
+            candidates.append(json_block_match.group(1).strip())
+        start, end = text.find('['), text.rfind(']')
+        if 0 <= start < end:
+            candidates.append(text[start:end + 1])
+        
+        for candidate in candidates:
+            try:
+                parsed = json.loads(candidate)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(parsed, dict):
+                # Wrapped array such as {"prompts": [...]}
+                parsed = next((value for value in parsed.values() if isinstance(value, list)), None)
+            if isinstance(parsed, list):
+                entries = parsed
+                break
+        
+        if entries is None:
+            parsed = parse_llama_json_response(text)
+            if parsed and isinstance(parsed.get('structuredPrompts'), list):
+                entries = parsed['structuredPrompts']
+            elif parsed:
+                entries = [parsed]
+    
+    results = []
+    for i in range(count):
+        entry = entries[i] if entries and i < len(entries) else None
+        if isinstance(entry, dict) and isinstance(entry.get('positive'), str) and entry['positive'].strip():
+            results.append(entry)
+        else:
+            results.append(None)
+    return results
+
+# ========================= Keyword Extraction =========================
+# Keywords per prompt element, in the order they were listed in the original
+# per-element regexes: at any position the first listed keyword wins
+ELEMENT_KEYWORDS = {
+    'subject': ('young woman', 'woman', 'man', 'person', 'girl', 'boy', 'female', 'male', 'figure', 'character'),
+    'clothing': ('string thong', 'string top', 'nipple tape', 'shoulder strap', 'clothing', 'wearing', 'dressed in',
+                 'outfit', 'attire', 'garment', 'bikini', 'lingerie', 'swimsuit'),
+    'pose': ('squats', 'squatting', 'reclines', 'leaning', 'standing', 'sitting', 'lying', 'kneeling', 'bending',
+             'stretching', 'posing', 'position', 'posture', 'gesture'),
+    'location': ('campfire', 'sauna', 'wood-paneled', 'cozy scene', 'environment', 'setting', 'background',
+                 'behind her', 'room', 'place', 'location', 'surroundings'),
+    'lighting': ('warm golden light', 'golden light', 'lighting', 'light', 'shadows', 'highlighting', 'sheen',
+                 'illuminated', 'glow', 'sunlight', 'moonlight', 'ambient light', 'dramatic lighting'),
+    'mood': ('joyful', 'playful', 'relaxed', 'confident', 'sensual', 'intimate', 'comfortable', 'warmth', 'laughter',
+             'enjoyment', 'happiness', 'pleasure', 'content', 'serene', 'peaceful', 'excited'),
+    'details': ('radiating', 'playful', 'provocatively', 'subtle', 'sensuality', 'cozy', 'delicate', 'sweet',
+                'realistic', 'intimate', 'vivid', 'dynamic', 'expressive', 'natural', 'organic', 'fluid')
+}
+# A subject keyword only counts when followed by one of these
+SUBJECT_KEYWORD_SUFFIX = re.compile(r'(?: with|,| who| that| \(|\s+|$)', re.IGNORECASE)
+# Whole words (split on whitespace) added to the details
+DESCRIPTIVE_WORDS = (
+    'radiating', 'playful', 'provocatively', 'relaxed', 'subtle', 'confident',
+    'sensuality', 'cozy', 'delicate', 'sweet', 'realistic', 'intimate', 'comfortable',
+    'vivid', 'dynamic', 'expressive', 'natural', 'organic', 'fluid', 'graceful',
+    'elegant', 'powerful', 'soft', 'gentle', 'strong', 'feminine', 'masculine',
+    'youthful', 'mature', 'energetic', 'calm', 'serene', 'peaceful', 'intense'
+)
+# Keywords that add fixed elements when any of them occurs
+DETAIL_KEYWORDS = {
+    'squatting': ('squats', 'squatting', 'low position', 'crouching'),
+    'campfire': ('campfire', 'firelight', 'fire glow', 'bonfire'),
+    'sauna': ('sauna', 'steam room', 'hot room', 'wooden sauna'),
+    'golden_light': ('golden light', 'warm light', 'sunset glow', 'golden hour'),
+    'skin': ('skin texture', 'skin details', 'pore details', 'skin sheen', 'skin glow'),
+    'hair': ('hair flow', 'hair details', 'strands of hair', 'hair movement'),
+    'eyes': ('eye details', 'sparkling eyes', 'expressive eyes', 'eye color'),
+    'environment': ('wood-paneled', 'cozy', 'warm', 'intimate', 'comfortable', 'relaxing')
+}
+DETAIL_ELEMENTS = {
+    'squatting': (('pose', 'squatting pose'),),
+    'campfire': (('location', 'around campfire'), ('lighting', 'firelight glow')),
+    'sauna': (('location', 'in sauna'), ('background', 'steamy atmosphere')),
+    'golden_light': (('lighting', 'golden hour lighting'), ('mood', 'warm atmosphere')),
+    'skin': (('details', 'detailed skin texture'), ('details', 'skin pores visible')),
+    'hair': (('details', 'detailed hair strands'), ('details', 'hair movement')),
+    'eyes': (('details', 'expressive eyes'), ('details', 'detailed eye reflection'))
+}
+# Characters re.IGNORECASE matches to ASCII letters although str.lower() does not
+# map them there; U+0130 is also the only character whose lower() is longer
+_IGNORECASE_FOLD = str.maketrans({'İ': 'i', 'ı': 'i', 'ſ': 's', 'K': 'k'})
+
+def keyword_trie_pattern(keywords: List[str]) -> str:
+    """
+    Regex matching the longest of the keywords at a position, factored as a
+    trie so the regex engine branches once per character instead of trying
+    every keyword
+    """
+    trie: Dict[str, Any] = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def emit(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + emit(node[char]) for char in sorted(node) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        # Longer continuations are tried before stopping here, so the longest keyword wins
+        return '(?:' + '|'.join(branches) + (')?' if '' in node else ')')
+    
+    return emit(trie)
+
+class KeywordMatcher:
+    """
+    Finds the keywords of several groups in one pass over the text. A single
+    regex reports, at each position where any keyword starts, the longest
+    keyword there; the other keywords starting at that position are its
+    prefixes, which are precomputed. Per group the result is what re.findall
+    over the group's alternation would return (case-insensitive,
+    non-overlapping, left to right, first listed keyword wins).
+    """
+    
+    def __init__(self, groups: Dict[str, Tuple[str, ...]], suffixes: Optional[Dict[str, Any]] = None):
+        self.groups = groups
+        self.suffixes = suffixes or {}
+        keywords = sorted({keyword for group in groups.values() for keyword in group})
+        self._pattern = re.compile('(?=(' + keyword_trie_pattern(keywords) + '))')
+        # Longest keyword -> (group, length, suffix) for every keyword it starts with, first listed first
+        self._hits: Dict[str, List[Tuple[str, int, Any]]] = {}
+        for keyword in keywords:
+            hits = []
+            for name, group in groups.items():
+                ranked = sorted((rank, other) for rank, other in enumerate(group) if keyword.startswith(other))
+                hits.extend((name, len(other), self.suffixes.get(name)) for rank, other in ranked)
+            self._hits[keyword] = hits
+    
+    def find_spans(self, text: str) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        (start, end) of every keyword match per group
+        """
+        spans: Dict[str, List[Tuple[int, int]]] = {name: [] for name in self.groups}
+        resume = dict.fromkeys(self.groups, 0)
+        for match in self._pattern.finditer(text.translate(_IGNORECASE_FOLD).lower()):
+            start = match.start()
+            for name, length, suffix in self._hits[match.group(1)]:
+                if start < resume[name]:
+                    continue
+                end = start + length
+                if suffix is None:
+                    resume[name] = end
+                else:
+                    tail = suffix.match(text, end)
+                    if tail is None:
+                        continue
+                    resume[name] = tail.end()
+                spans[name].append((start, end))
+        return spans
+
+@functools.lru_cache(maxsize=None)
+def get_element_matcher() -> KeywordMatcher:
+    """
+    Matcher for the element and detail keywords, compiled on first use
+    """
+    return KeywordMatcher({**ELEMENT_KEYWORDS, **DETAIL_KEYWORDS}, {'subject': SUBJECT_KEYWORD_SUFFIX})
+
+def extract_prompt_elements(description: str) -> Dict[str, List[str]]:
+    """
+    Key elements of a rich description, by category, for prompt building
+    without an LLM
+    """
+    elements: Dict[str, List[str]] = {
+        'subject': [], 'attributes': [], 'clothing': [], 'pose': [], 'action': [],
+        'location': [], 'background': [], 'lighting': [], 'mood': [], 'details': []
+    }
+    spans = get_element_matcher().find_spans(description)
+    for category in ELEMENT_KEYWORDS:
+        elements[category].extend(description[start:end].lower() for start, end in spans[category])
+    
+    words = description.lower().split()
+    word_set = set(words)
+    for word in DESCRIPTIVE_WORDS:
+        if word in word_set and word not in elements['details']:
+            elements['details'].append(word)
+    
+    for detail_type in DETAIL_KEYWORDS:
+        if not spans[detail_type]:
+            continue
+        if detail_type == 'environment':
+            for start, end in spans[detail_type]:
+                if description[start:end] not in elements['location']:
+                    elements['location'].append(description[start:end])
+        else:
+            for category, element in DETAIL_ELEMENTS[detail_type]:
+                elements[category].append(element)
+    
+    # If no subject found, take the beginning of the description
+    if not elements['subject'] and len(words) > 2:
+        elements['subject'].append(' '.join(words[:3]))
+    return elements
+
+# ========================= Offline Enhancement =========================
+# Batches are split across worker processes only when every worker gets at least this many descriptions
+ENHANCE_BATCH_MIN_PER_PROCESS = 500
+
+def element_prompt_parts(elements: Dict[str, List[str]], description: str) -> List[str]:
+    """
+    Prompt parts describing the elements extracted from a description
+    """
+    prompt_parts = []
+    
+    # Subject with detailed attributes
+    if elements['subject']:
+        subject = elements['subject'][0]
+        if elements['details']:
+            prompt_parts.append(f"{', '.join(elements['details'][:5])} {subject}")
+        else:
+            prompt_parts.append(subject)
+    elif description.strip():  # Use the original description if no subject extracted
+        prompt_parts.append(description.strip())
+    
+    # Pose and action with more details
+    if elements['pose']:
+        pose_desc = ', '.join(elements['pose'][:3])
+        prompt_parts.append(f"{pose_desc} pose")
+    
+    # Location and background with context
+    if elements['location']:
+        location_desc = ', '.join(elements['location'][:3])
+        prompt_parts.append(f"in {location_desc}")
+    
+    # Lighting and mood with atmosphere
+    if elements['lighting']:
+        lighting_desc = ', '.join(elements['lighting'][:3])
+        prompt_parts.append(f"with {lighting_desc}")
+    
+    if elements['mood']:
+        mood_desc = ', '.join(elements['mood'][:3])
+        prompt_parts.append(f"{mood_desc} atmosphere")
+    
+    # Additional descriptive details
+    if elements['details'] and len(elements['details']) > 5:
+        extra_details = ', '.join(elements['details'][5:8])
+        prompt_parts.append(extra_details)
+    
+    return prompt_parts
+
+def enhancement_tail_parts(style_main: str, style_sub: str, **kwargs) -> Tuple[List[str], List[str]]:
+    """
+    Style, NSFW and quality parts that follow the description in every
+    offline prompt, and the NSFW or hardcore elements among them
+    """
+    prompt_parts = []
+    
+    # Style-specific enhancements with more variety
+    if style_main == 'realistic':
+        prompt_parts.extend([
+            'photorealistic', 'high detail', 'sharp focus', 'professional photography',
+            'ultra detailed', 'intricate details', 'texture details', 'realistic shadows',
+            'accurate proportions', 'natural lighting', 'professional composition'
+        ])
+        if style_sub != 'any':
+            prompt_parts.append(style_sub + ' photography')
+    elif style_main == 'anime':
+        anime_style = kwargs.get('anime_style', 'ghibli')
+        prompt_parts.extend([
+            f'{anime_style} anime style', 'detailed', 'high quality', 'expressive',
+            'vibrant colors', 'clean lines', 'anime aesthetic', 'character design',
+            'expressive features', 'dynamic posing', 'anime art'
+        ])
+    
+    # NSFW enhancements based on mode and intensity
+    nsfw_mode = kwargs.get('nsfw_mode', 'off')
+    nsfw_level = kwargs.get('nsfw_level', 5)
+    hardcore_level = kwargs.get('hardcore_level', 5)
+    
+    if nsfw_mode == "nsfw":
+        # NSFW nudity and suggestive elements based on intensity level
+        nsfw_elements = []
+        if nsfw_level >= 1:
+            nsfw_elements.extend(['nude', 'naked', 'bare skin', 'exposed'])
+        if nsfw_level >= 3:
+            nsfw_elements.extend(['sensual', 'suggestive pose', 'alluring', 'revealing'])
+        if nsfw_level >= 5:
+            nsfw_elements.extend(['provocative', 'seductive', 'enticing', 'erotic'])
+        if nsfw_level >= 7:
+            nsfw_elements.extend(['tempting', 'captivating', 'mesmerizing', 'voluptuous'])
+        if nsfw_level >= 9:
+            nsfw_elements.extend(['intoxicating', 'ravishing', 'beguiling', 'luscious'])
+        
+        prompt_parts.extend(nsfw_elements)
+        
+    elif nsfw_mode == "hardcore":
+        # Hardcore sexual elements based on intensity level
+        hardcore_elements = []
+        if hardcore_level >= 1:
+            hardcore_elements.extend(['sexual', 'intimate', 'passionate', 'explicit content'])
+        if hardcore_level >= 3:
+            hardcore_elements.extend(['masturbation', 'self-pleasure', 'touching herself', 'touching himself', 'sexual stimulation'])
+        if hardcore_level >= 5:
+            hardcore_elements.extend(['explicit sexual activities', 'detailed intimate interactions', 'graphic sexual descriptions', 'intense passion', 'sexual intercourse', 'penetration', 'orgasm', 'climax', 'sexual positions', 'sexual acts'])
+        if hardcore_level >= 7:
+            hardcore_elements.extend(['very explicit content', 'graphic sexual activities', 'detailed intimate scenarios', 'wild passion', 'multiple sexual positions', 'group activities', 'BDSM elements', 'fetish content'])
+        if hardcore_level >= 9:
+            hardcore_elements.extend(['maximum explicit content', 'full graphic sexual details', 'complete intimate scenarios', 'ultimate sexual intensity', 'extreme hardcore acts', 'all sexual taboos', 'no restrictions'])
+        
+        prompt_parts.extend(hardcore_elements)
+    
+    # Enhanced quality tags
+    quality_tags = [
+        'masterpiece', 'best quality', '8k', 'ultra detailed', 'high resolution',
+        'professional art', 'award winning', 'trending on artstation', 'unreal engine',
+        'octane render', 'concept art', 'digital painting', 'illustration'
+    ]
+    prompt_parts.extend(quality_tags)
+    
+    if nsfw_mode == "nsfw":
+        return prompt_parts, nsfw_elements
+    if nsfw_mode == "hardcore":
+        return prompt_parts, hardcore_elements
+    return prompt_parts, []
+
+def finalize_enhanced_prompt(enhanced_prompt: str) -> str:
+    """
+    Pad short prompts with generic detail tags and drop repeated parts
+    """
+    # Ensure the prompt is rich and detailed
+    if len(enhanced_prompt.split(',')) < 12:
+        # Add more descriptive elements focusing on details and quality
+        additional_enhancements = [
+            'detailed background', 'intricate details', 'texture details',
+            'depth of field', 'cinematic lighting', 'dynamic composition',
+            'professional shot', 'sharp details', 'high contrast', 'vivid colors',
+            'atmospheric effects', 'environmental details', 'focus on subject'
+        ]
+        enhanced_prompt += ', ' + ', '.join(additional_enhancements)
+    
+    # Remove any duplicate phrases while preserving order
+    seen = set()
+    unique_parts = []
+    for part in enhanced_prompt.split(', '):
+        if part not in seen:
+            seen.add(part)
+            unique_parts.append(part)
+    
+    return ', '.join(unique_parts)
+
+def _enhance_prompts_chunk(descriptions: List[str], settings: Tuple[str, str, Dict[str, Any]]) -> List[str]:
+    style_main, style_sub, kwargs = settings
+    tail_parts, _ = enhancement_tail_parts(style_main, style_sub, **kwargs)
+    prompts = []
+    for description in descriptions:
+        prompt_parts = element_prompt_parts(extract_prompt_elements(description), description) + tail_parts
+        prompts.append(finalize_enhanced_prompt(', '.join([part for part in prompt_parts if part])))
+    return prompts
+
+def enhance_prompts_batch(descriptions: List[str], style_main: str, style_sub: str,
+                          processes: int = 1, **kwargs) -> List[str]:
+    """
+    Offline enhancement of many descriptions, equal to calling
+    enhance_prompt_advanced on each. The style, NSFW and quality parts are
+    built once and the keyword matcher is shared. With processes > 1 (0 = one
+    per CPU) large batches are split across spawned worker processes.
+    """
+    descriptions = list(descriptions)
+    if processes == 0:
+        processes = os.cpu_count() or 1
+    workers = min(processes, len(descriptions) // ENHANCE_BATCH_MIN_PER_PROCESS)
+    settings = (style_main, style_sub, kwargs)
+    if workers <= 1:
+        return _enhance_prompts_chunk(descriptions, settings)
+    
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    # A few chunks per worker even out descriptions of different lengths
+    size = -(-len(descriptions) // (workers * 4))
+    chunks = [descriptions[i:i + size] for i in range(0, len(descriptions), size)]
+    # Spawned workers only import this module; forking a ComfyUI process with live threads is not safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = list(executor.map(_enhance_prompts_chunk, chunks, [settings] * len(chunks)))
+    return [prompt for chunk in results for prompt in chunk]
+
+# ========================= System Prompt Building Blocks =========================
+REALISTIC_STYLE_GUIDANCE = "Focus on photorealistic, detailed descriptions. Include professional photography terms like depth of field, bokeh, natural lighting, studio lighting, three-point lighting, 85mm f/1.8 lens, high dynamic range, sharp focus, shallow depth of field, golden hour lighting, blue hour, rim lighting, backlighting, side lighting, soft shadows, harsh shadows, overcast lighting, direct flash, bounce flash, fill light, key light, hair light, catchlights in eyes, lens flare, chromatic aberration, film grain, noise reduction, high ISO, low ISO, fast shutter speed, slow shutter speed, motion blur, image stabilization, white balance, color temperature, saturation, contrast, vibrancy, clarity, dehaze, vignetting, perspective distortion, focal length, aperture, f-stop, exposure compensation, metering mode, center-weighted, spot metering, evaluative metering, histogram, dynamic range, highlight recovery, shadow detail, black point, white point, midtones, curves adjustment, levels adjustment, color grading, split toning, HSL adjustments, sharpening, noise reduction, lens correction, profile correction, distortion correction, chromatic aberration correction, vignette correction, perspective correction, crop factor, full frame, APS-C, medium format, large format, prime lens, zoom lens, telephoto lens, wide-angle lens, fisheye lens, macro lens, tilt-shift lens, image sensor, CMOS, CCD, Bayer filter, anti-aliasing filter, low-pass filter, optical low-pass filter, image processor, RAW format, JPEG compression, lossless compression, bit depth, color space, sRGB, Adobe RGB, ProPhoto RGB, gamut, color management, ICC profile, monitor calibration, printer calibration, soft proofing, hard proofing, print resolution, DPI, PPI, interpolation, resampling, upscaling, downscaling, aliasing, moiré, compression artifacts, banding, posterization, dithering, color cast, color shift, white balance shift, exposure shift, contrast shift, saturation shift, vibrancy shift, clarity shift, dehaze shift, vignetting shift, perspective shift, distortion shift, chromatic aberration shift, lens flare shift, motion blur shift, focus shift, depth of field shift, bokeh shift, sharpness shift, noise shift, grain shift, texture shift, detail shift, dynamic range shift, highlight shift, shadow shift, midtone shift, black point shift, white point shift, curves shift, levels shift, color grading shift, split toning shift, HSL shift, sharpening shift, noise reduction shift, lens correction shift, profile correction shift, distortion correction shift, chromatic aberration correction shift, vignette correction shift, perspective correction shift, crop shift, format shift, sensor shift, processor shift, format conversion, color space conversion, gamut conversion, profile conversion, calibration shift, proofing shift, resolution shift, DPI shift, PPI shift, interpolation shift, resampling shift, upscaling shift, downscaling shift, aliasing shift, moiré shift, compression artifacts shift, banding shift, posterization shift, dithering shift, color cast shift, color shift shift."
+
+PROMPT_JSON_FORMAT = """Return a JSON object with:
+{
+    "positive": "detailed positive prompt",
+    "negative": "negative prompt elements",
+    "enhanced_description": "enhanced scene description"
+}"""
+
+# Character constraint functions for local model
+def get_body_type_description(gender: str, body_type: str) -> str:
+    if gender == 'female':
+        if body_type == 'slim': return 'The subject must have a slim build, slender figure, and petite frame.'
+        if body_type == 'curvy': return 'The subject must have a curvy figure with an hourglass shape, wide hips, and a voluptuous body.'
+        if body_type == 'athletic': return 'The subject must have an athletic build with a toned body, defined muscles, and a fit physique.'
+        if body_type == 'instagram model': return 'The subject must have an "instagram model" physique: a slim-thick, surgically enhanced look with an exaggerated hourglass figure and an impossibly small waist.'
+    elif gender == 'male':
+        if body_type == 'slim': return 'The subject must have a slim build, a lean physique, and a slender frame.'
+        if body_type == 'fat': return 'The subject must have a heavy-set, plus-size male build, such as a "dad bod" or a chubby, overweight frame with a large belly.'
+        if body_type == 'muscular': return 'The subject must have a muscular, athletic body with toned muscles and a well-defined physique (like a movie star).'
+        if body_type == 'big muscular': return 'The subject must have a hypermuscular bodybuilder physique with huge, massive, bulging muscles.'
+    return ''
+
+def get_ethnicity_description(ethnicity: str) -> str:
+    if ethnicity == 'any': return ''
+    return f"The subject's ethnicity MUST be {ethnicity}. This is a strict, non-negotiable requirement."
+
+def get_height_description(height: str) -> str:
+    if height == 'any': return ''
+    description = height.replace('\s*\(.+\\)', '')
+    return f"The subject's height MUST be in the '{description}' range. For reference: {height}. This is a strict physical trait."
+
+def get_breast_size_description(size: str) -> str:
+    if size == 'any': return ''
+    return f"As a key physical attribute, the female subject MUST have {size} breasts. This is a strict requirement."
+
+def get_hips_size_description(size: str) -> str:
+    if size == 'any': return ''
+    return f"The female subject is required to have {size} hips. This is a defining characteristic and must be depicted."
+
+def get_butt_size_description(size: str) -> str:
+    if size == 'any': return ''
+    return f"The female subject's butt MUST be {size}. Adhere strictly to this physical trait."
+
+def get_penis_size_description(size: str) -> str:
+    if size == 'any': return ''
+    return f"The male subject MUST be depicted with a {size} penis. This is a non-negotiable anatomical detail."
+
+def get_muscle_definition_description(muscle_def: str) -> str:
+    if muscle_def == 'any': return ''
+    return f"The male subject's musculature must be depicted as '{muscle_def}'. This is a key part of their physique."
+
+def get_facial_hair_description(hair: str) -> str:
+    if hair == 'any': return ''
+    return f"The male subject MUST have facial hair described as: {hair}. This is a strict visual requirement."
+
+# ========================= System Prompt Compilation =========================
+SYSTEM_PROMPT_CACHE_SIZE = 256
+
+# Keyword arguments that can change the system prompt; the memoization key ignores all others
+SYSTEM_PROMPT_OPTIONS = (
+    'anime_style', 'nsfw_level', 'hardcore_level', 'enable_random_generation', 'random_intensity',
+    'gender', 'body_type', 'ethnicity', 'height_range', 'age_range', 'breast_size', 'hips_size',
+    'butt_size', 'muscle_definition', 'facial_hair', 'penis_size', 'scene_type', 'character_style',
+    'roleplay', 'system_prompt_budget'
+)
+
+ANIME_STYLE_DETAILS = {
+    "ghibli": "Studio Ghibli style - soft, detailed, magical atmosphere, beautiful landscapes, expressive characters",
+    "naruto": "Naruto anime style - dynamic action poses, ninja themes, vibrant colors, spiky hair designs",
+    "bleach": "Bleach anime style - sharp character designs, dramatic lighting, gothic elements, spiritual themes",
+    "one_piece": "One Piece anime style - exaggerated proportions, colorful characters, adventure themes, unique character designs",
+    "attack_on_titan": "Attack on Titan style - dark atmosphere, detailed military gear, intense expressions, apocalyptic themes",
+    "demon_slayer": "Demon Slayer style - traditional Japanese elements, flowing water/fire effects, detailed sword techniques",
+    "your_name": "Your Name anime style - realistic anime, beautiful lighting, emotional expressions, modern settings",
+    "spirited_away": "Spirited Away style - magical creatures, detailed fantasy worlds, soft color palettes",
+    "princess_mononoke": "Princess Mononoke style - nature themes, forest spirits, detailed environmental art",
+    "akira": "Akira anime style - cyberpunk aesthetic, detailed mechanical designs, neon colors, futuristic themes",
+    "ghost_in_shell": "Ghost in the Shell style - cyberpunk, detailed technology, philosophical themes, futuristic cityscapes",
+    "cowboy_bebop": "Cowboy Bebop style - space western, jazz age aesthetic, detailed spacecraft, noir atmosphere",
+    "evangelion": "Evangelion style - mecha designs, psychological themes, religious symbolism, detailed mechanical art",
+    "sailor_moon": "Sailor Moon style - magical girl aesthetic, sparkles and ribbons, cute character designs, pastel colors",
+    "dragon_ball": "Dragon Ball style - muscular characters, energy auras, dynamic fighting poses, spiky hair",
+    "pokemon": "Pokemon anime style - cute creatures, bright colors, adventure themes, friendly character designs",
+    "jojo": "JoJo's Bizarre Adventure style - dramatic poses, detailed clothing, unique character designs, flamboyant style",
+    "death_note": "Death Note style - dark gothic aesthetic, detailed character expressions, psychological thriller themes",
+    "fullmetal_alchemist": "Fullmetal Alchemist style - detailed alchemy symbols, steampunk elements, emotional character designs",
+    "my_hero_academia": "My Hero Academia style - superhero themes, dynamic action, colorful costumes, expressive characters"
+}
+
+NSFW_INTENSITY_DESCRIPTIONS = {
+    1: "subtle sensuality, gentle curves, soft lighting, romantic atmosphere",
+    2: "mild suggestive elements, alluring poses, seductive glances, sensual undertones",
+    3: "provocative clothing, revealing outfits, suggestive positioning, enticing expressions",
+    4: "partial nudity, bare skin, intimate apparel, seductive atmosphere, tempting scenarios",
+    5: "provocative, seductive, enticing, erotic, sensual, alluring, tempting, flirtatious, suggestive, intimate",
+    6: "explicit sensuality, detailed anatomy, provocative situations, intense erotic tension",
+    7: "highly suggestive content, graphic intimate details, passionate scenarios, wild sensuality",
+    8: "extremely provocative, graphic intimate descriptions, detailed erotic elements, intense passion",
+    9: "maximum suggestive content, full explicit sensuality, graphic intimate scenarios, wild passion",
+    10: "ultimate suggestive content, complete explicit details, maximum erotic intensity, graphic intimate descriptions"
+}
+
+HARDCORE_INTENSITY_DESCRIPTIONS = {
+    1: "mild explicit elements, sensual touching, gentle caressing, soft intimacy",
+    2: "subtle explicit content, intimate contact, gentle exploration, sensual interaction",
+    3: "moderate explicit content, passionate kissing, intimate touching, sensual exploration",
+    4: "noticeable explicit content, heavy petting, intimate contact, sensual activities",
+    5: "explicit sexual activities, detailed intimate interactions, graphic sexual descriptions, intense passion, sexual intercourse, penetration, orgasm, climax, sexual positions, sexual acts",
+    6: "very explicit content, graphic sexual activities, detailed intimate scenarios, wild passion, multiple sexual positions, group activities, BDSM elements, fetish content",
+    7: "highly explicit, graphic sexual descriptions, detailed intimate interactions, intense sexual scenarios, extreme sexual acts, hardcore BDSM, fetish exploration",
+    8: "extremely explicit, complete sexual details, graphic intimate activities, wild sexual passion, taboo scenarios, extreme fetishes, hardcore sexual content",
+    9: "maximum explicit content, full graphic sexual details, complete intimate scenarios, ultimate sexual intensity, extreme hardcore acts, all sexual taboos",
+    10: "ultimate explicit content, complete graphic sexual details, maximum sexual intensity, all possible sexual acts and taboos, no restrictions"
+}
+
+_tags_reference: Tuple[Optional[Dict[str, Any]], str] = (None, "")
+
+def build_tags_reference() -> str:
+    """
+    Condensed overview of the tags database categories for the LLM. The
+    category sums only change when TAGS_DB is replaced, so the text is
+    computed once per database.
+    """
+    global _tags_reference
+    tags_db = get_tags_db()
+    if _tags_reference[0] is tags_db:
+        return _tags_reference[1]
+    
+    text = ""
+    if tags_db:
+        # Create a condensed reference of available tags for the LLM
+        text = f"""
+- **Tags Database Reference**: You have access to a comprehensive tags database with the following categories:
+  * Quality Tags: {len(tags_db.get('quality_tags', []))} professional quality descriptors
+  * Technical Styles: {len(tags_db.get('technical_styles', []))} technical photography/art terms
+  * Character Subjects: Multiple gender/type categories with {sum(len(tags_db.get(f'subjects_{cat}', [])) for cat in ['female', 'male', 'couple', 'futanari', 'trans_female', 'trans_male', 'femboy'])} character descriptors
+  * Character Styles: {len(tags_db.get('character_styles', []))} style variations
+  * Body Types: {len(tags_db.get('body_types', []))} body type descriptors
+  * Hair Styles: {len(tags_db.get('hair_styles', []))} hair variations
+  * Clothing: {len(tags_db.get('clothing', []))} clothing options
+  * Poses: {len(tags_db.get('poses', []))} pose variations
+  * Lighting: {len(tags_db.get('lighting', []))} lighting setups
+  * Sexual Acts: {len(tags_db.get('sexual_acts', []))} intimate activities (NSFW)
+  * Roleplay Scenarios: {len(tags_db.get('roleplay_scenarios', []))} roleplay contexts
+  Use these references to enhance prompt accuracy and variety."""
+    _tags_reference = (tags_db, text)
+    return text
+
+def _reset_tags_reference():
+    global _tags_reference
+    _tags_reference = (None, "")
+
+_tags_db_reload_hooks.append(_reset_tags_reference)
+
+def build_system_prompt_fragments(target_model: str, style_main: str, style_sub: str, nsfw_mode: str,
+                                  **kwargs) -> Dict[str, Any]:
+    """
+    Compute the individual sections the system prompt is assembled from
+    """
+    # Get anime style if anime is selected
+    anime_style = kwargs.get('anime_style', 'ghibli') if style_main == 'anime' else None
+    
+    style_guidance = {
+        "realistic": REALISTIC_STYLE_GUIDANCE,
+        "anime": f"Focus on anime and manga style descriptions. Use {anime_style} anime art style specifically. Include character design elements and anime-specific terminology."
+    }
+    
+    # Add sub-style specific guidance for realistic
+    style_sub = kwargs.get('style_sub', 'any')
+    if style_main == 'realistic' and style_sub != 'any':
+        if style_sub == 'amateur':
+            style_guidance["realistic"] += " The 'amateur' sub-style requires a candid, unposed, and natural look. AVOID descriptions of perfect compositions, professional studio lighting, or overly idealized subjects. The scene should feel spontaneous and authentic, like a photo taken by a friend."
+        elif style_sub == 'professional':
+            style_guidance["realistic"] += " The 'professional' sub-style implies a high-quality, well-composed shot. Focus on photographic details like camera models, lens types (e.g., 85mm f/1.8), and specific lighting setups (e.g., three-point lighting)."
+        elif style_sub == 'flash':
+            style_guidance["realistic"] += " The 'flash' sub-style implies direct, on-camera flash. Describe harsh shadows, bright highlights, and a 'paparazzi', 'nightclub', or 'disposable camera' feel."
+    
+    # Enhanced anime style guidance
+    if anime_style and anime_style in ANIME_STYLE_DETAILS:
+        style_guidance["anime"] += f" Specifically: {ANIME_STYLE_DETAILS[anime_style]}"
+    
+    nsfw_guidance = ""
+    nsfw_level = kwargs.get('nsfw_level', 5)
+    hardcore_level = kwargs.get('hardcore_level', 5)
+    
+    if nsfw_mode == "nsfw":
+        intensity = NSFW_INTENSITY_DESCRIPTIONS.get(nsfw_level, "moderate suggestive content")
+        nsfw_guidance = f"ALWAYS include these specific elements: {intensity}. Use these words directly in the prompt. Be explicit and detailed."
+    elif nsfw_mode == "hardcore":
+        intensity = HARDCORE_INTENSITY_DESCRIPTIONS.get(hardcore_level, "moderate explicit content")
+        nsfw_guidance = f"ALWAYS include these specific elements: {intensity}. Use these words directly in the prompt. Be explicit and detailed."
+    
+    # Check if random generation is enabled
+    random_mode = kwargs.get('enable_random_generation', False)
+    random_guidance = ""
+    if random_mode:
+        random_intensity = kwargs.get('random_intensity', 0.5)
+        # Balanced creative guidance
+        random_guidance = f"\n\nRANDOM MODE ENABLED (Intensity: {random_intensity}):\n- Generate creative and unexpected elements\n- Add surprising details and compositions\n- Be imaginative and artistic within constraints\n- Include unique and interesting variations\n- Keep wording clear and concrete; avoid overly poetic metaphors"
+    
+    # Creative scope rules (applies to all generations)
+    imagination_guidance = "\n\nCREATIVE SCOPE RULES:\n- You may introduce additional creative elements (camera angle, composition, color palette, atmosphere, props) that fit the user's constraints.\n- Keep descriptions vivid but grounded; avoid flowery or metaphorical language unless explicitly requested.\n- Ensure coherence with selected presets and Content Rules."
+    
+    # Character constraints
+    character_guidance = ""
+    gender = kwargs.get('gender', 'any')
+    body_type = kwargs.get('body_type', 'any')
+    ethnicity = kwargs.get('ethnicity', 'any')
+    height_range = kwargs.get('height_range', 'any')
+    
+    if gender != 'any':
+        if gender == 'male':
+            character_guidance += f"\n- **Gender Constraint**: All individuals depicted in the scene MUST be male. Do not include any other genders."
+        elif gender == 'female':
+            character_guidance += f"\n- **Gender Constraint**: All individuals depicted in the scene MUST be female. Do not include any other genders."
+        elif gender == 'mixed':
+            character_guidance += f"\n- **Gender Constraint**: The scene MUST include both male and female individuals."
+    
+    age_range = kwargs.get('age_range', 'any')
+    if age_range != 'any':
+        character_guidance += f"\n- **Age Constraint**: The main subject's age MUST be in the '{age_range}' range."
+    
+    if body_type != 'any' and (gender == 'male' or gender == 'female'):
+        character_guidance += f"\n- **Body Type Constraint**: {get_body_type_description(gender, body_type)}"
+
+    if ethnicity != 'any': 
+        character_guidance += f"\n- **Ethnicity Constraint**: {get_ethnicity_description(ethnicity)}"
+        
+    if height_range != 'any':
+        character_guidance += f"\n- **Height Constraint**: {get_height_description(height_range)}"
+
+    # Female specific constraints
+    if gender == 'female':
+        breast_size = kwargs.get('breast_size', 'any')
+        if breast_size != 'any':
+            character_guidance += f"\n- **Breast Size Constraint**: {get_breast_size_description(breast_size)}"
+            
+        hips_size = kwargs.get('hips_size', 'any')
+        if hips_size != 'any':
+            character_guidance += f"\n- **Hips Size Constraint**: {get_hips_size_description(hips_size)}"
+            
+        butt_size = kwargs.get('butt_size', 'any')
+        if butt_size != 'any':
+            character_guidance += f"\n- **Butt Size Constraint**: {get_butt_size_description(butt_size)}"
+
+    # Male specific constraints  
+    if gender == 'male':
+        muscle_definition = kwargs.get('muscle_definition', 'any')
+        if muscle_definition != 'any':
+            character_guidance += f"\n- **Muscle Definition Constraint**: {get_muscle_definition_description(muscle_definition)}"
+            
+        facial_hair = kwargs.get('facial_hair', 'any')
+        if facial_hair != 'any':
+            character_guidance += f"\n- **Facial Hair Constraint**: {get_facial_hair_description(facial_hair)}"
+            
+        nsfw_mode = kwargs.get('nsfw_mode', 'off')
+        if nsfw_mode in ['nsfw', 'hardcore']:
+            penis_size = kwargs.get('penis_size', 'any')
+            if penis_size != 'any':
+                character_guidance += f"\n- **Penis Size Constraint**: {get_penis_size_description(penis_size)}"
+    
+    # Scene type constraints
+    scene_type = kwargs.get('scene_type', 'solo')
+    scene_guidance = ""
+    if scene_type != 'solo':
+        if scene_type == 'couple':
+            scene_guidance = "\n- **Scene Type Constraint**: This MUST be a couple scene with exactly two people interacting romantically or intimately."
+        elif scene_type == 'threesome':
+            scene_guidance = "\n- **Scene Type Constraint**: This MUST be a threesome scene with exactly three people in intimate interaction."
+        elif scene_type == 'group':
+            scene_guidance = "\n- **Scene Type Constraint**: This MUST be a group scene with multiple people (4 or more) in social or intimate interaction."
+    else:
+        scene_guidance = "\n- **Scene Type Constraint**: This MUST be a solo scene featuring a single individual. Do NOT include multiple people or partner interactions."
+    
+    # Character style constraints
+    character_style = kwargs.get('character_style', 'any')
+    style_guidance_extra = ""
+    if character_style != 'any':
+        if character_style == 'realistic':
+            style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have realistic, photographic appearance with natural proportions and features."
+        elif character_style == 'anime':
+            style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have anime/manga style with stylized features, large eyes, and anime proportions."
+        elif character_style == 'fantasy':
+            style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have fantasy elements like magical features, mythical attributes, or supernatural appearance."
+        elif character_style == 'cyberpunk':
+            style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have cyberpunk aesthetic with futuristic implants, neon colors, and high-tech elements."
+        elif character_style == 'gothic':
+            style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have gothic style with dark clothing, pale skin, dramatic makeup, and gothic accessories."
+        elif character_style == 'vintage':
+            style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have vintage/retro appearance with period-appropriate clothing and styling."
+    
+    # Roleplay constraints
+    roleplay = kwargs.get('roleplay', 'none')
+    roleplay_guidance = ""
+    if roleplay != 'none':
+        if roleplay == 'teacher_student':
+            roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include teacher-student roleplay dynamic with appropriate setting (classroom, office) and power dynamic."
+        elif roleplay == 'boss_employee':
+            roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include boss-employee roleplay dynamic with office setting and workplace power dynamic."
+        elif roleplay == 'doctor_patient':
+            roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include doctor-patient roleplay dynamic with medical setting and professional/patient relationship."
+        elif roleplay == 'police_criminal':
+            roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include police-criminal roleplay dynamic with law enforcement setting and authority/suspect relationship."
+        elif roleplay == 'maid_master':
+            roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include maid-master roleplay dynamic with domestic setting and service/authority relationship."
+        elif roleplay == 'nurse_patient':
+            roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include nurse-patient roleplay dynamic with medical setting and caregiver/patient relationship."
+    
+    # Create tags database reference for LLM
+    tags_reference = build_tags_reference()
+    
+    style_text = style_guidance.get(style_main, style_guidance['realistic'])
+    style_base = REALISTIC_STYLE_GUIDANCE if style_text.startswith(REALISTIC_STYLE_GUIDANCE) else ''
+    
+    return {
+        'style_sub': style_sub,
+        'nsfw_mode': nsfw_mode,
+        'nsfw_level': nsfw_level,
+        'hardcore_level': hardcore_level,
+        'style_base': style_base,
+        'style_specific': style_text[len(style_base):],
+        'nsfw_guidance': nsfw_guidance,
+        'random_guidance': random_guidance,
+        'imagination_guidance': imagination_guidance,
+        'character_guidance': character_guidance,
+        'scene_guidance': scene_guidance,
+        'style_guidance_extra': style_guidance_extra,
+        'roleplay_guidance': roleplay_guidance,
+        'tags_reference': tags_reference
+    }
+
+def assemble_system_prompt(f: Dict[str, Any], target_model: str, style_main: str) -> str:
+    """
+    Default system prompt layout
+    """
+    return f"""You are an advanced AI assistant specialized in generating detailed image prompts for the {target_model} model.
+
+Target Model: {target_model}
+Style: {style_main} ({f['style_sub']})
+NSFW Mode: {f['nsfw_mode']}
+NSFW Level: {f['nsfw_level']}/10
+Hardcore Level: {f['hardcore_level']}/10
+
+Style Guidance: {f['style_base']}{f['style_specific']}
+{f['nsfw_guidance']}{f['random_guidance']}{f['imagination_guidance']}{f['character_guidance']}{f['scene_guidance']}{f['style_guidance_extra']}{f['roleplay_guidance']}{f['tags_reference']}
+
+Generate enhanced prompts that are:
+1. Highly detailed and specific
+2. Optimized for {target_model}
+3. Appropriate for {style_main} style
+4. Include relevant technical terms
+5. Consider lighting, composition, and atmosphere
+
+{PROMPT_JSON_FORMAT}"""
+
+def assemble_system_prompt_parts(f: Dict[str, Any], target_model: str, style_main: str) -> Tuple[str, str]:
+    """
+    Cache-friendly system prompt: a long prefix that is identical for every
+    request with the same main style, followed by a short suffix holding
+    the per-request settings. Servers with prefix caching (llama.cpp,
+    vLLM) then only prefill the suffix.
+    """
+    stable_prefix = f"""You are an advanced AI assistant specialized in generating detailed image prompts for text-to-image models.
+{f['imagination_guidance']}{f['tags_reference']}
+
+Generate enhanced prompts that are:
+1. Highly detailed and specific
+2. Optimized for the target model given in the request settings
+3. Appropriate for the requested style
+4. Include relevant technical terms
+5. Consider lighting, composition, and atmosphere
+
+{PROMPT_JSON_FORMAT}"""
+    if f['style_base']:
+        stable_prefix += f"\n\nStyle Guidance: {f['style_base']}"
+    variable_suffix = f"""
+
+REQUEST SETTINGS:
+Target Model: {target_model}
+Style: {style_main} ({f['style_sub']})
+NSFW Mode: {f['nsfw_mode']}
+NSFW Level: {f['nsfw_level']}/10
+Hardcore Level: {f['hardcore_level']}/10
+Style Specifics: {f['style_specific'].strip() or 'see Style Guidance above'}
+{f['nsfw_guidance']}{f['random_guidance']}{f['character_guidance']}{f['scene_guidance']}{f['style_guidance_extra']}{f['roleplay_guidance']}"""
+    return stable_prefix, variable_suffix.rstrip()
+
+# Compact layout: the realistic guidance split into its lead sentence and the glossary,
+# minus the derived "... shift" variants
+REALISTIC_GUIDANCE_LEAD, _realistic_glossary = REALISTIC_STYLE_GUIDANCE.split(" Include professional photography terms like ", 1)
+COMPACT_GLOSSARY_TERMS = [term for term in _realistic_glossary.rstrip('.').split(', ') if not term.endswith(' shift')]
+
+COMPACT_PROMPT_INSTRUCTIONS = "Make the prompts highly detailed and specific, optimized for the target model and style, with relevant technical terms, lighting, composition and atmosphere."
+
+def assemble_compact_system_prompt(f: Dict[str, Any], target_model: str, style_main: str, budget: int) -> str:
+    """
+    System prompt that fits in about budget tokens. The header and the JSON
+    format are always kept; the other sections are added in priority order
+    (content rules and character constraints first, the photography glossary
+    last, trimmed term by term) while they still fit.
+    """
+    header = f"""You are an AI assistant that writes detailed image prompts for the {target_model} model.
+Target Model: {target_model}
+Style: {style_main} ({f['style_sub']})
+NSFW Mode: {f['nsfw_mode']}
+NSFW Level: {f['nsfw_level']}/10
+Hardcore Level: {f['hardcore_level']}/10"""
+    constraints = (f['character_guidance'] + f['scene_guidance'] + f['style_guidance_extra'] + f['roleplay_guidance']).strip()
+    style_text = f['style_specific'].strip() or (REALISTIC_GUIDANCE_LEAD if f['style_base'] else '')
+    
+    # Highest priority first
+    sections = [
+        ('content_rules', f['nsfw_guidance']),
+        ('constraints', f"CONSTRAINTS:\n{constraints}" if constraints else ''),
+        ('style', f"Style Guidance: {style_text}" if style_text else ''),
+        ('random', f['random_guidance'].strip()),
+        ('instructions', COMPACT_PROMPT_INSTRUCTIONS),
+        ('creative_scope', f['imagination_guidance'].strip()),
+        ('tags_reference', f['tags_reference'].strip()),
+    ]
+    remaining = budget - estimate_tokens(header) - estimate_tokens(PROMPT_JSON_FORMAT)
+    chosen = {}
+    for name, text in sections:
+        # Each section costs its text plus the blank line separating it
+        cost = estimate_tokens(text) + 1
+        if text and cost <= remaining:
+            chosen[name] = text
+            remaining -= cost
+    
+    if f['style_base']:
+        lead = "Useful photography terms: "
+        chars = (remaining - 1) * 4 - len(lead)
+        terms = []
+        for term in COMPACT_GLOSSARY_TERMS:
+            chars -= len(term) + 2
+            if chars < 0:
+                break
+            terms.append(term)
+        if terms:
+            chosen['glossary'] = f"{lead}{', '.join(terms)}."
+    
+    order = ['style', 'glossary', 'content_rules', 'random', 'constraints', 'creative_scope', 'tags_reference', 'instructions']
+    return "\n\n".join([header] + [chosen[name] for name in order if name in chosen] + [PROMPT_JSON_FORMAT])
+
+@functools.lru_cache(maxsize=SYSTEM_PROMPT_CACHE_SIZE)
+def _compile_system_prompt(layout: str, target_model: str, style_main: str, style_sub: str, nsfw_mode: str,
+                           options: Tuple[Tuple[str, Any], ...], tags_db_id: int) -> Tuple[str, str]:
+    f = build_system_prompt_fragments(target_model, style_main, style_sub, nsfw_mode, **dict(options))
+    if layout == 'parts':
+        return assemble_system_prompt_parts(f, target_model, style_main)
+    if layout == 'compact':
+        return assemble_compact_system_prompt(f, target_model, style_main, dict(options).get('system_prompt_budget', 0)), ''
+    return assemble_system_prompt(f, target_model, style_main), ''
+
+# Compiled prompts are keyed on id(TAGS_DB), which a reloaded database may reuse
+_tags_db_reload_hooks.append(_compile_system_prompt.cache_clear)
+
+def compile_system_prompt(layout: str, target_model: str, style_main: str, style_sub: str, nsfw_mode: str,
+                          kwargs: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    System prompt shared by all nodes, memoized (LRU) on the arguments and
+    the kwargs listed in SYSTEM_PROMPT_OPTIONS. Layouts 'full' and 'compact'
+    return (prompt, ''), layout 'parts' returns (stable_prefix, variable_suffix).
+    """
+    options = tuple([(name, kwargs[name]) for name in SYSTEM_PROMPT_OPTIONS if name in kwargs])
+    try:
+        hash(options)
+    except TypeError:
+        # Unhashable option values (never produced by the node inputs) skip the cache
+        return _compile_system_prompt.__wrapped__(layout, target_model, style_main, style_sub, nsfw_mode,
+                                                  options, id(get_tags_db()))
+    return _compile_system_prompt(layout, target_model, style_main, style_sub, nsfw_mode, options, id(get_tags_db()))
+
+# ========================= Prompt Engine =========================
+class PromptEngine:
+    """
+    Prompt assembly shared by every node: character and preset expansion,
+    system prompts, request building, offline enhancement and model
+    formatting. It keeps no state between calls (presets are read-only
+    mappings), so the single PROMPT_ENGINE instance is safe to share
+    across nodes and threads.
+    """
+    __slots__ = ()
+    
+    shot_presets = types.MappingProxyType({
+        "close-up": "close-up shot, detailed face, intimate framing",
+        "medium shot": "medium shot, waist up, balanced composition",
+        "full body": "full body shot, head to toe, complete figure",
+        "wide shot": "wide shot, environmental context, expansive view",
+        "extreme close-up": "extreme close-up, macro detail, intense focus",
+        "bird's eye": "bird's eye view, top-down perspective, aerial shot",
+        "low angle": "low angle shot, dramatic perspective, powerful composition",
+        "high angle": "high angle shot, looking down, diminished perspective"
+    })
+    
+    pose_presets = types.MappingProxyType({
+        "standing": "standing pose, confident posture, natural stance",
+        "sitting": "sitting pose, relaxed position, comfortable seating",
+        "lying down": "lying down, reclining pose, horizontal position",
+        "walking": "walking pose, dynamic movement, stride in motion",
+        "running": "running pose, athletic movement, energetic motion",
+        "dancing": "dancing pose, graceful movement, rhythmic expression",
+        "jumping": "jumping pose, airborne moment, dynamic action",
+        "crouching": "crouching pose, low position, bent knees"
+    })
+    
+    location_presets = types.MappingProxyType({
+        "studio": "professional studio, controlled lighting, clean background",
+        "outdoor": "outdoor setting, natural environment, open air",
+        "beach": "beach location, sandy shore, ocean waves",
+        "forest": "forest setting, trees and nature, woodland environment",
+        "city": "urban cityscape, buildings and streets, metropolitan area",
+        "bedroom": "bedroom interior, intimate space, private setting",
+        "office": "office environment, professional workspace, business setting",
+        "cafe": "cafe interior, cozy atmosphere, coffee shop ambiance"
+    })
+    
+    clothing_presets = types.MappingProxyType({
+        "casual": "casual clothing, comfortable attire, everyday wear",
+        "formal": "formal attire, elegant clothing, sophisticated dress",
+        "business": "business attire, professional clothing, office wear",
+        "swimwear": "swimwear, beach attire, swimming costume",
+        "lingerie": "lingerie, intimate apparel, delicate undergarments",
+        "sportswear": "sportswear, athletic clothing, fitness attire",
+        "evening wear": "evening wear, glamorous dress, formal gown",
+        "vintage": "vintage clothing, retro style, classic fashion"
+    })
+    
+    def get_quality_tags(self, target_model: str, style_main: str, style_sub: str) -> List[str]:
+        """
+        Get quality tags based on model and style
+        """
+        if style_main == 'anime':
+            return ['masterpiece', 'best quality', 'amazing quality', 'anime screenshot', 'absurdres']
+        
+        # Realistic styles
+        if style_sub == 'professional':
+            return ['photorealistic', 'professional photography', '8k', 'high detail', 'sharp focus', 'award-winning photograph']
+        elif style_sub == 'amateur':
+            return ['realistic photograph', 'candid shot', 'amateur photography', 'photographic grain', 'natural look', 'unposed']
+        elif style_sub == 'flash':
+            return ['flash photography', 'direct flash', 'harsh lighting', 'realistic', 'overexposed highlights', 'deep shadows', 'candid']
+        else:
+            return ['photorealistic', 'best quality', 'high detail']
+    
+    def build_character_description(self, rng: Optional[random.Random] = None, **kwargs) -> str:
+        """
+        Build character description from settings with random support
+        """
+        parts = []
+        
+        # Own random stream, seeded from random_seed if provided
+        if rng is None:
+            rng = item_rng(kwargs.get('random_seed', -1))
+        
+        # Handle random gender selection
+        gender = kwargs.get('gender', 'any')
+        if gender == 'random':
+            gender = rng.choice(['male', 'female'])
+        
+        # Basic demographics
+        if gender and gender != 'any':
+            parts.append(gender)
+        
+        # Random age if enabled
+        age_range = kwargs.get('age_range', 'any')
+        if kwargs.get('enable_random_generation') and age_range == 'any':
+            age_range = rng.choice(['18s', '25s', '30s', '40s', '50s'])
+        
+        if age_range and age_range != 'any':
+            parts.append(f"{age_range} years old")
+        
+        # Random ethnicity if enabled
+        ethnicity = kwargs.get('ethnicity', 'any')
+        if kwargs.get('enable_random_generation') and ethnicity == 'any':
+            ethnicity_options = ['caucasian', 'european', 'asian', 'japanese', 'chinese', 'korean', 'african', 'hispanic']
+            ethnicity = rng.choice(ethnicity_options)
+        
+        if ethnicity and ethnicity != 'any':
+            parts.append(ethnicity)
+        
+        # Random body type if enabled
+        body_type = kwargs.get('body_type', 'any')
+        if kwargs.get('enable_random_generation') and body_type == 'any':
+            if gender == 'female':
+                body_type = rng.choice(['slim', 'curvy', 'athletic', 'instagram model'])
+            elif gender == 'male':
+                body_type = rng.choice(['slim', 'muscular', 'athletic', 'big muscular'])
+        
+        if body_type and body_type != 'any':
+            parts.append(f"{body_type} body type")
+        
+        # Random height if enabled
+        height_range = kwargs.get('height_range', 'any')
+        if kwargs.get('enable_random_generation') and height_range == 'any':
+            height_range = rng.choice(['short', 'average', 'tall'])
+        
+        if height_range and height_range != 'any':
+            parts.append(height_range)
+        
+        # Gender-specific attributes with random support
+        if gender == 'female':
+            breast_size = kwargs.get('breast_size', 'any')
+            if kwargs.get('enable_random_generation') and breast_size == 'any':
+                breast_size = rng.choice(['small', 'medium', 'large'])
+            if breast_size and breast_size != 'any':
+                parts.append(f"{breast_size} breasts")
+            
+            hips_size = kwargs.get('hips_size', 'any')
+            if kwargs.get('enable_random_generation') and hips_size == 'any':
+                hips_size = rng.choice(['narrow', 'average', 'wide'])
+            if hips_size and hips_size != 'any':
+                parts.append(f"{hips_size} hips")
+            
+            butt_size = kwargs.get('butt_size', 'any')
+            if kwargs.get('enable_random_generation') and butt_size == 'any':
+                butt_size = rng.choice(['small', 'average', 'large'])
+            if butt_size and butt_size != 'any':
+                parts.append(f"{butt_size} butt")
+        
+        if gender == 'male':
+            muscle_definition = kwargs.get('muscle_definition', 'any')
+            if kwargs.get('enable_random_generation') and muscle_definition == 'any':
+                muscle_definition = rng.choice(['toned', 'defined', 'ripped'])
+            if muscle_definition and muscle_definition != 'any':
+                parts.append(f"{muscle_definition} muscles")
+            
+            facial_hair = kwargs.get('facial_hair', 'any')
+            if kwargs.get('enable_random_generation') and facial_hair == 'any':
+                facial_hair = rng.choice(['clean-shaven', 'stubble', 'goatee', 'full beard'])
+            if facial_hair and facial_hair != 'any':
+                parts.append(facial_hair)
+            
+            if kwargs.get('nsfw_mode') != 'off':
+                penis_size = kwargs.get('penis_size', 'any')
+                if kwargs.get('enable_random_generation') and penis_size == 'any':
+                    penis_size = rng.choice(['average', 'large'])
+                if penis_size and penis_size != 'any':
+                    parts.append(f"{penis_size} penis")
+        
+        # Add scene type context
+        scene_type = kwargs.get('scene_type', 'solo')
+        if scene_type and scene_type != 'solo':
+            if scene_type == 'couple':
+                parts.append("in a couple scene")
+            elif scene_type == 'threesome':
+                parts.append("in a threesome scene")
+            elif scene_type == 'group':
+                parts.append("in a group scene")
+        
+        # Add character style
+        character_style = kwargs.get('character_style', 'any')
+        if character_style and character_style != 'any':
+            if character_style == 'realistic':
+                parts.append("realistic style")
+            elif character_style == 'anime':
+                parts.append("anime style")
+            elif character_style == 'fantasy':
+                parts.append("fantasy style")
+            elif character_style == 'cyberpunk':
+                parts.append("cyberpunk style")
+            elif character_style == 'gothic':
+                parts.append("gothic style")
+            elif character_style == 'vintage':
+                parts.append("vintage style")
+        
+        # Add roleplay context
+        roleplay = kwargs.get('roleplay', 'none')
+        if roleplay and roleplay != 'none':
+            if roleplay == 'teacher_student':
+                parts.append("teacher-student roleplay")
+            elif roleplay == 'boss_employee':
+                parts.append("boss-employee roleplay")
+            elif roleplay == 'doctor_patient':
+                parts.append("doctor-patient roleplay")
+            elif roleplay == 'photographer_model':
+                parts.append("photographer-model roleplay")
+            elif roleplay == 'massage_therapist':
+                parts.append("massage therapist roleplay")
+            elif roleplay == 'personal_trainer':
+                parts.append("personal trainer roleplay")
+            elif roleplay == 'roommates':
+                parts.append("roommates roleplay")
+            elif roleplay == 'neighbors':
+                parts.append("neighbors roleplay")
+            elif roleplay == 'strangers':
+                parts.append("strangers roleplay")
+            elif roleplay == 'friends_with_benefits':
+                parts.append("friends with benefits roleplay")
+        
+        # Start with appropriate article based on gender and scene type
+        if parts:
+            description = ', '.join(parts)
+            if scene_type == 'solo':
+                if gender == 'female':
+                    return f"the woman, {description}"
+                elif gender == 'male':
+                    return f"the man, {description}"
+                else:
+                    return f"the person, {description}"
+            else:
+                # For multi-person scenes, adjust the description
+                if gender == 'mixed' or scene_type in ['couple', 'threesome', 'group']:
+                    return f"the people, {description}"
+                elif gender == 'female':
+                    return f"the women, {description}"
+                elif gender == 'male':
+                    return f"the men, {description}"
+                else:
+                    return f"the people, {description}"
+        return ''
+    
+    def apply_presets(self, preset_string: str, preset_dict: Dict[str, str]) -> List[str]:
+        """
+        Apply presets from comma-separated string
+        """
+        if not preset_string.strip():
+            return []
+        
+        presets = [p.strip().lower() for p in preset_string.split(',')]
+        applied = []
+        
+        for preset in presets:
+            if preset in preset_dict:
+                applied.append(preset_dict[preset])
+        
+        return applied
+    
+    def create_system_prompt(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str, **kwargs) -> str:
+        """
+        Create comprehensive system prompt for LLM
+        """
+        if kwargs.get('system_prompt_budget', 0) > 0:
+            return compile_system_prompt('compact', target_model, style_main, style_sub, nsfw_mode, kwargs)[0]
+        if kwargs.get('cache_friendly_prompt'):
+            return ''.join(self.create_system_prompt_parts(target_model, style_main, style_sub, nsfw_mode, **kwargs))
+        return compile_system_prompt('full', target_model, style_main, style_sub, nsfw_mode, kwargs)[0]
+    
+    def create_system_prompt_parts(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str,
+                                   **kwargs) -> Tuple[str, str]:
+        """
+        System prompt split into a stable prefix and a per-request suffix
+        """
+        return compile_system_prompt('parts', target_model, style_main, style_sub, nsfw_mode, kwargs)
+    
+    def system_prompt_fragments(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str,
+                                **kwargs) -> Dict[str, Any]:
+        """
+        Compute the individual sections the system prompt is assembled from
+        """
+        return build_system_prompt_fragments(target_model, style_main, style_sub, nsfw_mode, **kwargs)
+    
+    def prepare_prompt_request(self, description: str, api_url: str, model_name: str, target_model: str,
+                               style_main: str, style_sub: str, **kwargs) -> Dict[str, Any]:
+        """
+        Build the full description, API config and messages for one prompt.
+        All random choices happen here, so batch items can be prepared in order
+        and their LLM calls dispatched concurrently afterwards.
+        """
+        full_description = self.build_full_description(description, **kwargs)
+        return self.build_prompt_request(full_description, api_url, model_name, target_model,
+                                         style_main, style_sub, **kwargs)
+    
+    def build_full_description(self, description: str, rng: Optional[random.Random] = None, **kwargs) -> str:
+        """
+        Description plus character settings and presets
+        """
+        # Build character description
+        character_desc = self.build_character_description(rng, **kwargs)
+        
+        # Apply presets
+        shot_elements = self.apply_presets(kwargs.get('shot_presets', ''), self.shot_presets)
+        pose_elements = self.apply_presets(kwargs.get('pose_presets', ''), self.pose_presets)
+        location_elements = self.apply_presets(kwargs.get('location_presets', ''), self.location_presets)
+        clothing_elements = self.apply_presets(kwargs.get('clothing_presets', ''), self.clothing_presets)
+        
+        # Combine all elements
+        full_description = description
+        if character_desc:
+            full_description += f", {character_desc}"
+        
+        preset_elements = shot_elements + pose_elements + location_elements + clothing_elements
+        if preset_elements:
+            full_description += f", {', '.join(preset_elements)}"
+        return full_description
+    
+    def retrieve_relevant_tags(self, texts: List[str], **kwargs) -> List[Dict[str, List[str]]]:
+        """
+        Most relevant tags per category for each text (empty when retrieval is off)
+        """
+        top_k = kwargs.get('tag_retrieval_top_k', 0)
+        if top_k <= 0:
+            return [{} for _ in texts]
+        exclude = tag_retrieval_exclusions(kwargs.get('nsfw_mode', 'off'))
+        ranked = get_tags_index().search_batch(texts, top_k, exclude)
+        # Tags the text names verbatim always make the list, found with one trie walk per phrase
+        compiled = current_compiled_tags_index()
+        return [merge_exact_tags(result, exact_tag_matches(text, compiled, exclude), top_k)
+                for text, result in zip(texts, ranked)]
+    
+    def build_prompt_request(self, full_description: str, api_url: str, model_name: str, target_model: str,
+                             style_main: str, style_sub: str, relevant_tags: Optional[Dict[str, List[str]]] = None,
+                             **kwargs) -> Dict[str, Any]:
+        """
+        API config and messages for a full description
+        """
+        if relevant_tags is None:
+            relevant_tags = self.retrieve_relevant_tags([full_description], **kwargs)[0]
+        
+        # Create system prompt
+        nsfw_mode = kwargs.get('nsfw_mode', 'off')
+        # Remove nsfw_mode from kwargs to avoid duplicate argument error
+        kwargs_copy = kwargs.copy()
+        kwargs_copy.pop('nsfw_mode', None)
+        if kwargs.get('cache_friendly_prompt', False) and not kwargs.get('system_prompt_budget', 0):
+            stable_prefix, variable_suffix = self.create_system_prompt_parts(
+                target_model, style_main, style_sub, nsfw_mode, **kwargs_copy
+            )
+            system_prompt = stable_prefix + variable_suffix
+        else:
+            stable_prefix = ''
+            system_prompt = self.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs_copy)
+        # Retrieved tags vary per description, so they always go last
+        system_prompt += format_relevant_tags(relevant_tags)
+        
+        # API configuration
+        config = {
+            'api_url': api_url.strip().rstrip('/'),
+            'model_name': model_name,
+            'api_key': kwargs.get('api_key', ''),
+            'temperature': kwargs.get('temperature', 0.7),
+            'max_tokens': kwargs.get('max_tokens', 2000),
+            'stream': kwargs.get('stream_response', False),
+            'stream_early_stop': kwargs.get('stream_early_stop', True),
+            'response_cache': kwargs.get('response_cache', False),
+            'response_cache_ttl': kwargs.get('response_cache_ttl', RESPONSE_CACHE_DEFAULT_TTL),
+            'connect_timeout': kwargs.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+            'read_timeout': kwargs.get('read_timeout', DEFAULT_READ_TIMEOUT),
+            'max_retries': kwargs.get('max_retries', DEFAULT_MAX_RETRIES),
+            'circuit_breaker_threshold': kwargs.get('circuit_breaker_threshold', CIRCUIT_FAILURE_THRESHOLD),
+            'circuit_breaker_cooldown': kwargs.get('circuit_breaker_cooldown', CIRCUIT_COOLDOWN),
+            'coalesce_requests': kwargs.get('coalesce_requests', True),
+            'cache_prompt': kwargs.get('cache_friendly_prompt', False),
+            'slot_id': kwargs.get('llama_slot_id', -1),
+            'structured_output': kwargs.get('structured_output', 'off'),
+            'structured_output_retries': kwargs.get('structured_output_retries', 2)
+        }
+        
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Create enhanced prompts for: {full_description}"}
+        ]
+        
+        return {
+            'full_description': full_description,
+            'config': config,
+            'messages': messages,
+            'prefix_tokens': estimate_tokens(stable_prefix),
+            'system_prompt_info': describe_system_prompt(system_prompt, kwargs.get('system_prompt_budget', 0))
+        }
     
-    cleaned_text = text.strip()
+    def result_cache_key(self, request: Dict[str, Any], target_model: str, style_main: str,
+                         style_sub: str, **kwargs) -> str:
+        """
+        Result cache key of a prepared request; its messages already carry
+        every random choice, so seeded and unseeded requests cache alike
+        """
+        return canonical_result_key("local", {
+            'api_url': request['config']['api_url'],
+            'model_name': request['config']['model_name'],
+            'messages': request['messages'],
+            'target_model': target_model,
+            'style_main': style_main,
+            'style_sub': style_sub,
+            'options': kwargs
+        })
     
-    # Strategy 1: Try direct JSON parsing
-    try:
-        parsed = json.loads(cleaned_text)
-        if parsed and isinstance(parsed, dict):
-            return parsed
-    except json.JSONDecodeError:
-        pass
+    def finalize_prompts(self, positive_prompt: str, negative_prompt: str, enhanced_description: str,
+                         target_model: str, style_main: str, style_sub: str, **kwargs) -> Tuple[str, str, str, str]:
+        """
+        Add quality tags and the model-specific formatting to generated prompts
+        """
+        # Add quality tags if enabled
+        if kwargs.get('quality_tags', True):
+            quality_tags = self.get_quality_tags(target_model, style_main, style_sub)
+            positive_prompt = ', '.join(quality_tags) + ', ' + positive_prompt
+        
+        # Format final prompt based on target model
+        formatted_prompt = self.format_for_model(positive_prompt, target_model, kwargs)
+        
+        return (positive_prompt, negative_prompt, enhanced_description, formatted_prompt)
     
-    # Strategy 2: Extract JSON from code blocks or markdown
-    import re
-    json_block_match = re.search(r'```(?:json)?\s*([\s\S]*?)```', cleaned_text)
-    if json_block_match:
-        try:
-            parsed = json.loads(json_block_match.group(1).strip())
-            if parsed and isinstance(parsed, dict):
-                return parsed
-        except json.JSONDecodeError:
-            pass
-    
-    # Strategy 3: Find the first valid JSON object in the text
-    json_object_match = re.search(r'\{[\s\S]*?\}(?=\s*$|\s*[^\s\w\d\{\}\[\]"\',])', cleaned_text)
-    if json_object_match:
-        try:
-            # Clean common JSON formatting issues
-            json_str = json_object_match.group(0)
-            json_str = re.sub(r',\s*\}', '}', json_str)
-            json_str = re.sub(r',\s*\]', ']', json_str)
-            json_str = re.sub(r"'", '"', json_str)
-            json_str = re.sub(r'\n', ' ', json_str)
-            json_str = re.sub(r'\s+', ' ', json_str)
+    def create_smart_variation(self, base_description: str, iteration: int, full_randomize: bool, 
+                              preserved_traits: str, variation_pools: dict,
+                              rng: Optional[random.Random] = None, **kwargs) -> str:
+        """
+        Create smart variations based on user settings - EXACTLY as requested
+        """
+        variations = []
+        if rng is None:
+            rng = item_rng(kwargs.get('random_seed', -1), iteration)
+        
+        # Always add preserved traits if specified
+        if preserved_traits:
+            variations.append(preserved_traits)
+        
+        if full_randomize:
+            # Add random elements based on user settings
+            if kwargs.get('random_locations', True):
+                location = rng.choice(variation_pools['locations'])
+                variations.append(f"in {location}")
             
-            parsed = json.loads(json_str)
-            if parsed and isinstance(parsed, dict):
-                return parsed
-        except json.JSONDecodeError:
-            pass
-    
-    # Strategy 4: Try to parse as array of objects
-    json_array_match = re.search(r'\[[\s\S]*?\]', cleaned_text)
-    if json_array_match:
-        try:
-            parsed = json.loads(json_array_match.group(0))
-            if isinstance(parsed, list):
-                return {"structuredPrompts": parsed}
-        except json.JSONDecodeError:
-            pass
-    
-    # Strategy 5: Try to find and fix common JSON syntax errors
-    potential_json_match = re.search(r'\{[\s\S]{20,1000}\}', cleaned_text)
-    if potential_json_match:
-        try:
-            fixed_json = potential_json_match.group(0)
-            # Fix missing quotes around keys
-            fixed_json = re.sub(r'([\{\,])\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*:', r'\1"\2":', fixed_json)
-            # Fix single quotes
-            fixed_json = re.sub(r"'", '"', fixed_json)
-            # Fix trailing commas
-            fixed_json = re.sub(r',\s*\}', '}', fixed_json)
-            fixed_json = re.sub(r',\s*\]', ']', fixed_json)
+            if kwargs.get('random_poses', True):
+                pose = rng.choice(variation_pools['poses'])
+                variations.append(f"{pose}")
+            
+            if kwargs.get('random_emotions', True):
+                emotion = rng.choice(variation_pools['emotions'])
+                variations.append(f"{emotion} expression")
+            
+            if kwargs.get('random_clothing', True):
+                clothing = rng.choice(variation_pools['clothing'])
+                variations.append(f"wearing {clothing}")
             
-            parsed = json.loads(fixed_json)
-            if parsed and isinstance(parsed, dict):
-                return parsed
-        except json.JSONDecodeError:
-            pass
+            if kwargs.get('random_lighting', True):
+                lighting = rng.choice(variation_pools['lighting'])
+                variations.append(f"{lighting}")
+        
+        # Combine base description with variations
+        if variations:
+            return f"{base_description}, {', '.join(variations)}"
+        else:
+            return base_description
     
-    return None
-
-# Character constraint functions for local model
-def get_body_type_description(gender: str, body_type: str) -> str:
-    if gender == 'female':
-        if body_type == 'slim': return 'The subject must have a slim build, slender figure, and petite frame.'
-        if body_type == 'curvy': return 'The subject must have a curvy figure with an hourglass shape, wide hips, and a voluptuous body.'
-        if body_type == 'athletic': return 'The subject must have an athletic build with a toned body, defined muscles, and a fit physique.'
-        if body_type == 'instagram model': return 'The subject must have an "instagram model" physique: a slim-thick, surgically enhanced look with an exaggerated hourglass figure and an impossibly small waist.'
-    elif gender == 'male':
-        if body_type == 'slim': return 'The subject must have a slim build, a lean physique, and a slender frame.'
-        if body_type == 'fat': return 'The subject must have a heavy-set, plus-size male build, such as a "dad bod" or a chubby, overweight frame with a large belly.'
-        if body_type == 'muscular': return 'The subject must have a muscular, athletic body with toned muscles and a well-defined physique (like a movie star).'
-        if body_type == 'big muscular': return 'The subject must have a hypermuscular bodybuilder physique with huge, massive, bulging muscles.'
-    return ''
-
-def get_ethnicity_description(ethnicity: str) -> str:
-    if ethnicity == 'any': return ''
-    return f"The subject's ethnicity MUST be {ethnicity}. This is a strict, non-negotiable requirement."
-
-def get_height_description(height: str) -> str:
-    if height == 'any': return ''
-    description = height.replace('\s*\(.+\\)', '')
-    return f"The subject's height MUST be in the '{description}' range. For reference: {height}. This is a strict physical trait."
-
-def get_breast_size_description(size: str) -> str:
-    if size == 'any': return ''
-    return f"As a key physical attribute, the female subject MUST have {size} breasts. This is a strict requirement."
-
-def get_hips_size_description(size: str) -> str:
-    if size == 'any': return ''
-    return f"The female subject is required to have {size} hips. This is a defining characteristic and must be depicted."
-
-def get_butt_size_description(size: str) -> str:
-    if size == 'any': return ''
-    return f"The female subject's butt MUST be {size}. Adhere strictly to this physical trait."
-
-def get_penis_size_description(size: str) -> str:
-    if size == 'any': return ''
-    return f"The male subject MUST be depicted with a {size} penis. This is a non-negotiable anatomical detail."
-
-def get_muscle_definition_description(muscle_def: str) -> str:
-    if muscle_def == 'any': return ''
-    return f"The male subject's musculature must be depicted as '{muscle_def}'. This is a key part of their physique."
+    def enhance_prompt_advanced(self, description: str, style_main: str, style_sub: str, **kwargs) -> str:
+        """
+        Advanced prompt enhancement without LLM - extracts key elements from rich descriptions
+        and creates optimized prompts for image generation
+        """
+        # Extract key elements from the rich description
+        elements = extract_prompt_elements(description)
+        
+        # Build the enhanced prompt with richer content
+        tail_parts, intensity_elements = enhancement_tail_parts(style_main, style_sub, **kwargs)
+        prompt_parts = element_prompt_parts(elements, description) + tail_parts
+        
+        # Combine all parts with better flow
+        enhanced_prompt = ', '.join([part for part in prompt_parts if part])
+        
+        # DEBUG: Log NSFW/hardcore elements for verification
+        nsfw_mode = kwargs.get('nsfw_mode', 'off')
+        if DEBUG_LOGGING and nsfw_mode != "off":
+            print(f"\n=== NSFW DEBUG ===")
+            print(f"Mode: {nsfw_mode}, Level: {kwargs.get('nsfw_level', 5)}, Hardcore Level: {kwargs.get('hardcore_level', 5)}")
+            if nsfw_mode == "nsfw":
+                print(f"NSFW Elements: {intensity_elements}")
+            elif nsfw_mode == "hardcore":
+                print(f"Hardcore Elements: {intensity_elements}")
+            print(f"Enhanced Prompt Preview: {enhanced_prompt[:200]}...")
+            print("==================\n")
+        
+        return finalize_enhanced_prompt(enhanced_prompt)
+    
+    def format_for_model(self, prompt: str, target_model: str, kwargs: Dict[str, Any]) -> str:
+        """
+        Format prompt according to target model requirements
+        """
+        formatted = prompt
+        
+        # Add BREAK tokens for supported models
+        if kwargs.get('use_break', True) and target_model in ['SDXL', 'Pony', 'Stable Cascade']:
+            # Insert BREAK every 75 tokens (approximate)
+            words = formatted.split()
+            if len(words) > 75:
+                mid_point = len(words) // 2
+                words.insert(mid_point, 'BREAK')
+                formatted = ' '.join(words)
+        
+        # Add model-specific formatting
+        if target_model == 'MidJourney':
+            formatted = f"/imagine prompt: {formatted}"
+            if kwargs.get('aspect_ratio'):
+                formatted += f" --ar {kwargs['aspect_ratio']}"
+            if kwargs.get('seed'):
+                formatted += f" --seed {kwargs['seed']}"
+        
+        return formatted
 
-def get_facial_hair_description(hair: str) -> str:
-    if hair == 'any': return ''
-    return f"The male subject MUST have facial hair described as: {hair}. This is a strict visual requirement."
+PROMPT_ENGINE = PromptEngine()
 
 class PromptBuilderLocalNode:
     """
@@ -166,7 +3154,8 @@ class PromptBuilderLocalNode:
                 }),
                 "api_url": ("STRING", {
                     "default": "http://127.0.0.1:1234",
-                    "placeholder": "Local LLM API URL"
+                    "placeholder": "Local LLM API URL",
+                    "tooltip": "One or more comma-separated server URLs; several servers are load-balanced"
                 }),
                 "model_name": ("STRING", {
                     "default": "dolphin-2.7-mixtral-8x7b",
@@ -212,6 +3201,102 @@ class PromptBuilderLocalNode:
                     "max": 4000,
                     "step": 100
                 }),
+                "stream_response": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Stream the completion (SSE) so long generations are not cut by a fixed timeout"
+                }),
+                "stream_early_stop": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "When streaming, close the connection as soon as the prompt JSON object is complete instead of waiting for trailing text"
+                }),
+                "response_cache": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Reuse LLM responses for identical requests from an on-disk cache shared by all ComfyUI processes"
+                }),
+                "response_cache_ttl": ("INT", {
+                    "default": RESPONSE_CACHE_DEFAULT_TTL,
+                    "min": 0,
+                    "max": 30 * 86400,
+                    "step": 3600,
+                    "tooltip": "Seconds a cached response stays valid (0 = until evicted)"
+                }),
+                "result_cache": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Reuse finished prompts for identical requests from a bounded in-memory cache shared by all PromptBuilder nodes"
+                }),
+                "coalesce_requests": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "Identical requests (same servers, same payload) in flight at the same time share one LLM call and its answer; items of a batch are always sent as separate calls"
+                }),
+                "structured_output": (["off", "json_schema", "gbnf"], {
+                    "default": "off",
+                    "tooltip": "Constrain the LLM to the prompt JSON shape: json_schema sends an OpenAI-style response_format, gbnf sends a llama.cpp grammar"
+                }),
+                "structured_output_retries": ("INT", {
+                    "default": 2,
+                    "min": 0,
+                    "max": 5,
+                    "step": 1,
+                    "tooltip": "Extra LLM calls when a structured response still does not match the schema"
+                }),
+                "cache_friendly_prompt": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Put the long, unchanging part of the system prompt first and the per-request settings last, and ask llama.cpp to reuse the cached prefix (cache_prompt) so only the changed tail is prefilled"
+                }),
+                "llama_slot_id": ("INT", {
+                    "default": -1,
+                    "min": -1,
+                    "max": 255,
+                    "tooltip": "Pin requests to this llama.cpp server slot so they hit the same KV cache (-1 = let the server choose)"
+                }),
+                "system_prompt_budget": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 8192,
+                    "step": 64,
+                    "tooltip": "Target size of the system prompt in tokens (0 = full prompt). Content rules and character constraints are kept first, long glossaries are trimmed"
+                }),
+                "tag_retrieval_top_k": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 20,
+                    "tooltip": "Add up to this many tags per category from tags_db.json that best match the description to the system prompt (0 = off)"
+                }),
+                "connect_timeout": ("FLOAT", {
+                    "default": DEFAULT_CONNECT_TIMEOUT,
+                    "min": 0.5,
+                    "max": 60.0,
+                    "step": 0.5,
+                    "tooltip": "Seconds to wait for the LLM server to accept the connection"
+                }),
+                "read_timeout": ("FLOAT", {
+                    "default": DEFAULT_READ_TIMEOUT,
+                    "min": 5.0,
+                    "max": 600.0,
+                    "step": 5.0,
+                    "tooltip": "Seconds to wait for a complete (non-streamed) response"
+                }),
+                "max_retries": ("INT", {
+                    "default": DEFAULT_MAX_RETRIES,
+                    "min": 0,
+                    "max": 5,
+                    "step": 1,
+                    "tooltip": "Retries for connection errors, timeouts and 5xx responses"
+                }),
+                "circuit_breaker_threshold": ("INT", {
+                    "default": CIRCUIT_FAILURE_THRESHOLD,
+                    "min": 0,
+                    "max": 20,
+                    "step": 1,
+                    "tooltip": "Consecutive failed calls before the server is skipped for the cool-down (0 = never)"
+                }),
+                "circuit_breaker_cooldown": ("FLOAT", {
+                    "default": CIRCUIT_COOLDOWN,
+                    "min": 1.0,
+                    "max": 600.0,
+                    "step": 1.0,
+                    "tooltip": "Seconds to use offline enhancement before probing the server again"
+                }),
                 
                 # NSFW Settings
                 "nsfw_mode": (["off", "nsfw", "hardcore"], {
@@ -357,6 +3442,27 @@ class PromptBuilderLocalNode:
                     "default": False,
                     "tooltip": "Enable full randomization for batch generation"
                 }),
+                "prompts_per_request": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": 10,
+                    "step": 1,
+                    "tooltip": "Batch items generated by a single LLM call, sharing one system prompt"
+                }),
+                "multi_prompt_max_tokens": ("INT", {
+                    "default": MULTI_PROMPT_MAX_TOKENS,
+                    "min": 256,
+                    "max": 131072,
+                    "step": 256,
+                    "tooltip": "Largest max_tokens for one packed LLM call; fewer items are packed per call when prompts_per_request x max_tokens would exceed it"
+                }),
+                "max_concurrency": ("INT", {
+                    "default": 1,
+                    "min": 1,
+                    "max": MAX_BATCH_CONCURRENCY,
+                    "step": 1,
+                    "tooltip": "Batch items sent to each LLM server at the same time (1 = one at a time per server)"
+                }),
                 
                 # Selective Randomization (only visible when full_randomize_batch = True)
                 "random_locations": ("BOOLEAN", {
@@ -392,648 +3498,439 @@ class PromptBuilderLocalNode:
     
     RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "STRING")
     RETURN_NAMES = ("positive_prompt", "negative_prompt", "enhanced_description", "formatted_prompt", "batch_info")
-    FUNCTION = "generate_prompts"
+    FUNCTION = "generate_prompts_async" if ASYNC_NODES else "generate_prompts"
     CATEGORY = "PromptBuilder"
     DESCRIPTION = "Advanced Prompt Builder with Local LLM - Full Feature Set + Intelligent Batch Processing"
     
     def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'User-Agent': 'ComfyUI-PromptBuilder/2.0'
-        })
-        
-        # Presets data
-        self.shot_presets = {
-            "close-up": "close-up shot, detailed face, intimate framing",
-            "medium shot": "medium shot, waist up, balanced composition",
-            "full body": "full body shot, head to toe, complete figure",
-            "wide shot": "wide shot, environmental context, expansive view",
-            "extreme close-up": "extreme close-up, macro detail, intense focus",
-            "bird's eye": "bird's eye view, top-down perspective, aerial shot",
-            "low angle": "low angle shot, dramatic perspective, powerful composition",
-            "high angle": "high angle shot, looking down, diminished perspective"
-        }
-        
-        self.pose_presets = {
-            "standing": "standing pose, confident posture, natural stance",
-            "sitting": "sitting pose, relaxed position, comfortable seating",
-            "lying down": "lying down, reclining pose, horizontal position",
-            "walking": "walking pose, dynamic movement, stride in motion",
-            "running": "running pose, athletic movement, energetic motion",
-            "dancing": "dancing pose, graceful movement, rhythmic expression",
-            "jumping": "jumping pose, airborne moment, dynamic action",
-            "crouching": "crouching pose, low position, bent knees"
-        }
-        
-        self.location_presets = {
-            "studio": "professional studio, controlled lighting, clean background",
-            "outdoor": "outdoor setting, natural environment, open air",
-            "beach": "beach location, sandy shore, ocean waves",
-            "forest": "forest setting, trees and nature, woodland environment",
-            "city": "urban cityscape, buildings and streets, metropolitan area",
-            "bedroom": "bedroom interior, intimate space, private setting",
-            "office": "office environment, professional workspace, business setting",
-            "cafe": "cafe interior, cozy atmosphere, coffee shop ambiance"
-        }
-        
-        self.clothing_presets = {
-            "casual": "casual clothing, comfortable attire, everyday wear",
-            "formal": "formal attire, elegant clothing, sophisticated dress",
-            "business": "business attire, professional clothing, office wear",
-            "swimwear": "swimwear, beach attire, swimming costume",
-            "lingerie": "lingerie, intimate apparel, delicate undergarments",
-            "sportswear": "sportswear, athletic clothing, fitness attire",
-            "evening wear": "evening wear, glamorous dress, formal gown",
-            "vintage": "vintage clothing, retro style, classic fashion"
-        }
-    
-    def make_api_call(self, config: Dict[str, Any], messages: List[Dict[str, str]]) -> str:
-        """
-        Make API call to local LLM
-        """
-        # Validate API URL
-        api_url = config.get('api_url', '').strip()
-        if not api_url:
-            raise Exception("API URL is empty. Please provide a valid local LLM API URL.")
-        
-        if not api_url.startswith(('http://', 'https://')):
-            raise Exception(f"Invalid API URL format: {api_url}. Must start with http:// or https://")
-        
-        headers = {'Content-Type': 'application/json'}
-        
-        if config.get('api_key'):
-            headers['Authorization'] = f"Bearer {config['api_key']}"
-        
-        payload = {
-            "model": config['model_name'],
-            "messages": messages,
-            "temperature": config.get('temperature', 0.7),
-            "max_tokens": config.get('max_tokens', 2000),
-        }
-        
-        try:
-            response = self.session.post(
-                f"{api_url}/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'choices' not in data or not data['choices']:
-                    raise Exception("Invalid API response: missing 'choices' field")
-                return data['choices'][0]['message']['content']
-            elif response.status_code == 404:
-                raise Exception(f"API endpoint not found. Check if LLM server is running on {api_url}")
-            elif response.status_code == 401:
-                raise Exception("Authentication failed. Check API key if required.")
-            elif response.status_code == 500:
-                raise Exception("LLM server internal error. Check server logs.")
-            else:
-                raise Exception(f"API Error: {response.status_code} - {response.text}")
-                
-        except requests.exceptions.ConnectionError:
-            raise Exception(f"Cannot connect to LLM server at {api_url}. Check if server is running.")
-        except requests.exceptions.Timeout:
-            raise Exception(f"LLM server timeout. Server at {api_url} is not responding.")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Connection Error: {str(e)}")
+        # Connections come from the process-wide pools, shared with every other node
+        self.connection_pools = get_connection_pools()
+
+        # Presets data, shared read-only with the engine
+        self.shot_presets = PROMPT_ENGINE.shot_presets
+        self.pose_presets = PROMPT_ENGINE.pose_presets
+        self.location_presets = PROMPT_ENGINE.location_presets
+        self.clothing_presets = PROMPT_ENGINE.clothing_presets
     
+    # Prompt assembly is delegated to the shared PROMPT_ENGINE
     def get_quality_tags(self, target_model: str, style_main: str, style_sub: str) -> List[str]:
-        """
-        Get quality tags based on model and style
-        """
-        if style_main == 'anime':
-            return ['masterpiece', 'best quality', 'amazing quality', 'anime screenshot', 'absurdres']
-        
-        # Realistic styles
-        if style_sub == 'professional':
-            return ['photorealistic', 'professional photography', '8k', 'high detail', 'sharp focus', 'award-winning photograph']
-        elif style_sub == 'amateur':
-            return ['realistic photograph', 'candid shot', 'amateur photography', 'photographic grain', 'natural look', 'unposed']
-        elif style_sub == 'flash':
-            return ['flash photography', 'direct flash', 'harsh lighting', 'realistic', 'overexposed highlights', 'deep shadows', 'candid']
-        else:
-            return ['photorealistic', 'best quality', 'high detail']
+        return PROMPT_ENGINE.get_quality_tags(target_model, style_main, style_sub)
+    
+    def build_character_description(self, rng: Optional[random.Random] = None, **kwargs) -> str:
+        return PROMPT_ENGINE.build_character_description(rng, **kwargs)
+    
+    def apply_presets(self, preset_string: str, preset_dict: Dict[str, str]) -> List[str]:
+        return PROMPT_ENGINE.apply_presets(preset_string, preset_dict)
+    
+    def create_system_prompt(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str, **kwargs) -> str:
+        return PROMPT_ENGINE.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs)
+    
+    def create_system_prompt_parts(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str,
+                                   **kwargs) -> Tuple[str, str]:
+        return PROMPT_ENGINE.create_system_prompt_parts(target_model, style_main, style_sub, nsfw_mode, **kwargs)
+    
+    def system_prompt_fragments(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str,
+                                **kwargs) -> Dict[str, Any]:
+        return PROMPT_ENGINE.system_prompt_fragments(target_model, style_main, style_sub, nsfw_mode, **kwargs)
+    
+    def prepare_prompt_request(self, description: str, api_url: str, model_name: str, target_model: str,
+                               style_main: str, style_sub: str, **kwargs) -> Dict[str, Any]:
+        return PROMPT_ENGINE.prepare_prompt_request(description, api_url, model_name, target_model,
+                                                    style_main, style_sub, **kwargs)
+    
+    def build_full_description(self, description: str, rng: Optional[random.Random] = None, **kwargs) -> str:
+        return PROMPT_ENGINE.build_full_description(description, rng, **kwargs)
+    
+    def retrieve_relevant_tags(self, texts: List[str], **kwargs) -> List[Dict[str, List[str]]]:
+        return PROMPT_ENGINE.retrieve_relevant_tags(texts, **kwargs)
     
-    def build_character_description(self, **kwargs) -> str:
+    def build_prompt_request(self, full_description: str, api_url: str, model_name: str, target_model: str,
+                             style_main: str, style_sub: str, relevant_tags: Optional[Dict[str, List[str]]] = None,
+                             **kwargs) -> Dict[str, Any]:
+        return PROMPT_ENGINE.build_prompt_request(full_description, api_url, model_name, target_model,
+                                                  style_main, style_sub, relevant_tags, **kwargs)
+    
+    def result_cache_key(self, request: Dict[str, Any], target_model: str, style_main: str,
+                         style_sub: str, **kwargs) -> str:
+        return PROMPT_ENGINE.result_cache_key(request, target_model, style_main, style_sub, **kwargs)
+    
+    def finalize_prompts(self, positive_prompt: str, negative_prompt: str, enhanced_description: str,
+                         target_model: str, style_main: str, style_sub: str, **kwargs) -> Tuple[str, str, str, str]:
+        return PROMPT_ENGINE.finalize_prompts(positive_prompt, negative_prompt, enhanced_description,
+                                              target_model, style_main, style_sub, **kwargs)
+    
+    def create_smart_variation(self, base_description: str, iteration: int, full_randomize: bool,
+                               preserved_traits: str, variation_pools: dict,
+                               rng: Optional[random.Random] = None, **kwargs) -> str:
+        return PROMPT_ENGINE.create_smart_variation(base_description, iteration, full_randomize,
+                                                    preserved_traits, variation_pools, rng, **kwargs)
+    
+    def enhance_prompt_advanced(self, description: str, style_main: str, style_sub: str, **kwargs) -> str:
+        return PROMPT_ENGINE.enhance_prompt_advanced(description, style_main, style_sub, **kwargs)
+    
+    def format_for_model(self, prompt: str, target_model: str, kwargs: Dict[str, Any]) -> str:
+        return PROMPT_ENGINE.format_for_model(prompt, target_model, kwargs)
+    
+    def make_api_call(self, config: Dict[str, Any], messages: List[Dict[str, str]],
+                      validate: Optional[Callable[[str], bool]] = None) -> str:
         """
-        Build character description from settings with random support
+        Synchronous facade of make_api_call_async for ComfyUI's worker thread
         """
-        parts = []
-        
-        # Set up random seed if provided
-        random_seed = kwargs.get('random_seed', -1)
-        if random_seed != -1:
-            random.seed(random_seed)
-        
-        # Handle random gender selection
-        gender = kwargs.get('gender', 'any')
-        if gender == 'random':
-            gender = random.choice(['male', 'female'])
-        
-        # Basic demographics
-        if gender and gender != 'any':
-            parts.append(gender)
-        
-        # Random age if enabled
-        age_range = kwargs.get('age_range', 'any')
-        if kwargs.get('enable_random_generation') and age_range == 'any':
-            age_range = random.choice(['18s', '25s', '30s', '40s', '50s'])
-        
-        if age_range and age_range != 'any':
-            parts.append(f"{age_range} years old")
-        
-        # Random ethnicity if enabled
-        ethnicity = kwargs.get('ethnicity', 'any')
-        if kwargs.get('enable_random_generation') and ethnicity == 'any':
-            ethnicity_options = ['caucasian', 'european', 'asian', 'japanese', 'chinese', 'korean', 'african', 'hispanic']
-            ethnicity = random.choice(ethnicity_options)
-        
-        if ethnicity and ethnicity != 'any':
-            parts.append(ethnicity)
+        return get_async_runtime().run(self.make_api_call_async(config, messages, validate))
+    
+    @on_async_runtime
+    async def make_api_call_async(self, config: Dict[str, Any], messages: List[Dict[str, str]],
+                                  validate: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Make API call to local LLM. Responses rejected by validate are never
+        stored in, or served from, the response cache.
+        """
+        # Validate API URL(s)
+        endpoints = parse_endpoint_list(config.get('api_url', ''))
+        if not endpoints:
+            raise Exception("API URL is empty. Please provide a valid local LLM API URL.")
         
-        # Random body type if enabled
-        body_type = kwargs.get('body_type', 'any')
-        if kwargs.get('enable_random_generation') and body_type == 'any':
-            if gender == 'female':
-                body_type = random.choice(['slim', 'curvy', 'athletic', 'instagram model'])
-            elif gender == 'male':
-                body_type = random.choice(['slim', 'muscular', 'athletic', 'big muscular'])
+        for api_url in endpoints:
+            if not api_url.startswith(('http://', 'https://')):
+                raise Exception(f"Invalid API URL format: {api_url}. Must start with http:// or https://")
         
-        if body_type and body_type != 'any':
-            parts.append(f"{body_type} body type")
+        headers = {'Content-Type': 'application/json'}
         
-        # Random height if enabled
-        height_range = kwargs.get('height_range', 'any')
-        if kwargs.get('enable_random_generation') and height_range == 'any':
-            height_range = random.choice(['short', 'average', 'tall'])
+        if config.get('api_key'):
+            headers['Authorization'] = f"Bearer {config['api_key']}"
         
-        if height_range and height_range != 'any':
-            parts.append(height_range)
+        payload = {
+            "model": config['model_name'],
+            "messages": messages,
+            "temperature": config.get('temperature', 0.7),
+            "max_tokens": config.get('max_tokens', 2000),
+        }
         
-        # Gender-specific attributes with random support
-        if gender == 'female':
-            breast_size = kwargs.get('breast_size', 'any')
-            if kwargs.get('enable_random_generation') and breast_size == 'any':
-                breast_size = random.choice(['small', 'medium', 'large'])
-            if breast_size and breast_size != 'any':
-                parts.append(f"{breast_size} breasts")
-            
-            hips_size = kwargs.get('hips_size', 'any')
-            if kwargs.get('enable_random_generation') and hips_size == 'any':
-                hips_size = random.choice(['narrow', 'average', 'wide'])
-            if hips_size and hips_size != 'any':
-                parts.append(f"{hips_size} hips")
-            
-            butt_size = kwargs.get('butt_size', 'any')
-            if kwargs.get('enable_random_generation') and butt_size == 'any':
-                butt_size = random.choice(['small', 'average', 'large'])
-            if butt_size and butt_size != 'any':
-                parts.append(f"{butt_size} butt")
+        if config.get('stream'):
+            payload["stream"] = True
         
-        if gender == 'male':
-            muscle_definition = kwargs.get('muscle_definition', 'any')
-            if kwargs.get('enable_random_generation') and muscle_definition == 'any':
-                muscle_definition = random.choice(['toned', 'defined', 'ripped'])
-            if muscle_definition and muscle_definition != 'any':
-                parts.append(f"{muscle_definition} muscles")
-            
-            facial_hair = kwargs.get('facial_hair', 'any')
-            if kwargs.get('enable_random_generation') and facial_hair == 'any':
-                facial_hair = random.choice(['clean-shaven', 'stubble', 'goatee', 'full beard'])
-            if facial_hair and facial_hair != 'any':
-                parts.append(facial_hair)
-            
-            if kwargs.get('nsfw_mode') != 'off':
-                penis_size = kwargs.get('penis_size', 'any')
-                if kwargs.get('enable_random_generation') and penis_size == 'any':
-                    penis_size = random.choice(['average', 'large'])
-                if penis_size and penis_size != 'any':
-                    parts.append(f"{penis_size} penis")
+        # Constrain the output to the prompt JSON shape
+        structured_output = config.get('structured_output', 'off')
+        payload.update(structured_output_payload(structured_output, config.get('prompt_count', 1)))
         
-        # Add scene type context
-        scene_type = kwargs.get('scene_type', 'solo')
-        if scene_type and scene_type != 'solo':
-            if scene_type == 'couple':
-                parts.append("in a couple scene")
-            elif scene_type == 'threesome':
-                parts.append("in a threesome scene")
-            elif scene_type == 'group':
-                parts.append("in a group scene")
+        # Ask llama.cpp to keep the shared system prompt prefix in its KV cache
+        if config.get('cache_prompt'):
+            payload["cache_prompt"] = True
+            if config.get('slot_id', -1) >= 0:
+                payload["id_slot"] = config['slot_id']
         
-        # Add character style
-        character_style = kwargs.get('character_style', 'any')
-        if character_style and character_style != 'any':
-            if character_style == 'realistic':
-                parts.append("realistic style")
-            elif character_style == 'anime':
-                parts.append("anime style")
-            elif character_style == 'fantasy':
-                parts.append("fantasy style")
-            elif character_style == 'cyberpunk':
-                parts.append("cyberpunk style")
-            elif character_style == 'gothic':
-                parts.append("gothic style")
-            elif character_style == 'vintage':
-                parts.append("vintage style")
+        namespace = "local" if structured_output == 'off' else f"local:{structured_output}"
+        request_key = canonical_request_key(namespace, payload["model"], messages,
+                                            payload["temperature"], payload["max_tokens"])
         
-        # Add roleplay context
-        roleplay = kwargs.get('roleplay', 'none')
-        if roleplay and roleplay != 'none':
-            if roleplay == 'teacher_student':
-                parts.append("teacher-student roleplay")
-            elif roleplay == 'boss_employee':
-                parts.append("boss-employee roleplay")
-            elif roleplay == 'doctor_patient':
-                parts.append("doctor-patient roleplay")
-            elif roleplay == 'photographer_model':
-                parts.append("photographer-model roleplay")
-            elif roleplay == 'massage_therapist':
-                parts.append("massage therapist roleplay")
-            elif roleplay == 'personal_trainer':
-                parts.append("personal trainer roleplay")
-            elif roleplay == 'roommates':
-                parts.append("roommates roleplay")
-            elif roleplay == 'neighbors':
-                parts.append("neighbors roleplay")
-            elif roleplay == 'strangers':
-                parts.append("strangers roleplay")
-            elif roleplay == 'friends_with_benefits':
-                parts.append("friends with benefits roleplay")
+        async def fetch() -> str:
+            cache = get_response_cache() if config.get('response_cache') else None
+            content = await cache.get_async(request_key) if cache else None
+            if content is not None and validate and not validate(content):
+                content = None
+            if content is None:
+                content = await self.send_balanced_async(endpoints, headers, payload, config)
+                if cache and not isinstance(content, PartialResponse) and (validate is None or validate(content)):
+                    await cache.put_async(request_key, content,
+                                          config.get('response_cache_ttl', RESPONSE_CACHE_DEFAULT_TTL))
+            return content
         
-        # Start with appropriate article based on gender and scene type
-        if parts:
-            description = ', '.join(parts)
-            if scene_type == 'solo':
-                if gender == 'female':
-                    return f"the woman, {description}"
-                elif gender == 'male':
-                    return f"the man, {description}"
-                else:
-                    return f"the person, {description}"
-            else:
-                # For multi-person scenes, adjust the description
-                if gender == 'mixed' or scene_type in ['couple', 'threesome', 'group']:
-                    return f"the people, {description}"
-                elif gender == 'female':
-                    return f"the women, {description}"
-                elif gender == 'male':
-                    return f"the men, {description}"
-                else:
-                    return f"the people, {description}"
-        return ''
+        # Identical requests already in flight share a single upstream call
+        if config.get('coalesce_requests', True):
+            return await _single_flight.do(single_flight_key(endpoints, headers, payload), fetch)
+        return await fetch()
     
-    def apply_presets(self, preset_string: str, preset_dict: Dict[str, str]) -> List[str]:
+    async def send_balanced_async(self, endpoints: List[str], headers: Dict[str, str], payload: Dict[str, Any],
+                      config: Dict[str, Any]) -> str:
         """
-        Apply presets from comma-separated string
+        Send the request to the least busy healthy endpoint, failing over to
+        the remaining ones when it errors
         """
-        if not preset_string.strip():
-            return []
+        if len(endpoints) == 1:
+            return await self.send_chat_completion_async(endpoints[0], headers, payload, config)
         
-        presets = [p.strip().lower() for p in preset_string.split(',')]
-        applied = []
-        
-        for preset in presets:
-            if preset in preset_dict:
-                applied.append(preset_dict[preset])
+        tried = []
+        last_error = None
+        while len(tried) < len(endpoints):
+            api_url = _endpoint_balancer.acquire(endpoints, exclude=tried)
+            if api_url is None:
+                break
+            tried.append(api_url)
+            # Fail over to another server instead of retrying this one
+            attempt_config = config if len(tried) == len(endpoints) else dict(config, max_retries=0)
+            started = time.monotonic()
+            try:
+                content = await self.send_chat_completion_async(api_url, headers, payload, attempt_config)
+            except Exception as e:
+                _endpoint_balancer.release(api_url, failed=True)
+                print(f"⚠️ LLM server {api_url} failed, trying next server: {str(e)}")
+                last_error = e
+                continue
+            _endpoint_balancer.release(api_url, latency=time.monotonic() - started)
+            return content
         
-        return applied
+        if last_error is None:
+            raise Exception(f"All {len(endpoints)} LLM servers are marked offline after repeated failures.")
+        raise Exception(f"All LLM servers failed. Last error: {str(last_error)}")
     
-    def create_system_prompt(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str, **kwargs) -> str:
+    async def send_chat_completion_async(self, api_url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                                         config: Optional[Dict[str, Any]] = None) -> str:
         """
-        Create comprehensive system prompt for LLM
+        POST a chat completion request through the endpoint's circuit breaker,
+        retrying transient failures with jittered exponential backoff
         """
-        # Get anime style if anime is selected
-        anime_style = kwargs.get('anime_style', 'ghibli') if style_main == 'anime' else None
-        
-        style_guidance = {
-            "realistic": "Focus on photorealistic, detailed descriptions. Include professional photography terms like depth of field, bokeh, natural lighting, studio lighting, three-point lighting, 85mm f/1.8 lens, high dynamic range, sharp focus, shallow depth of field, golden hour lighting, blue hour, rim lighting, backlighting, side lighting, soft shadows, harsh shadows, overcast lighting, direct flash, bounce flash, fill light, key light, hair light, catchlights in eyes, lens flare, chromatic aberration, film grain, noise reduction, high ISO, low ISO, fast shutter speed, slow shutter speed, motion blur, image stabilization, white balance, color temperature, saturation, contrast, vibrancy, clarity, dehaze, vignetting, perspective distortion, focal length, aperture, f-stop, exposure compensation, metering mode, center-weighted, spot metering, evaluative metering, histogram, dynamic range, highlight recovery, shadow detail, black point, white point, midtones, curves adjustment, levels adjustment, color grading, split toning, HSL adjustments, sharpening, noise reduction, lens correction, profile correction, distortion correction, chromatic aberration correction, vignette correction, perspective correction, crop factor, full frame, APS-C, medium format, large format, prime lens, zoom lens, telephoto lens, wide-angle lens, fisheye lens, macro lens, tilt-shift lens, image sensor, CMOS, CCD, Bayer filter, anti-aliasing filter, low-pass filter, optical low-pass filter, image processor, RAW format, JPEG compression, lossless compression, bit depth, color space, sRGB, Adobe RGB, ProPhoto RGB, gamut, color management, ICC profile, monitor calibration, printer calibration, soft proofing, hard proofing, print resolution, DPI, PPI, interpolation, resampling, upscaling, downscaling, aliasing, moiré, compression artifacts, banding, posterization, dithering, color cast, color shift, white balance shift, exposure shift, contrast shift, saturation shift, vibrancy shift, clarity shift, dehaze shift, vignetting shift, perspective shift, distortion shift, chromatic aberration shift, lens flare shift, motion blur shift, focus shift, depth of field shift, bokeh shift, sharpness shift, noise shift, grain shift, texture shift, detail shift, dynamic range shift, highlight shift, shadow shift, midtone shift, black point shift, white point shift, curves shift, levels shift, color grading shift, split toning shift, HSL shift, sharpening shift, noise reduction shift, lens correction shift, profile correction shift, distortion correction shift, chromatic aberration correction shift, vignette correction shift, perspective correction shift, crop shift, format shift, sensor shift, processor shift, format conversion, color space conversion, gamut conversion, profile conversion, calibration shift, proofing shift, resolution shift, DPI shift, PPI shift, interpolation shift, resampling shift, upscaling shift, downscaling shift, aliasing shift, moiré shift, compression artifacts shift, banding shift, posterization shift, dithering shift, color cast shift, color shift shift.",
-            "anime": f"Focus on anime and manga style descriptions. Use {anime_style} anime art style specifically. Include character design elements and anime-specific terminology."
-        }
+        import asyncio
+        config = config or {}
+        breaker = get_circuit_breaker(
+            api_url,
+            config.get('circuit_breaker_threshold', CIRCUIT_FAILURE_THRESHOLD),
+            config.get('circuit_breaker_cooldown', CIRCUIT_COOLDOWN)
+        )
+        if not breaker.allow_request():
+            raise Exception(f"LLM server at {api_url} is marked offline after repeated failures. "
+                            f"Retrying in {breaker.remaining_cooldown():.0f}s.")
         
-        # Add sub-style specific guidance for realistic
-        style_sub = kwargs.get('style_sub', 'any')
-        if style_main == 'realistic' and style_sub != 'any':
-            if style_sub == 'amateur':
-                style_guidance["realistic"] += " The 'amateur' sub-style requires a candid, unposed, and natural look. AVOID descriptions of perfect compositions, professional studio lighting, or overly idealized subjects. The scene should feel spontaneous and authentic, like a photo taken by a friend."
-            elif style_sub == 'professional':
-                style_guidance["realistic"] += " The 'professional' sub-style implies a high-quality, well-composed shot. Focus on photographic details like camera models, lens types (e.g., 85mm f/1.8), and specific lighting setups (e.g., three-point lighting)."
-            elif style_sub == 'flash':
-                style_guidance["realistic"] += " The 'flash' sub-style implies direct, on-camera flash. Describe harsh shadows, bright highlights, and a 'paparazzi', 'nightclub', or 'disposable camera' feel."
-        
-        # Enhanced anime style guidance
-        anime_style_details = {
-            "ghibli": "Studio Ghibli style - soft, detailed, magical atmosphere, beautiful landscapes, expressive characters",
-            "naruto": "Naruto anime style - dynamic action poses, ninja themes, vibrant colors, spiky hair designs",
-            "bleach": "Bleach anime style - sharp character designs, dramatic lighting, gothic elements, spiritual themes",
-            "one_piece": "One Piece anime style - exaggerated proportions, colorful characters, adventure themes, unique character designs",
-            "attack_on_titan": "Attack on Titan style - dark atmosphere, detailed military gear, intense expressions, apocalyptic themes",
-            "demon_slayer": "Demon Slayer style - traditional Japanese elements, flowing water/fire effects, detailed sword techniques",
-            "your_name": "Your Name anime style - realistic anime, beautiful lighting, emotional expressions, modern settings",
-            "spirited_away": "Spirited Away style - magical creatures, detailed fantasy worlds, soft color palettes",
-            "princess_mononoke": "Princess Mononoke style - nature themes, forest spirits, detailed environmental art",
-            "akira": "Akira anime style - cyberpunk aesthetic, detailed mechanical designs, neon colors, futuristic themes",
-            "ghost_in_shell": "Ghost in the Shell style - cyberpunk, detailed technology, philosophical themes, futuristic cityscapes",
-            "cowboy_bebop": "Cowboy Bebop style - space western, jazz age aesthetic, detailed spacecraft, noir atmosphere",
-            "evangelion": "Evangelion style - mecha designs, psychological themes, religious symbolism, detailed mechanical art",
-            "sailor_moon": "Sailor Moon style - magical girl aesthetic, sparkles and ribbons, cute character designs, pastel colors",
-            "dragon_ball": "Dragon Ball style - muscular characters, energy auras, dynamic fighting poses, spiky hair",
-            "pokemon": "Pokemon anime style - cute creatures, bright colors, adventure themes, friendly character designs",
-            "jojo": "JoJo's Bizarre Adventure style - dramatic poses, detailed clothing, unique character designs, flamboyant style",
-            "death_note": "Death Note style - dark gothic aesthetic, detailed character expressions, psychological thriller themes",
-            "fullmetal_alchemist": "Fullmetal Alchemist style - detailed alchemy symbols, steampunk elements, emotional character designs",
-            "my_hero_academia": "My Hero Academia style - superhero themes, dynamic action, colorful costumes, expressive characters"
-        }
-        
-        if anime_style and anime_style in anime_style_details:
-            style_guidance["anime"] += f" Specifically: {anime_style_details[anime_style]}"
-        
-        nsfw_guidance = ""
-        nsfw_level = kwargs.get('nsfw_level', 5)
-        hardcore_level = kwargs.get('hardcore_level', 5)
-        
-        if nsfw_mode == "nsfw":
-            intensity_descriptions = {
-                1: "subtle sensuality, gentle curves, soft lighting, romantic atmosphere",
-                2: "mild suggestive elements, alluring poses, seductive glances, sensual undertones",
-                3: "provocative clothing, revealing outfits, suggestive positioning, enticing expressions",
-                4: "partial nudity, bare skin, intimate apparel, seductive atmosphere, tempting scenarios",
-                5: "provocative, seductive, enticing, erotic, sensual, alluring, tempting, flirtatious, suggestive, intimate",
-                6: "explicit sensuality, detailed anatomy, provocative situations, intense erotic tension",
-                7: "highly suggestive content, graphic intimate details, passionate scenarios, wild sensuality",
-                8: "extremely provocative, graphic intimate descriptions, detailed erotic elements, intense passion",
-                9: "maximum suggestive content, full explicit sensuality, graphic intimate scenarios, wild passion",
-                10: "ultimate suggestive content, complete explicit details, maximum erotic intensity, graphic intimate descriptions"
-            }
-            intensity = intensity_descriptions.get(nsfw_level, "moderate suggestive content")
-            nsfw_guidance = f"ALWAYS include these specific elements: {intensity}. Use these words directly in the prompt. Be explicit and detailed."
-        elif nsfw_mode == "hardcore":
-            intensity_descriptions = {
-                1: "mild explicit elements, sensual touching, gentle caressing, soft intimacy",
-                2: "subtle explicit content, intimate contact, gentle exploration, sensual interaction",
-                3: "moderate explicit content, passionate kissing, intimate touching, sensual exploration",
-                4: "noticeable explicit content, heavy petting, intimate contact, sensual activities",
-                5: "explicit sexual activities, detailed intimate interactions, graphic sexual descriptions, intense passion, sexual intercourse, penetration, orgasm, climax, sexual positions, sexual acts",
-                6: "very explicit content, graphic sexual activities, detailed intimate scenarios, wild passion, multiple sexual positions, group activities, BDSM elements, fetish content",
-                7: "highly explicit, graphic sexual descriptions, detailed intimate interactions, intense sexual scenarios, extreme sexual acts, hardcore BDSM, fetish exploration",
-                8: "extremely explicit, complete sexual details, graphic intimate activities, wild sexual passion, taboo scenarios, extreme fetishes, hardcore sexual content",
-                9: "maximum explicit content, full graphic sexual details, complete intimate scenarios, ultimate sexual intensity, extreme hardcore acts, all sexual taboos",
-                10: "ultimate explicit content, complete graphic sexual details, maximum sexual intensity, all possible sexual acts and taboos, no restrictions"
-            }
-            intensity = intensity_descriptions.get(hardcore_level, "moderate explicit content")
-            nsfw_guidance = f"ALWAYS include these specific elements: {intensity}. Use these words directly in the prompt. Be explicit and detailed."
-        
-        # Check if random generation is enabled
-        random_mode = kwargs.get('enable_random_generation', False)
-        random_guidance = ""
-        if random_mode:
-            random_intensity = kwargs.get('random_intensity', 0.5)
-            # Balanced creative guidance
-            random_guidance = f"\n\nRANDOM MODE ENABLED (Intensity: {random_intensity}):\n- Generate creative and unexpected elements\n- Add surprising details and compositions\n- Be imaginative and artistic within constraints\n- Include unique and interesting variations\n- Keep wording clear and concrete; avoid overly poetic metaphors"
-        
-        # Creative scope rules (applies to all generations)
-        imagination_guidance = "\n\nCREATIVE SCOPE RULES:\n- You may introduce additional creative elements (camera angle, composition, color palette, atmosphere, props) that fit the user's constraints.\n- Keep descriptions vivid but grounded; avoid flowery or metaphorical language unless explicitly requested.\n- Ensure coherence with selected presets and Content Rules."
-        
-        # Character constraints
-        character_guidance = ""
-        gender = kwargs.get('gender', 'any')
-        body_type = kwargs.get('body_type', 'any')
-        ethnicity = kwargs.get('ethnicity', 'any')
-        height_range = kwargs.get('height_range', 'any')
+        connect_timeout = config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT)
+        read_timeout = STREAM_IDLE_TIMEOUT if payload.get('stream') else config.get('read_timeout', DEFAULT_READ_TIMEOUT)
+        max_retries = max(0, config.get('max_retries', DEFAULT_MAX_RETRIES))
         
-        if gender != 'any':
-            if gender == 'male':
-                character_guidance += f"\n- **Gender Constraint**: All individuals depicted in the scene MUST be male. Do not include any other genders."
-            elif gender == 'female':
-                character_guidance += f"\n- **Gender Constraint**: All individuals depicted in the scene MUST be female. Do not include any other genders."
-            elif gender == 'mixed':
-                character_guidance += f"\n- **Gender Constraint**: The scene MUST include both male and female individuals."
-        
-        age_range = kwargs.get('age_range', 'any')
-        if age_range != 'any':
-            character_guidance += f"\n- **Age Constraint**: The main subject's age MUST be in the '{age_range}' range."
-        
-        if body_type != 'any' and (gender == 'male' or gender == 'female'):
-            character_guidance += f"\n- **Body Type Constraint**: {get_body_type_description(gender, body_type)}"
-
-        if ethnicity != 'any': 
-            character_guidance += f"\n- **Ethnicity Constraint**: {get_ethnicity_description(ethnicity)}"
-            
-        if height_range != 'any':
-            character_guidance += f"\n- **Height Constraint**: {get_height_description(height_range)}"
-
-        # Female specific constraints
-        if gender == 'female':
-            breast_size = kwargs.get('breast_size', 'any')
-            if breast_size != 'any':
-                character_guidance += f"\n- **Breast Size Constraint**: {get_breast_size_description(breast_size)}"
-                
-            hips_size = kwargs.get('hips_size', 'any')
-            if hips_size != 'any':
-                character_guidance += f"\n- **Hips Size Constraint**: {get_hips_size_description(hips_size)}"
-                
-            butt_size = kwargs.get('butt_size', 'any')
-            if butt_size != 'any':
-                character_guidance += f"\n- **Butt Size Constraint**: {get_butt_size_description(butt_size)}"
-
-        # Male specific constraints  
-        if gender == 'male':
-            muscle_definition = kwargs.get('muscle_definition', 'any')
-            if muscle_definition != 'any':
-                character_guidance += f"\n- **Muscle Definition Constraint**: {get_muscle_definition_description(muscle_definition)}"
-                
-            facial_hair = kwargs.get('facial_hair', 'any')
-            if facial_hair != 'any':
-                character_guidance += f"\n- **Facial Hair Constraint**: {get_facial_hair_description(facial_hair)}"
-                
-            nsfw_mode = kwargs.get('nsfw_mode', 'off')
-            if nsfw_mode in ['nsfw', 'hardcore']:
-                penis_size = kwargs.get('penis_size', 'any')
-                if penis_size != 'any':
-                    character_guidance += f"\n- **Penis Size Constraint**: {get_penis_size_description(penis_size)}"
+        for attempt in range(max_retries + 1):
+            # Other requests may have opened the circuit while this one waited to retry
+            if attempt and not breaker.allow_request():
+                raise Exception(f"LLM server at {api_url} is marked offline after repeated failures. "
+                                f"Retrying in {breaker.remaining_cooldown():.0f}s.")
+            try:
+                # A single prompt object can end the stream as soon as it closes
+                parser = None
+                if payload.get('stream') and config.get('stream_early_stop', True) and config.get('prompt_count', 1) == 1:
+                    parser = StreamingPromptParser(config.get('on_prompt_field'))
+                content = await self.post_chat_completion_async(api_url, headers, payload,
+                                                                (connect_timeout, read_timeout), parser)
+            except TransientAPIError as e:
+                # Every failed attempt counts, so a hung server opens the circuit quickly
+                breaker.record_failure()
+                if e.retryable and attempt < max_retries:
+                    delay = retry_backoff_delay(attempt)
+                    print(f"⚠️ {str(e)} Retrying in {delay:.2f}s ({attempt + 1}/{max_retries})")
+                    await asyncio.sleep(delay)
+                    continue
+                raise Exception(str(e))
+            except Exception:
+                # The server answered, so the endpoint itself is reachable
+                breaker.record_success()
+                raise
+            breaker.record_success()
+            return content
+    
+    async def post_chat_completion_async(self, api_url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                                         timeout: Tuple[float, float],
+                                         parser: Optional[StreamingPromptParser] = None) -> str:
+        """
+        Single POST to /v1/chat/completions returning the message content
+        """
+        import asyncio
+        import aiohttp
+        stream = bool(payload.get('stream'))
+        session = get_connection_pools().session()
+        try:
+            async with session.post(
+                f"{api_url}/v1/chat/completions",
+                headers=headers,
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=timeout[0], sock_read=timeout[1])
+            ) as response:
+                if response.status == 200 and stream:
+                    max_chars = payload["max_tokens"] * STREAM_MAX_CHARS_PER_TOKEN
+                    return await self.read_streamed_completion_async(response, max_chars, parser)
+                text = await response.text(errors='replace')
+        except asyncio.TimeoutError as e:
+            # aiohttp < 3.10 cannot tell connect timeouts apart, those are not retried either
+            connect_timeout_error = getattr(aiohttp, 'ConnectionTimeoutError', None)
+            if connect_timeout_error is not None and isinstance(e, connect_timeout_error):
+                raise TransientAPIError(f"Cannot connect to LLM server at {api_url} in time. Check if server is running.")
+            raise TransientAPIError(f"LLM server timeout. Server at {api_url} is not responding.", retryable=False)
+        except aiohttp.ClientConnectorError:
+            raise TransientAPIError(f"Cannot connect to LLM server at {api_url}. Check if server is running.")
+        except aiohttp.ClientError as e:
+            raise TransientAPIError(f"LLM server at {api_url} sent a broken response: {str(e)}", retryable=False)
         
-        # Scene type constraints
-        scene_type = kwargs.get('scene_type', 'solo')
-        scene_guidance = ""
-        if scene_type != 'solo':
-            if scene_type == 'couple':
-                scene_guidance = "\n- **Scene Type Constraint**: This MUST be a couple scene with exactly two people interacting romantically or intimately."
-            elif scene_type == 'threesome':
-                scene_guidance = "\n- **Scene Type Constraint**: This MUST be a threesome scene with exactly three people in intimate interaction."
-            elif scene_type == 'group':
-                scene_guidance = "\n- **Scene Type Constraint**: This MUST be a group scene with multiple people (4 or more) in social or intimate interaction."
+        if response.status == 200:
+            try:
+                data = json.loads(text)
+            except ValueError:
+                raise TransientAPIError(f"LLM server at {api_url} answered with invalid JSON", retryable=False)
+            if 'choices' not in data or not data['choices']:
+                raise Exception("Invalid API response: missing 'choices' field")
+            _prefix_cache_stats.record(data)
+            return data['choices'][0]['message']['content']
+        elif response.status == 404:
+            raise Exception(f"API endpoint not found. Check if LLM server is running on {api_url}")
+        elif response.status == 401:
+            raise Exception("Authentication failed. Check API key if required.")
+        elif response.status == 500:
+            raise TransientAPIError("LLM server internal error. Check server logs.")
+        elif response.status in RETRYABLE_STATUS_CODES:
+            raise TransientAPIError(f"API Error: {response.status} - {text}", retryable=response.status >= 500)
         else:
-            scene_guidance = "\n- **Scene Type Constraint**: This MUST be a solo scene featuring a single individual. Do NOT include multiple people or partner interactions."
-        
-        # Character style constraints
-        character_style = kwargs.get('character_style', 'any')
-        style_guidance_extra = ""
-        if character_style != 'any':
-            if character_style == 'realistic':
-                style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have realistic, photographic appearance with natural proportions and features."
-            elif character_style == 'anime':
-                style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have anime/manga style with stylized features, large eyes, and anime proportions."
-            elif character_style == 'fantasy':
-                style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have fantasy elements like magical features, mythical attributes, or supernatural appearance."
-            elif character_style == 'cyberpunk':
-                style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have cyberpunk aesthetic with futuristic implants, neon colors, and high-tech elements."
-            elif character_style == 'gothic':
-                style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have gothic style with dark clothing, pale skin, dramatic makeup, and gothic accessories."
-            elif character_style == 'vintage':
-                style_guidance_extra = "\n- **Character Style Constraint**: Characters MUST have vintage/retro appearance with period-appropriate clothing and styling."
+            raise Exception(f"API Error: {response.status} - {text}")
+    
+    async def read_streamed_completion_async(self, response: 'aiohttp.ClientResponse', max_chars: int,
+                                             parser: Optional[StreamingPromptParser] = None) -> str:
+        """
+        Collect the content deltas of a server-sent-event chat completion.
+        Each chunk must arrive within the idle timeout; output longer than
+        max_chars is cut off and the connection closed. With a parser the
+        stream is also closed as soon as the prompt object is complete. A
+        stream that did not finish comes back as a PartialResponse.
+        """
+        import asyncio
+        import aiohttp
+        parts = []
+        total = 0
+        finished = False
+        try:
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8', 'replace').strip()
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    finished = True
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                if 'error' in chunk:
+                    raise Exception(f"API Error: {chunk['error']}")
+                _prefix_cache_stats.record(chunk)
+                choices = chunk.get('choices') or []
+                if not choices:
+                    continue
+                delta = choices[0].get('delta') or choices[0].get('message') or {}
+                content = delta.get('content')
+                if content:
+                    parts.append(content)
+                    total += len(content)
+                    if total > max_chars:
+                        print(f"⚠️ Stream exceeded {max_chars} characters, aborting generation")
+                        break
+                    if parser:
+                        parser.feed(content)
+                        if parser.complete:
+                            # Skip whatever the model appends after the JSON
+                            finished = True
+                            break
+                if choices[0].get('finish_reason'):
+                    finished = True
+                    break
+        except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+            # ValueError: a line longer than aiohttp's read buffer
+            reason = str(e) or type(e).__name__
+            if not parts:
+                raise TransientAPIError(f"LLM server stopped streaming: {reason}", retryable=False)
+            print(f"⚠️ Stream interrupted, using partial response: {reason}")
+        finally:
+            if not response.content.at_eof():
+                # Drop the connection instead of reading the rest of the stream
+                response.close()
         
-        # Roleplay constraints
-        roleplay = kwargs.get('roleplay', 'none')
-        roleplay_guidance = ""
-        if roleplay != 'none':
-            if roleplay == 'teacher_student':
-                roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include teacher-student roleplay dynamic with appropriate setting (classroom, office) and power dynamic."
-            elif roleplay == 'boss_employee':
-                roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include boss-employee roleplay dynamic with office setting and workplace power dynamic."
-            elif roleplay == 'doctor_patient':
-                roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include doctor-patient roleplay dynamic with medical setting and professional/patient relationship."
-            elif roleplay == 'police_criminal':
-                roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include police-criminal roleplay dynamic with law enforcement setting and authority/suspect relationship."
-            elif roleplay == 'maid_master':
-                roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include maid-master roleplay dynamic with domestic setting and service/authority relationship."
-            elif roleplay == 'nurse_patient':
-                roleplay_guidance = "\n- **Roleplay Constraint**: Scene MUST include nurse-patient roleplay dynamic with medical setting and caregiver/patient relationship."
-        
-        # Create tags database reference for LLM
-        tags_reference = ""
-        if TAGS_DB:
-            # Create a condensed reference of available tags for the LLM
-            tags_reference = f"""
-- **Tags Database Reference**: You have access to a comprehensive tags database with the following categories:
-  * Quality Tags: {len(TAGS_DB.get('quality_tags', []))} professional quality descriptors
-  * Technical Styles: {len(TAGS_DB.get('technical_styles', []))} technical photography/art terms
-  * Character Subjects: Multiple gender/type categories with {sum(len(TAGS_DB.get(f'subjects_{cat}', [])) for cat in ['female', 'male', 'couple', 'futanari', 'trans_female', 'trans_male', 'femboy'])} character descriptors
-  * Character Styles: {len(TAGS_DB.get('character_styles', []))} style variations
-  * Body Types: {len(TAGS_DB.get('body_types', []))} body type descriptors
-  * Hair Styles: {len(TAGS_DB.get('hair_styles', []))} hair variations
-  * Clothing: {len(TAGS_DB.get('clothing', []))} clothing options
-  * Poses: {len(TAGS_DB.get('poses', []))} pose variations
-  * Lighting: {len(TAGS_DB.get('lighting', []))} lighting setups
-  * Sexual Acts: {len(TAGS_DB.get('sexual_acts', []))} intimate activities (NSFW)
-  * Roleplay Scenarios: {len(TAGS_DB.get('roleplay_scenarios', []))} roleplay contexts
-  Use these references to enhance prompt accuracy and variety."""
-
-        return f"""You are an advanced AI assistant specialized in generating detailed image prompts for the {target_model} model.
-
-Target Model: {target_model}
-Style: {style_main} ({style_sub})
-NSFW Mode: {nsfw_mode}
-NSFW Level: {nsfw_level}/10
-Hardcore Level: {hardcore_level}/10
-
-Style Guidance: {style_guidance.get(style_main, style_guidance['realistic'])}
-{nsfw_guidance}{random_guidance}{imagination_guidance}{character_guidance}{scene_guidance}{style_guidance_extra}{roleplay_guidance}{tags_reference}
-
-Generate enhanced prompts that are:
-1. Highly detailed and specific
-2. Optimized for {target_model}
-3. Appropriate for {style_main} style
-4. Include relevant technical terms
-5. Consider lighting, composition, and atmosphere
-
-Return a JSON object with:
-{{
-    "positive": "detailed positive prompt",
-    "negative": "negative prompt elements",
-    "enhanced_description": "enhanced scene description"
-}}"""
+        if not parts:
+            raise Exception("Invalid API response: stream contained no content")
+        if not finished:
+            return PartialResponse(''.join(parts))
+        return ''.join(parts)
     
     def generate_prompts(self, description: str, api_url: str, model_name: str, target_model: str,
                         style_main: str, style_sub: str, num_variations: int, **kwargs) -> Tuple[str, str, str, str, str]:
         """
+        Synchronous entry point for hosts that call node functions directly
+        """
+        return get_async_runtime().run(self.generate_prompts_async(
+            description, api_url, model_name, target_model, style_main, style_sub, num_variations, **kwargs
+        ))
+    
+    @on_async_runtime
+    async def generate_prompts_async(self, description: str, api_url: str, model_name: str, target_model: str,
+                                     style_main: str, style_sub: str, num_variations: int,
+                                     **kwargs) -> Tuple[str, str, str, str, str]:
+        """
         Generate enhanced prompts with full feature set and intelligent batch processing
         """
-        print(f"🔍 DEBUG: generate_prompts called - entry point")
+        debug_log(f"🔍 DEBUG: generate_prompts called - entry point")
         try:
             # Check if batch processing is enabled
             enable_batch = kwargs.get('enable_batch', False)
-            print(f"🔍 DEBUG: enable_batch = {enable_batch}")
+            debug_log(f"🔍 DEBUG: enable_batch = {enable_batch}")
             
-            if enable_batch:
-                print(f"🔍 DEBUG: Calling generate_batch_with_smart_randomization")
-                return self.generate_batch_with_smart_randomization(
-                    description, api_url, model_name, target_model, 
-                    style_main, style_sub, num_variations, **kwargs
-                )
-            else:
-                # Single prompt generation (original logic)
-                print(f"🔍 DEBUG: Calling generate_single_prompt")
-                return self.generate_single_prompt(
-                    description, api_url, model_name, target_model,
-                    style_main, style_sub, num_variations, **kwargs
-                )
+            # One tags database for the whole request, even if tags_db.json is reloaded meanwhile
+            with tags_db_snapshot():
+                if enable_batch:
+                    debug_log(f"🔍 DEBUG: Calling generate_batch_with_smart_randomization")
+                    return await self.generate_batch_with_smart_randomization_async(
+                        description, api_url, model_name, target_model, 
+                        style_main, style_sub, num_variations, **kwargs
+                    )
+                else:
+                    # Single prompt generation (original logic)
+                    debug_log(f"🔍 DEBUG: Calling generate_single_prompt")
+                    return await self.generate_single_prompt_async(
+                        description, api_url, model_name, target_model,
+                        style_main, style_sub, num_variations, **kwargs
+                    )
                 
         except Exception as e:
-            print(f"🔍 DEBUG: OUTER EXCEPTION CAUGHT: {str(e)}")
-            print(f"🔍 DEBUG: This outer try-catch may be interfering with fallback behavior!")
+            debug_log(f"🔍 DEBUG: OUTER EXCEPTION CAUGHT: {str(e)}")
+            debug_log(f"🔍 DEBUG: This outer try-catch may be interfering with fallback behavior!")
             error_msg = f"❌ Prompt Generation Error: {str(e)}"
             return (error_msg, error_msg, error_msg, error_msg, error_msg)
     
-    def generate_single_prompt(self, description: str, api_url: str, model_name: str, target_model: str,
-                              style_main: str, style_sub: str, num_variations: int, **kwargs) -> Tuple[str, str, str, str, str]:
+    async def generate_single_prompt_async(self, description: str, api_url: str, model_name: str, target_model: str,
+                                           style_main: str, style_sub: str, num_variations: int,
+                                           **kwargs) -> Tuple[str, str, str, str, str]:
         """
         Generate single prompt (original functionality)
         """
         # DEBUG: Log entry point
-        print(f"🔍 DEBUG: generate_single_prompt called with API URL: {api_url}")
-        print(f"🔍 DEBUG: Description: {description}")
-        
-        # Build character description
-        character_desc = self.build_character_description(**kwargs)
-        
-        # Apply presets
-        shot_elements = self.apply_presets(kwargs.get('shot_presets', ''), self.shot_presets)
-        pose_elements = self.apply_presets(kwargs.get('pose_presets', ''), self.pose_presets)
-        location_elements = self.apply_presets(kwargs.get('location_presets', ''), self.location_presets)
-        clothing_elements = self.apply_presets(kwargs.get('clothing_presets', ''), self.clothing_presets)
-        
-        # Combine all elements
-        full_description = description
-        if character_desc:
-            full_description += f", {character_desc}"
+        debug_log(f"🔍 DEBUG: generate_single_prompt called with API URL: {api_url}")
+        debug_log(f"🔍 DEBUG: Description: {description}")
         
-        preset_elements = shot_elements + pose_elements + location_elements + clothing_elements
-        if preset_elements:
-            full_description += f", {', '.join(preset_elements)}"
+        request = self.prepare_prompt_request(description, api_url, model_name, target_model,
+                                              style_main, style_sub, **kwargs)
+        positive_prompt, negative_prompt, enhanced_description, formatted_prompt = await self.complete_prompt_request_async(
+            request, target_model, style_main, style_sub, **kwargs
+        )
         
-        # Create system prompt
-        nsfw_mode = kwargs.get('nsfw_mode', 'off')
-        # Remove nsfw_mode from kwargs to avoid duplicate argument error
-        kwargs_copy = kwargs.copy()
-        kwargs_copy.pop('nsfw_mode', None)
-        system_prompt = self.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs_copy)
+        # Single prompt info
+        batch_info = f"📝 Single Prompt Generated\n{request['system_prompt_info']}"
         
-        # API configuration
-        config = {
-            'api_url': api_url.rstrip('/'),
-            'model_name': model_name,
-            'api_key': kwargs.get('api_key', ''),
-            'temperature': kwargs.get('temperature', 0.7),
-            'max_tokens': kwargs.get('max_tokens', 2000)
-        }
+        return (positive_prompt, negative_prompt, enhanced_description, formatted_prompt, batch_info)
+    
+    async def complete_prompt_request_async(self, request: Dict[str, Any], target_model: str, style_main: str,
+                                            style_sub: str, **kwargs) -> Tuple[str, str, str, str]:
+        """
+        Send a prepared request to the LLM and build the final prompts
+        """
+        full_description = request['full_description']
+        config = request['config']
+        messages = request['messages']
         
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Create enhanced prompts for: {full_description}"}
-        ]
+        cache = get_result_cache() if kwargs.get('result_cache') else None
+        if cache:
+            cache_key = self.result_cache_key(request, target_model, style_main, style_sub, **kwargs)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
         
         # Try to make API call, fallback to basic prompt if LLM is not available
-        print(f"🔍 DEBUG: About to call make_api_call with config: {config['api_url']}")
+        debug_log(f"🔍 DEBUG: About to call make_api_call with config: {config['api_url']}")
         try:
-            response = self.make_api_call(config, messages)
-            print(f"🔍 DEBUG: API call successful, response length: {len(response)}")
+            response, result = await self.request_structured_prompt_async(config, messages)
+            debug_log(f"🔍 DEBUG: API call successful, response length: {len(response)}")
             
             # Parse response using advanced JSON parsing
             try:
-                result = parse_llama_json_response(response)
+                result = result or parse_llama_json_response(response)
                 if result:
                     positive_prompt = result.get('positive', full_description)
                     negative_prompt = result.get('negative', kwargs.get('negative_prompt', 'blurry, low quality, distorted'))
@@ -1057,30 +3954,125 @@ Return a JSON object with:
                 
         except Exception as api_error:
             # LLM is not available - use fallback with advanced prompt enhancement
-            print(f"🔍 DEBUG: ENTERED FALLBACK EXCEPTION HANDLER")
+            debug_log(f"🔍 DEBUG: ENTERED FALLBACK EXCEPTION HANDLER")
             print(f"⚠️ LLM API Error: {str(api_error)}")
             print(f"🔄 Using advanced fallback mode - intelligent prompt enhancement without LLM")
             
             # Create enhanced prompt using advanced built-in logic
             positive_prompt = self.enhance_prompt_advanced(full_description, style_main, style_sub, **kwargs)
             negative_prompt = kwargs.get('negative_prompt', 'blurry, low quality, distorted, bad anatomy, worst quality, jpeg artifacts, watermark')
-            enhanced_description = f"⚠️ LLM Offline - Advanced Enhancement: {full_description}"
+            enhanced_description = f"{LLM_OFFLINE_PREFIX}{full_description}"
         
-        # Add quality tags if enabled
-        if kwargs.get('quality_tags', True):
-            quality_tags = self.get_quality_tags(target_model, style_main, style_sub)
-            positive_prompt = ', '.join(quality_tags) + ', ' + positive_prompt
+        result = self.finalize_prompts(positive_prompt, negative_prompt, enhanced_description,
+                                       target_model, style_main, style_sub, **kwargs)
+        if cache and is_cacheable_result(result):
+            cache.put(cache_key, result)
+        return result
+    
+    async def request_structured_prompt_async(self, config: Dict[str, Any],
+                                              messages: List[Dict[str, str]]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Call the LLM and, with structured output enabled, parse the answer
+        with a single json.loads, retrying responses that do not match the
+        schema. Returns the last raw response and the parsed object (None
+        when structured output is off or every attempt failed).
+        """
+        if config.get('structured_output', 'off') == 'off':
+            return await self.make_api_call_async(config, messages), None
         
-        # Format final prompt based on target model
-        formatted_prompt = self.format_for_model(positive_prompt, target_model, kwargs)
+        attempts = max(0, config.get('structured_output_retries', 2)) + 1
+        validate = lambda content: parse_structured_prompt_response(content) is not None
+        response = ''
+        for attempt in range(attempts):
+            response = await self.make_api_call_async(config, messages, validate=validate)
+            result = parse_structured_prompt_response(response)
+            if result:
+                return response, result
+            print(f"⚠️ Response does not match the prompt schema ({attempt + 1}/{attempts})")
+        return response, None
+    
+    async def complete_multi_prompt_request_async(self, requests_group: List[Dict[str, Any]], target_model: str,
+                                                  style_main: str, style_sub: str,
+                                                  **kwargs) -> List[Tuple[str, str, str, str]]:
+        """
+        Generate several prepared requests with one LLM call that returns a
+        JSON array; only the items that fail to parse are retried one by one
+        """
+        cache = get_result_cache() if kwargs.get('result_cache') else None
+        if cache and len(requests_group) > 1:
+            # Only the items missing from the result cache go to the LLM
+            keys = [self.result_cache_key(r, target_model, style_main, style_sub, **kwargs) for r in requests_group]
+            results = [cache.get(key) for key in keys]
+            missing = [i for i, result in enumerate(results) if result is None]
+            if missing:
+                generated = await self.complete_multi_prompt_request_async(
+                    [requests_group[i] for i in missing], target_model, style_main, style_sub,
+                    **dict(kwargs, result_cache=False)
+                )
+                for i, result in zip(missing, generated):
+                    results[i] = result
+                    if is_cacheable_result(result):
+                        cache.put(keys[i], result)
+            return results
         
-        # Single prompt info
-        batch_info = "📝 Single Prompt Generated"
+        first = requests_group[0]
+        if len(requests_group) == 1 or any(r['messages'][0] != first['messages'][0] for r in requests_group):
+            return [await self.complete_prompt_request_async(r, target_model, style_main, style_sub, **kwargs)
+                    for r in requests_group]
         
-        return (positive_prompt, negative_prompt, enhanced_description, formatted_prompt, batch_info)
+        count = len(requests_group)
+        # Room for every item, but never above the ceiling (or below a single item's budget)
+        item_tokens = first['config'].get('max_tokens', 2000)
+        ceiling = max(item_tokens, kwargs.get('multi_prompt_max_tokens', MULTI_PROMPT_MAX_TOKENS))
+        config = dict(first['config'], max_tokens=min(item_tokens * count, ceiling), prompt_count=count)
+        numbered = "\n".join(f"{i + 1}. {r['full_description']}" for i, r in enumerate(requests_group))
+        messages = [
+            {"role": "system", "content": first['messages'][0]['content'] + MULTI_PROMPT_INSTRUCTIONS.format(count=count)},
+            {"role": "user", "content": f"Create enhanced prompts for each of these {count} descriptions:\n{numbered}"}
+        ]
+        
+        items = [None] * count
+        try:
+            response = await self.make_api_call_async(config, messages)
+            items = parse_multi_prompt_response(response, count)
+        except Exception as api_error:
+            print(f"⚠️ Multi-prompt request failed, generating items individually: {str(api_error)}")
+        
+        results = []
+        for request, item in zip(requests_group, items):
+            if item is None:
+                results.append(await self.complete_prompt_request_async(request, target_model, style_main, style_sub,
+                                                                        **kwargs))
+                continue
+            results.append(self.finalize_prompts(
+                item['positive'],
+                item.get('negative', kwargs.get('negative_prompt', 'blurry, low quality, distorted')),
+                item.get('enhanced_description', request['full_description']),
+                target_model, style_main, style_sub, **kwargs
+            ))
+        return results
+    
+    async def complete_groups_async(self, groups: List[List[Dict[str, Any]]], concurrency: int,
+                                    target_model: str, style_main: str, style_sub: str,
+                                    **kwargs) -> List[List[Tuple[str, str, str, str]]]:
+        """
+        Complete every request group as a task on the shared event loop, at
+        most concurrency of them waiting on the LLM at a time
+        """
+        import asyncio
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def complete(group: List[Dict[str, Any]]) -> List[Tuple[str, str, str, str]]:
+            async with semaphore:
+                return await self.complete_multi_prompt_request_async(group, target_model, style_main, style_sub,
+                                                                      **kwargs)
+        
+        return list(await asyncio.gather(*(complete(group) for group in groups)))
     
-    def generate_batch_with_smart_randomization(self, description: str, api_url: str, model_name: str, target_model: str,
-                                               style_main: str, style_sub: str, num_variations: int, **kwargs) -> Tuple[str, str, str, str, str]:
+    async def generate_batch_with_smart_randomization_async(self, description: str, api_url: str, model_name: str,
+                                                            target_model: str, style_main: str, style_sub: str,
+                                                            num_variations: int,
+                                                            **kwargs) -> Tuple[str, str, str, str, str]:
         """
         Generate batch with intelligent randomization - exactly as user requested
         """
@@ -1128,19 +4120,49 @@ Return a JSON object with:
             'formatted': []
         }
         
-        # Generate batch
+        # Every item draws from its own (seed, index) stream, so items are reproducible in any order
+        random_seed = kwargs.get('random_seed', -1)
+        full_descriptions = []
         for i in range(batch_count):
+            rng = item_rng(random_seed, i)
             # Create variation for this iteration
             varied_description = self.create_smart_variation(
-                description, i, full_randomize_batch, preserved_traits, variation_pools, **kwargs
-            )
-            
-            # Generate single prompt for this variation
-            single_result = self.generate_single_prompt(
-                varied_description, api_url, model_name, target_model,
-                style_main, style_sub, 1, **kwargs
+                description, i, full_randomize_batch, preserved_traits, variation_pools, rng, **kwargs
             )
-            
+            full_descriptions.append(self.build_full_description(varied_description, rng, **kwargs))
+        
+        # One index lookup for the whole batch
+        batch_relevant_tags = self.retrieve_relevant_tags(full_descriptions, **kwargs)
+        # Items are separate generations even when their requests are identical, so they are never coalesced
+        item_kwargs = dict(kwargs, coalesce_requests=False)
+        requests_to_send = [
+            self.build_prompt_request(full_description, api_url, model_name, target_model,
+                                      style_main, style_sub, relevant_tags=relevant_tags, **item_kwargs)
+            for full_description, relevant_tags in zip(full_descriptions, batch_relevant_tags)
+        ]
+        
+        # Pack several items into one LLM call if requested
+        # Pack fewer items when prompts_per_request x max_tokens would exceed the ceiling
+        prompts_per_request = max(1, min(kwargs.get('prompts_per_request', 1),
+                                         kwargs.get('multi_prompt_max_tokens', MULTI_PROMPT_MAX_TOKENS) //
+                                         max(1, kwargs.get('max_tokens', 2000))))
+        groups = [requests_to_send[i:i + prompts_per_request] for i in range(0, batch_count, prompts_per_request)]
+        
+        # Dispatch LLM calls, optionally with bounded concurrency per server
+        servers = max(1, _endpoint_balancer.healthy_count(parse_endpoint_list(api_url)))
+        max_concurrency = max(1, min(kwargs.get('max_concurrency', 1) * servers, MAX_BATCH_CONCURRENCY, len(groups)))
+        
+        connections_before = _connection_pools.totals()
+        server_cached_before = _prefix_cache_stats.stats()['cached_tokens']
+        group_results = await self.complete_groups_async(groups, max_concurrency, target_model, style_main, style_sub,
+                                                         **kwargs)
+        connections_after = _connection_pools.totals()
+        connections_opened = connections_after['opened'] - connections_before['opened']
+        connections_reused = connections_after['reused'] - connections_before['reused']
+        server_cached_tokens = _prefix_cache_stats.stats()['cached_tokens'] - server_cached_before
+        results = [result for group_result in group_results for result in group_result]
+        
+        for i, single_result in enumerate(results):
             # Add to batch results
             batch_results['positive'].append(f"[{i+1}] {single_result[0]}")
             batch_results['negative'].append(f"[{i+1}] {single_result[1]}")
@@ -1153,6 +4175,13 @@ Return a JSON object with:
         batch_enhanced = "\n\n".join(batch_results['enhanced'])
         batch_formatted = "\n\n".join(batch_results['formatted'])
         
+        # Prefill work saved by the shared system prompt prefix
+        if server_cached_tokens:
+            prefill_info = f"{server_cached_tokens} tokens (server-reported)"
+        else:
+            estimated = requests_to_send[0]['prefix_tokens'] * max(0, len(groups) - 1) if requests_to_send else 0
+            prefill_info = f"~{estimated} tokens (estimated)" if estimated else "n/a"
+        
         # Create batch info
         randomization_info = "Full Randomization" if full_randomize_batch else "Fixed Settings"
         batch_info = f"""🎯 INTELLIGENT BATCH COMPLETE
@@ -1161,307 +4190,15 @@ Return a JSON object with:
 🔄 Mode: {randomization_info}
 🎨 Preserved Traits: {preserved_traits if preserved_traits else 'None'}
 💡 Smart Randomization: {'Enabled' if full_randomize_batch else 'Disabled'}
+⚡ Concurrency: {max_concurrency}
+📦 Prompts per LLM call: {prompts_per_request}
+🔌 Connections: {connections_reused} reused, {connections_opened} opened
+♻️ Prefill reused: {prefill_info}
+{requests_to_send[0]['system_prompt_info'] if requests_to_send else ''}
 ═══════════════════════════════════"""
         
         return (batch_positive, batch_negative, batch_enhanced, batch_formatted, batch_info)
     
-    def create_smart_variation(self, base_description: str, iteration: int, full_randomize: bool, 
-                              preserved_traits: str, variation_pools: dict, **kwargs) -> str:
-        """
-        Create smart variations based on user settings - EXACTLY as requested
-        """
-        variations = []
-        
-        # Always add preserved traits if specified
-        if preserved_traits:
-            variations.append(preserved_traits)
-        
-        if full_randomize:
-            # Add random elements based on user settings
-            if kwargs.get('random_locations', True):
-                location = random.choice(variation_pools['locations'])
-                variations.append(f"in {location}")
-            
-            if kwargs.get('random_poses', True):
-                pose = random.choice(variation_pools['poses'])
-                variations.append(f"{pose}")
-            
-            if kwargs.get('random_emotions', True):
-                emotion = random.choice(variation_pools['emotions'])
-                variations.append(f"{emotion} expression")
-            
-            if kwargs.get('random_clothing', True):
-                clothing = random.choice(variation_pools['clothing'])
-                variations.append(f"wearing {clothing}")
-            
-            if kwargs.get('random_lighting', True):
-                lighting = random.choice(variation_pools['lighting'])
-                variations.append(f"{lighting}")
-        
-        # Combine base description with variations
-        if variations:
-            return f"{base_description}, {', '.join(variations)}"
-        else:
-            return base_description
-    
-    def enhance_prompt_advanced(self, description: str, style_main: str, style_sub: str, **kwargs) -> str:
-        """
-        Advanced prompt enhancement without LLM - extracts key elements from rich descriptions
-        and creates optimized prompts for image generation
-        """
-        # Extract key elements from the rich description
-        elements = {
-            'subject': [],
-            'attributes': [],
-            'clothing': [],
-            'pose': [],
-            'action': [],
-            'location': [],
-            'background': [],
-            'lighting': [],
-            'mood': [],
-            'details': []
-        }
-        
-        # Enhanced patterns to extract more details from rich descriptions
-        patterns = {
-            'subject': r'(young woman|woman|man|person|girl|boy|female|male|figure|character)(?: with|,| who| that| \(|\s+|$)',
-            'clothing': r'(string thong|string top|nipple tape|shoulder strap|clothing|wearing|dressed in|outfit|attire|garment|bikini|lingerie|swimsuit)',
-            'pose': r'(squats|squatting|reclines|leaning|standing|sitting|lying|kneeling|bending|stretching|posing|position|posture|gesture)',
-            'location': r'(campfire|sauna|wood-paneled|cozy scene|environment|setting|background|behind her|room|place|location|setting|surroundings)',
-            'lighting': r'(warm golden light|golden light|lighting|light|shadows|highlighting|sheen|illuminated|glow|sunlight|moonlight|ambient light|dramatic lighting)',
-            'mood': r'(joyful|playful|relaxed|confident|sensual|intimate|comfortable|warmth|laughter|enjoyment|happiness|pleasure|content|serene|peaceful|excited)',
-            'details': r'(radiating|playful|provocatively|subtle|sensuality|cozy|delicate|sweet|realistic|intimate|vivid|dynamic|expressive|natural|organic|fluid)'
-        }
-        
-        # Extract using patterns
-        for category, pattern in patterns.items():
-            matches = re.findall(pattern, description, re.IGNORECASE)
-            if matches:
-                elements[category].extend([match.lower() for match in matches if match])
-        
-        # Additional intelligent extraction from the full description
-        words = description.lower().split()
-        
-        # Extract more descriptive adjectives and details
-        descriptive_words = [
-            'radiating', 'playful', 'provocatively', 'relaxed', 'subtle', 'confident', 
-            'sensuality', 'cozy', 'delicate', 'sweet', 'realistic', 'intimate', 'comfortable',
-            'vivid', 'dynamic', 'expressive', 'natural', 'organic', 'fluid', 'graceful',
-            'elegant', 'powerful', 'soft', 'gentle', 'strong', 'feminine', 'masculine',
-            'youthful', 'mature', 'energetic', 'calm', 'serene', 'peaceful', 'intense'
-        ]
-        
-        for word in descriptive_words:
-            if word in words and word not in elements['details']:
-                elements['details'].append(word)
-        
-        # Extract specific details with better context awareness
-        detail_patterns = {
-            'squatting': r'(squats|squatting|low position|crouching)',
-            'campfire': r'(campfire|firelight|fire glow|bonfire)',
-            'sauna': r'(sauna|steam room|hot room|wooden sauna)',
-            'golden_light': r'(golden light|warm light|sunset glow|golden hour)',
-            'skin': r'(skin texture|skin details|pore details|skin sheen|skin glow)',
-            'hair': r'(hair flow|hair details|strands of hair|hair movement)',
-            'eyes': r'(eye details|sparkling eyes|expressive eyes|eye color)',
-            'environment': r'(wood-paneled|cozy|warm|intimate|comfortable|relaxing)'
-        }
-        
-        for detail_type, pattern in detail_patterns.items():
-            matches = re.findall(pattern, description, re.IGNORECASE)
-            if matches:
-                if detail_type == 'squatting':
-                    elements['pose'].append('squatting pose')
-                elif detail_type == 'campfire':
-                    elements['location'].append('around campfire')
-                    elements['lighting'].append('firelight glow')
-                elif detail_type == 'sauna':
-                    elements['location'].append('in sauna')
-                    elements['background'].append('steamy atmosphere')
-                elif detail_type == 'golden_light':
-                    elements['lighting'].append('golden hour lighting')
-                    elements['mood'].append('warm atmosphere')
-                elif detail_type == 'skin':
-                    elements['details'].append('detailed skin texture')
-                    elements['details'].append('skin pores visible')
-                elif detail_type == 'hair':
-                    elements['details'].append('detailed hair strands')
-                    elements['details'].append('hair movement')
-                elif detail_type == 'eyes':
-                    elements['details'].append('expressive eyes')
-                    elements['details'].append('detailed eye reflection')
-                elif detail_type == 'environment':
-                    for match in matches:
-                        if match not in elements['location']:
-                            elements['location'].append(match)
-        
-        # If no subject found, try to extract from beginning of description
-        if not elements['subject'] and len(words) > 2:
-            potential_subject = ' '.join(words[:3])
-            elements['subject'].append(potential_subject)
-        
-        # Build the enhanced prompt with richer content
-        prompt_parts = []
-        
-        # Subject with detailed attributes
-        if elements['subject']:
-            subject = elements['subject'][0]
-            if elements['details']:
-                prompt_parts.append(f"{', '.join(elements['details'][:5])} {subject}")
-            else:
-                prompt_parts.append(subject)
-        elif description.strip():  # Use the original description if no subject extracted
-            prompt_parts.append(description.strip())
-        
-        # Pose and action with more details
-        if elements['pose']:
-            pose_desc = ', '.join(elements['pose'][:3])
-            prompt_parts.append(f"{pose_desc} pose")
-        
-        # Location and background with context
-        if elements['location']:
-            location_desc = ', '.join(elements['location'][:3])
-            prompt_parts.append(f"in {location_desc}")
-        
-        # Lighting and mood with atmosphere
-        if elements['lighting']:
-            lighting_desc = ', '.join(elements['lighting'][:3])
-            prompt_parts.append(f"with {lighting_desc}")
-        
-        if elements['mood']:
-            mood_desc = ', '.join(elements['mood'][:3])
-            prompt_parts.append(f"{mood_desc} atmosphere")
-        
-        # Additional descriptive details
-        if elements['details'] and len(elements['details']) > 5:
-            extra_details = ', '.join(elements['details'][5:8])
-            prompt_parts.append(extra_details)
-        
-        # Style-specific enhancements with more variety
-        if style_main == 'realistic':
-            prompt_parts.extend([
-                'photorealistic', 'high detail', 'sharp focus', 'professional photography',
-                'ultra detailed', 'intricate details', 'texture details', 'realistic shadows',
-                'accurate proportions', 'natural lighting', 'professional composition'
-            ])
-            if style_sub != 'any':
-                prompt_parts.append(style_sub + ' photography')
-        elif style_main == 'anime':
-            anime_style = kwargs.get('anime_style', 'ghibli')
-            prompt_parts.extend([
-                f'{anime_style} anime style', 'detailed', 'high quality', 'expressive',
-                'vibrant colors', 'clean lines', 'anime aesthetic', 'character design',
-                'expressive features', 'dynamic posing', 'anime art'
-            ])
-        
-        # NSFW enhancements based on mode and intensity
-        nsfw_mode = kwargs.get('nsfw_mode', 'off')
-        nsfw_level = kwargs.get('nsfw_level', 5)
-        hardcore_level = kwargs.get('hardcore_level', 5)
-        
-        if nsfw_mode == "nsfw":
-            # NSFW nudity and suggestive elements based on intensity level
-            nsfw_elements = []
-            if nsfw_level >= 1:
-                nsfw_elements.extend(['nude', 'naked', 'bare skin', 'exposed'])
-            if nsfw_level >= 3:
-                nsfw_elements.extend(['sensual', 'suggestive pose', 'alluring', 'revealing'])
-            if nsfw_level >= 5:
-                nsfw_elements.extend(['provocative', 'seductive', 'enticing', 'erotic'])
-            if nsfw_level >= 7:
-                nsfw_elements.extend(['tempting', 'captivating', 'mesmerizing', 'voluptuous'])
-            if nsfw_level >= 9:
-                nsfw_elements.extend(['intoxicating', 'ravishing', 'beguiling', 'luscious'])
-            
-            prompt_parts.extend(nsfw_elements)
-            
-        elif nsfw_mode == "hardcore":
-            # Hardcore sexual elements based on intensity level
-            hardcore_elements = []
-            if hardcore_level >= 1:
-                hardcore_elements.extend(['sexual', 'intimate', 'passionate', 'explicit content'])
-            if hardcore_level >= 3:
-                hardcore_elements.extend(['masturbation', 'self-pleasure', 'touching herself', 'touching himself', 'sexual stimulation'])
-            if hardcore_level >= 5:
-                hardcore_elements.extend(['explicit sexual activities', 'detailed intimate interactions', 'graphic sexual descriptions', 'intense passion', 'sexual intercourse', 'penetration', 'orgasm', 'climax', 'sexual positions', 'sexual acts'])
-            if hardcore_level >= 7:
-                hardcore_elements.extend(['very explicit content', 'graphic sexual activities', 'detailed intimate scenarios', 'wild passion', 'multiple sexual positions', 'group activities', 'BDSM elements', 'fetish content'])
-            if hardcore_level >= 9:
-                hardcore_elements.extend(['maximum explicit content', 'full graphic sexual details', 'complete intimate scenarios', 'ultimate sexual intensity', 'extreme hardcore acts', 'all sexual taboos', 'no restrictions'])
-            
-            prompt_parts.extend(hardcore_elements)
-        
-        # Enhanced quality tags
-        quality_tags = [
-            'masterpiece', 'best quality', '8k', 'ultra detailed', 'high resolution',
-            'professional art', 'award winning', 'trending on artstation', 'unreal engine',
-            'octane render', 'concept art', 'digital painting', 'illustration'
-        ]
-        prompt_parts.extend(quality_tags)
-        
-        # Combine all parts with better flow
-        enhanced_prompt = ', '.join([part for part in prompt_parts if part])
-        
-        # DEBUG: Log NSFW/hardcore elements for verification
-        if nsfw_mode != "off":
-            print(f"\n=== NSFW DEBUG ===")
-            print(f"Mode: {nsfw_mode}, Level: {nsfw_level}, Hardcore Level: {hardcore_level}")
-            if nsfw_mode == "nsfw":
-                print(f"NSFW Elements: {nsfw_elements}")
-            elif nsfw_mode == "hardcore":
-                print(f"Hardcore Elements: {hardcore_elements}")
-            print(f"Enhanced Prompt Preview: {enhanced_prompt[:200]}...")
-            print("==================\n")
-        
-        # Ensure the prompt is rich and detailed
-        if len(enhanced_prompt.split(',')) < 12:
-            # Add more descriptive elements focusing on details and quality
-            additional_enhancements = [
-                'detailed background', 'intricate details', 'texture details',
-                'depth of field', 'cinematic lighting', 'dynamic composition',
-                'professional shot', 'sharp details', 'high contrast', 'vivid colors',
-                'atmospheric effects', 'environmental details', 'focus on subject'
-            ]
-            enhanced_prompt += ', ' + ', '.join(additional_enhancements)
-        
-        # Remove any duplicate phrases while preserving order
-        seen = set()
-        unique_parts = []
-        for part in enhanced_prompt.split(', '):
-            if part not in seen:
-                seen.add(part)
-                unique_parts.append(part)
-        
-        enhanced_prompt = ', '.join(unique_parts)
-        
-        return enhanced_prompt
-    
-    def format_for_model(self, prompt: str, target_model: str, kwargs: Dict[str, Any]) -> str:
-        """
-        Format prompt according to target model requirements
-        """
-        formatted = prompt
-        
-        # Add BREAK tokens for supported models
-        if kwargs.get('use_break', True) and target_model in ['SDXL', 'Pony', 'Stable Cascade']:
-            # Insert BREAK every 75 tokens (approximate)
-            words = formatted.split()
-            if len(words) > 75:
-                mid_point = len(words) // 2
-                words.insert(mid_point, 'BREAK')
-                formatted = ' '.join(words)
-        
-        # Add model-specific formatting
-        if target_model == 'MidJourney':
-            formatted = f"/imagine prompt: {formatted}"
-            if kwargs.get('aspect_ratio'):
-                formatted += f" --ar {kwargs['aspect_ratio']}"
-            if kwargs.get('seed'):
-                formatted += f" --seed {kwargs['seed']}"
-        
-        return formatted
-
 class PromptBuilderOnlineNode:
     """
     Advanced ComfyUI Node for Prompt Builder with Online LLM APIs - Full Feature Set
@@ -1520,6 +4257,32 @@ class PromptBuilderOnlineNode:
                     "max": 4000,
                     "step": 100
                 }),
+                "response_cache": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Reuse LLM responses for identical requests from an on-disk cache shared by all ComfyUI processes"
+                }),
+                "response_cache_ttl": ("INT", {
+                    "default": RESPONSE_CACHE_DEFAULT_TTL,
+                    "min": 0,
+                    "max": 30 * 86400,
+                    "step": 3600,
+                    "tooltip": "Seconds a cached response stays valid (0 = until evicted)"
+                }),
+                "result_cache": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Reuse finished prompts for identical requests from a bounded in-memory cache shared by all PromptBuilder nodes"
+                }),
+                "coalesce_requests": ("BOOLEAN", {
+                    "default": True,
+                    "tooltip": "Identical requests (same servers, same payload) in flight at the same time share one LLM call and its answer; items of a batch are always sent as separate calls"
+                }),
+                "system_prompt_budget": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 8192,
+                    "step": 64,
+                    "tooltip": "Target size of the system prompt in tokens (0 = full prompt). Content rules and character constraints are kept first, long glossaries are trimmed"
+                }),
                 
                 # NSFW Settings
                 "nsfw_mode": (["off", "nsfw", "hardcore"], {
@@ -1653,17 +4416,16 @@ class PromptBuilderOnlineNode:
     
     RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING")
     RETURN_NAMES = ("positive_prompt", "negative_prompt", "enhanced_description", "formatted_prompt")
-    FUNCTION = "generate_prompts"
+    FUNCTION = "generate_prompts_async" if ASYNC_NODES else "generate_prompts"
     CATEGORY = "PromptBuilder"
     DESCRIPTION = "Advanced Prompt Builder with Online LLM APIs - Full Feature Set"
     
     def __init__(self):
-        # Inherit all methods from PromptBuilderLocalNode
-        local_node = PromptBuilderLocalNode()
-        self.shot_presets = local_node.shot_presets
-        self.pose_presets = local_node.pose_presets
-        self.location_presets = local_node.location_presets
-        self.clothing_presets = local_node.clothing_presets
+        # Presets data, shared read-only with the engine
+        self.shot_presets = PROMPT_ENGINE.shot_presets
+        self.pose_presets = PROMPT_ENGINE.pose_presets
+        self.location_presets = PROMPT_ENGINE.location_presets
+        self.clothing_presets = PROMPT_ENGINE.clothing_presets
         
         # Online API endpoints
         self.api_endpoints = {
@@ -1677,14 +4439,19 @@ class PromptBuilderOnlineNode:
             "cohere": "https://api.cohere.ai/v1/chat"
         }
         
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'User-Agent': 'ComfyUI-PromptBuilder-Online/2.0'
-        })
+        # Connections come from the process-wide pools, shared with every other node
+        self.connection_pools = get_connection_pools()
     
     def make_online_api_call(self, provider: str, api_key: str, messages: List[Dict[str, str]], **kwargs) -> str:
         """
+        Synchronous facade of make_online_api_call_async for ComfyUI's worker thread
+        """
+        return get_async_runtime().run(self.make_online_api_call_async(provider, api_key, messages, **kwargs))
+    
+    @on_async_runtime
+    async def make_online_api_call_async(self, provider: str, api_key: str, messages: List[Dict[str, str]],
+                                         **kwargs) -> str:
+        """
         Make API call to online LLM providers
         """
         if not api_key:
@@ -1694,7 +4461,7 @@ class PromptBuilderOnlineNode:
         if not endpoint:
             raise Exception(f"Unsupported provider: {provider}")
         
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', 'User-Agent': 'ComfyUI-PromptBuilder-Online/2.0'}
         
         # Provider-specific headers and payload formatting
         if provider == "openai":
@@ -1735,132 +4502,165 @@ class PromptBuilderOnlineNode:
                 "max_tokens": kwargs.get('max_tokens', 2000)
             }
         
+        request_key = canonical_request_key(provider, payload.get('model', provider), messages,
+                                            kwargs.get('temperature', 0.7), kwargs.get('max_tokens', 2000))
+        
+        async def fetch() -> str:
+            cache = get_response_cache() if kwargs.get('response_cache') else None
+            content = await cache.get_async(request_key) if cache else None
+            if content is None:
+                content = await self.post_online_request_async(provider, endpoint, headers, payload)
+                if cache:
+                    await cache.put_async(request_key, content,
+                                          kwargs.get('response_cache_ttl', RESPONSE_CACHE_DEFAULT_TTL))
+            return content
+        
+        if kwargs.get('coalesce_requests', True):
+            return await _single_flight.do(single_flight_key([endpoint], headers, payload), fetch)
+        return await fetch()
+    
+    async def post_online_request_async(self, provider: str, endpoint: str, headers: Dict[str, str],
+                                        payload: Dict[str, Any]) -> str:
+        """
+        POST to an online provider and extract the response text
+        """
+        import asyncio
+        import aiohttp
+        session = get_connection_pools().session()
         try:
-            response = self.session.post(endpoint, headers=headers, json=payload, timeout=60)
+            async with session.post(endpoint, headers=headers, json=payload,
+                                    timeout=aiohttp.ClientTimeout(total=60)) as response:
+                text = await response.text(errors='replace')
+        except asyncio.TimeoutError:
+            raise Exception(f"Connection Error: {provider} did not answer within 60s")
+        except aiohttp.ClientError as e:
+            raise Exception(f"Connection Error: {str(e) or type(e).__name__}")
+        
+        if response.status == 200:
+            try:
+                data = json.loads(text)
+            except ValueError:
+                raise Exception(f"Invalid API response from {provider}: body is not JSON")
             
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Extract response based on provider
-                if provider == "google_gemini":
-                    return data['candidates'][0]['content']['parts'][0]['text']
-                elif provider == "claude":
-                    return data['content'][0]['text']
-                else:
-                    return data['choices'][0]['message']['content']
+            # Extract response based on provider
+            if provider == "google_gemini":
+                return data['candidates'][0]['content']['parts'][0]['text']
+            elif provider == "claude":
+                return data['content'][0]['text']
             else:
-                raise Exception(f"API Error: {response.status_code} - {response.text}")
-                
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Connection Error: {str(e)}")
+                return data['choices'][0]['message']['content']
+        else:
+            raise Exception(f"API Error: {response.status} - {text}")
     
-    # Inherit methods from PromptBuilderLocalNode
+    # Prompt assembly is delegated to the shared PROMPT_ENGINE
     def get_quality_tags(self, target_model: str, style_main: str, style_sub: str) -> List[str]:
-        local_node = PromptBuilderLocalNode()
-        return local_node.get_quality_tags(target_model, style_main, style_sub)
+        return PROMPT_ENGINE.get_quality_tags(target_model, style_main, style_sub)
     
-    def build_character_description(self, **kwargs) -> str:
-        local_node = PromptBuilderLocalNode()
-        return local_node.build_character_description(**kwargs)
+    def build_character_description(self, rng: Optional[random.Random] = None, **kwargs) -> str:
+        return PROMPT_ENGINE.build_character_description(rng, **kwargs)
     
     def apply_presets(self, preset_string: str, preset_dict: Dict[str, str]) -> List[str]:
-        local_node = PromptBuilderLocalNode()
-        return local_node.apply_presets(preset_string, preset_dict)
+        return PROMPT_ENGINE.apply_presets(preset_string, preset_dict)
     
     def create_system_prompt(self, target_model: str, style_main: str, style_sub: str, nsfw_mode: str, **kwargs) -> str:
-        local_node = PromptBuilderLocalNode()
-        return local_node.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs)
+        return PROMPT_ENGINE.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs)
     
     def format_for_model(self, prompt: str, target_model: str, kwargs: Dict[str, Any]) -> str:
-        local_node = PromptBuilderLocalNode()
-        return local_node.format_for_model(prompt, target_model, kwargs)
+        return PROMPT_ENGINE.format_for_model(prompt, target_model, kwargs)
     
     def generate_prompts(self, description: str, api_provider: str, api_key: str, target_model: str,
                         style_main: str, style_sub: str, num_variations: int, **kwargs) -> Tuple[str, str, str, str]:
         """
+        Synchronous entry point for hosts that call node functions directly
+        """
+        return get_async_runtime().run(self.generate_prompts_async(
+            description, api_provider, api_key, target_model, style_main, style_sub, num_variations, **kwargs
+        ))
+    
+    @on_async_runtime
+    async def generate_prompts_async(self, description: str, api_provider: str, api_key: str, target_model: str,
+                                     style_main: str, style_sub: str, num_variations: int,
+                                     **kwargs) -> Tuple[str, str, str, str]:
+        """
         Generate enhanced prompts using online LLM APIs
         """
         try:
-            # Build character description
-            character_desc = self.build_character_description(**kwargs)
-            
-            # Apply presets
-            shot_elements = self.apply_presets(kwargs.get('shot_presets', ''), self.shot_presets)
-            pose_elements = self.apply_presets(kwargs.get('pose_presets', ''), self.pose_presets)
-            location_elements = self.apply_presets(kwargs.get('location_presets', ''), self.location_presets)
-            clothing_elements = self.apply_presets(kwargs.get('clothing_presets', ''), self.clothing_presets)
-            
-            # Combine all elements
-            full_description = description
-            if character_desc:
-                full_description += f", {character_desc}"
-            
-            preset_elements = shot_elements + pose_elements + location_elements + clothing_elements
-            if preset_elements:
-                full_description += f", {', '.join(preset_elements)}"
-            
-            # Apply NSFW/hardcore enhancements BEFORE sending to LLM
-            nsfw_mode = kwargs.get('nsfw_mode', 'off')
-            if nsfw_mode != 'off':
-                # Use local enhancement for NSFW content before LLM processing
-                local_node = PromptBuilderLocalNode()
-                enhanced_description = local_node.enhance_prompt_advanced(full_description, style_main, style_sub, **kwargs)
-                full_description = enhanced_description
-            
-            # Create system prompt - use the same local_node instance if it exists
-            nsfw_mode = kwargs.get('nsfw_mode', 'off')
-            # Remove nsfw_mode from kwargs to avoid duplicate argument error
-            kwargs_copy = kwargs.copy()
-            kwargs_copy.pop('nsfw_mode', None)
-            
-            # Use existing local_node if we created one for enhancement, otherwise create new
-            if nsfw_mode != 'off' and 'local_node' in locals():
-                system_prompt = local_node.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs_copy)
-            else:
-                local_node = PromptBuilderLocalNode()
-                system_prompt = local_node.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs_copy)
-            
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Create enhanced prompts for: {full_description}"}
-            ]
-            
-            response = self.make_online_api_call(api_provider, api_key, messages, **kwargs)
-            
-            # Parse response using advanced JSON parsing
-            try:
-                result = parse_llama_json_response(response)
-                if result:
-                    positive_prompt = result.get('positive', full_description)
-                    negative_prompt = result.get('negative', kwargs.get('negative_prompt', 'blurry, low quality, distorted'))
-                    enhanced_description = result.get('enhanced_description', full_description)
-                else:
-                    # Fallback to basic parsing if advanced parsing fails
-                    try:
-                        result = json.loads(response)
+            # One tags database for the whole request, even if tags_db.json is reloaded meanwhile
+            with tags_db_snapshot():
+                # Description plus character settings and presets
+                full_description = PROMPT_ENGINE.build_full_description(description, **kwargs)
+
+                # Apply NSFW/hardcore enhancements BEFORE sending to LLM
+                nsfw_mode = kwargs.get('nsfw_mode', 'off')
+                if nsfw_mode != 'off':
+                    # Use local enhancement for NSFW content before LLM processing
+                    full_description = PROMPT_ENGINE.enhance_prompt_advanced(full_description, style_main, style_sub, **kwargs)
+
+                # Create system prompt
+                # Remove nsfw_mode from kwargs to avoid duplicate argument error
+                kwargs_copy = kwargs.copy()
+                kwargs_copy.pop('nsfw_mode', None)
+                system_prompt = PROMPT_ENGINE.create_system_prompt(target_model, style_main, style_sub, nsfw_mode, **kwargs_copy)
+                debug_log(describe_system_prompt(system_prompt, kwargs.get('system_prompt_budget', 0)))
+
+                messages = [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": f"Create enhanced prompts for: {full_description}"}
+                ]
+
+                cache = get_result_cache() if kwargs.get('result_cache') else None
+                if cache:
+                    cache_key = canonical_result_key("online", {
+                        'api_provider': api_provider,
+                        'messages': messages,
+                        'target_model': target_model,
+                        'style_main': style_main,
+                        'style_sub': style_sub,
+                        'options': kwargs
+                    })
+                    cached = cache.get(cache_key)
+                    if cached is not None:
+                        return cached
+
+                response = await self.make_online_api_call_async(api_provider, api_key, messages, **kwargs)
+
+                # Parse response using advanced JSON parsing
+                try:
+                    result = parse_llama_json_response(response)
+                    if result:
                         positive_prompt = result.get('positive', full_description)
                         negative_prompt = result.get('negative', kwargs.get('negative_prompt', 'blurry, low quality, distorted'))
                         enhanced_description = result.get('enhanced_description', full_description)
-                    except json.JSONDecodeError:
-                        positive_prompt = response
-                        negative_prompt = kwargs.get('negative_prompt', 'blurry, low quality, distorted')
-                        enhanced_description = response
-            except Exception as parse_error:
-                print(f"JSON parsing error: {parse_error}")
-                positive_prompt = response
-                negative_prompt = kwargs.get('negative_prompt', 'blurry, low quality, distorted')
-                enhanced_description = response
-            
-            # Add quality tags if enabled
-            if kwargs.get('quality_tags', True):
-                quality_tags = self.get_quality_tags(target_model, style_main, style_sub)
-                positive_prompt = ', '.join(quality_tags) + ', ' + positive_prompt
-            
-            # Format final prompt based on target model
-            formatted_prompt = self.format_for_model(positive_prompt, target_model, kwargs)
-            
-            return (positive_prompt, negative_prompt, enhanced_description, formatted_prompt)
-            
+                    else:
+                        # Fallback to basic parsing if advanced parsing fails
+                        try:
+                            result = json.loads(response)
+                            positive_prompt = result.get('positive', full_description)
+                            negative_prompt = result.get('negative', kwargs.get('negative_prompt', 'blurry, low quality, distorted'))
+                            enhanced_description = result.get('enhanced_description', full_description)
+                        except json.JSONDecodeError:
+                            positive_prompt = response
+                            negative_prompt = kwargs.get('negative_prompt', 'blurry, low quality, distorted')
+                            enhanced_description = response
+                except Exception as parse_error:
+                    print(f"JSON parsing error: {parse_error}")
+                    positive_prompt = response
+                    negative_prompt = kwargs.get('negative_prompt', 'blurry, low quality, distorted')
+                    enhanced_description = response
+
+                # Add quality tags if enabled
+                if kwargs.get('quality_tags', True):
+                    quality_tags = self.get_quality_tags(target_model, style_main, style_sub)
+                    positive_prompt = ', '.join(quality_tags) + ', ' + positive_prompt
+
+                # Format final prompt based on target model
+                formatted_prompt = self.format_for_model(positive_prompt, target_model, kwargs)
+
+                result = (positive_prompt, negative_prompt, enhanced_description, formatted_prompt)
+                if cache:
+                    cache.put(cache_key, result)
+                return result
+
         except Exception as e:
             error_msg = f"❌ Online LLM API Error: {str(e)}"
             print(f"PromptBuilder Online Node Error: {error_msg}")
@@ -1971,7 +4771,8 @@ class PromptBuilderQuickNode:
                 }),
                 "api_url": ("STRING", {
                     "default": "http://127.0.0.1:1234",
-                    "placeholder": "Local LLM API URL"
+                    "placeholder": "Local LLM API URL",
+                    "tooltip": "One or more comma-separated server URLs; several servers are load-balanced"
                 }),
                 "model_name": ("STRING", {
                     "default": "mistral",
@@ -2068,7 +4869,7 @@ class PromptBuilderQuickNode:
     
     RETURN_TYPES = ("STRING", "STRING", "STRING", "STRING", "STRING")
     RETURN_NAMES = ("batch_positive", "batch_negative", "batch_enhanced", "batch_formatted", "batch_info")
-    FUNCTION = "generate_batch_prompts"
+    FUNCTION = "generate_batch_prompts_async" if ASYNC_NODES else "generate_batch_prompts"
     CATEGORY = "PromptBuilder"
     DESCRIPTION = "Quick Preset Node with Batch Processing and Advanced Randomization"
     
@@ -2177,23 +4978,32 @@ class PromptBuilderQuickNode:
             ]
         }
         
-        # Cache for performance
-        self.cache = {}
+        # Result cache shared with the other nodes
+        self.cache = get_result_cache()
     
     def generate_batch_prompts(self, description: str, quick_preset: str, api_url: str, 
                               model_name: str, **kwargs) -> Tuple[str, str, str, str, str]:
         """
+        Synchronous entry point for hosts that call node functions directly
+        """
+        return get_async_runtime().run(self.generate_batch_prompts_async(
+            description, quick_preset, api_url, model_name, **kwargs
+        ))
+    
+    @on_async_runtime
+    async def generate_batch_prompts_async(self, description: str, quick_preset: str, api_url: str,
+                                           model_name: str, **kwargs) -> Tuple[str, str, str, str, str]:
+        """
         Generate batch prompts with advanced randomization and fixed character support
         """
+        import asyncio
         try:
             batch_count = kwargs.get('batch_count', 1)
             batch_variation_mode = kwargs.get('batch_variation_mode', 'random_all')
             use_cache = kwargs.get('use_cache', True)
             
-            # Set random seed if provided
+            # Each item gets its own stream derived from (seed, index)
             randomization_seed = kwargs.get('randomization_seed', -1)
-            if randomization_seed != -1:
-                random.seed(randomization_seed)
             
             # Get preset configuration
             if quick_preset != "Custom":
@@ -2203,6 +5013,12 @@ class PromptBuilderQuickNode:
                     if key not in kwargs:
                         kwargs[key] = value
             
+            # The main node takes these positionally
+            target_model = kwargs.get('target_model', 'SDXL')
+            style_main = kwargs.get('style_main', 'realistic')
+            style_sub = kwargs.get('style_sub', 'professional')
+            item_kwargs = {k: v for k, v in kwargs.items() if k not in ('target_model', 'style_main', 'style_sub')}
+            
             batch_results = {
                 'positive': [],
                 'negative': [],
@@ -2210,31 +5026,44 @@ class PromptBuilderQuickNode:
                 'formatted': []
             }
             
-            # Generate batch
-            for i in range(batch_count):
+            async def generate(i: int) -> Tuple[str, str, str, str, str]:
                 # Create variation for this iteration
                 varied_description = self.create_variation(
-                    description, i, batch_variation_mode, **kwargs
+                    description, i, batch_variation_mode, item_rng(randomization_seed, i), **kwargs
                 )
                 
                 # Check cache
-                cache_key = f"{varied_description}_{quick_preset}_{hash(str(kwargs))}"
-                if use_cache and cache_key in self.cache:
-                    result = self.cache[cache_key]
-                else:
+                cache_key = canonical_result_key("quick", {
+                    'description': varied_description,
+                    'quick_preset': quick_preset,
+                    'api_url': api_url,
+                    'model_name': model_name,
+                    'options': kwargs
+                })
+                result = self.cache.get(cache_key) if use_cache else None
+                if result is None:
                     # Generate prompt using main node
-                    result = self.main_node.generate_prompts(
-                        varied_description, api_url, model_name,
-                        kwargs.get('target_model', 'SDXL'),
-                        kwargs.get('style_main', 'realistic'),
-                        kwargs.get('style_sub', 'professional'),
-                        1, **kwargs
+                    result = await self.main_node.generate_prompts_async(
+                        varied_description, api_url, model_name, target_model, style_main, style_sub, 1, **item_kwargs
                     )
                     
                     # Cache result
-                    if use_cache:
-                        self.cache[cache_key] = result
+                    if use_cache and is_cacheable_result(result):
+                        self.cache.put(cache_key, result)
+                return result
+            
+            # Items are independent, so parallel processing runs them as concurrent tasks
+            if kwargs.get('parallel_processing', False):
+                semaphore = asyncio.Semaphore(MAX_BATCH_CONCURRENCY)
                 
+                async def bounded(i: int) -> Tuple[str, str, str, str, str]:
+                    async with semaphore:
+                        return await generate(i)
+                results = await asyncio.gather(*(bounded(i) for i in range(batch_count)))
+            else:
+                results = [await generate(i) for i in range(batch_count)]
+            
+            for i, result in enumerate(results):
                 # Add to batch results
                 batch_results['positive'].append(f"[{i+1}] {result[0]}")
                 batch_results['negative'].append(f"[{i+1}] {result[1]}")
@@ -2248,13 +5077,16 @@ class PromptBuilderQuickNode:
             batch_formatted = "\n\n".join(batch_results['formatted'])
             
             # Create batch info
+            cache_stats = self.cache.stats()
+            cache_info = (f"Enabled ({cache_stats['entries']} entries, {cache_stats['bytes'] // 1024} KiB, "
+                          f"{cache_stats['hit_rate']:.0%} hit rate)") if use_cache else 'Disabled'
             batch_info = f"""🎯 BATCH GENERATION COMPLETE
 ═══════════════════════════════════
 📊 Generated: {batch_count} prompts
 🎨 Preset: {quick_preset}
 🔄 Mode: {batch_variation_mode}
 🎲 Seed: {randomization_seed if randomization_seed != -1 else 'Random'}
-💾 Cache: {'Enabled' if use_cache else 'Disabled'}
+💾 Cache: {cache_info}
 ═══════════════════════════════════"""
             
             return (batch_positive, batch_negative, batch_enhanced, batch_formatted, batch_info)
@@ -2264,21 +5096,26 @@ class PromptBuilderQuickNode:
             return (error_msg, error_msg, error_msg, error_msg, error_msg)
     
     def create_variation(self, base_description: str, iteration: int, 
-                        variation_mode: str, **kwargs) -> str:
+                        variation_mode: str, rng: Optional[random.Random] = None, **kwargs) -> str:
         """
         Create variations based on mode and settings
         """
+        if rng is None:
+            rng = item_rng(kwargs.get('randomization_seed', -1), iteration)
         if variation_mode == "fixed_character":
-            return self.create_fixed_character_variation(base_description, iteration, **kwargs)
+            return self.create_fixed_character_variation(base_description, iteration, rng, **kwargs)
         elif variation_mode == "themed_variations":
             return self.create_themed_variation(base_description, iteration, **kwargs)
         else:  # random_all
-            return self.create_random_variation(base_description, iteration, **kwargs)
+            return self.create_random_variation(base_description, iteration, rng, **kwargs)
     
-    def create_fixed_character_variation(self, base_description: str, iteration: int, **kwargs) -> str:
+    def create_fixed_character_variation(self, base_description: str, iteration: int,
+                                         rng: Optional[random.Random] = None, **kwargs) -> str:
         """
         Create variation with fixed character but varied everything else
         """
+        if rng is None:
+            rng = item_rng(kwargs.get('randomization_seed', -1), iteration)
         # Fixed character attributes
         fixed_attrs = []
         fixed_attrs.append(f"{kwargs.get('fixed_gender', 'female')}")
@@ -2296,30 +5133,30 @@ class PromptBuilderQuickNode:
         variations = []
         
         if kwargs.get('vary_locations', True):
-            location = random.choice(self.variation_pools['locations'])
+            location = rng.choice(self.variation_pools['locations'])
             variations.append(f"in {location}")
         
         if kwargs.get('vary_poses', True):
-            pose = random.choice(self.variation_pools['poses'])
+            pose = rng.choice(self.variation_pools['poses'])
             variations.append(f"{pose}")
         
         if kwargs.get('vary_emotions', True):
-            emotion = random.choice(self.variation_pools['emotions'])
+            emotion = rng.choice(self.variation_pools['emotions'])
             variations.append(f"{emotion} expression")
         
         if kwargs.get('vary_clothing', True):
-            clothing = random.choice(self.variation_pools['clothing'])
+            clothing = rng.choice(self.variation_pools['clothing'])
             variations.append(f"wearing {clothing}")
         
         if kwargs.get('vary_lighting', True):
-            lighting = random.choice(self.variation_pools['lighting'])
+            lighting = rng.choice(self.variation_pools['lighting'])
             variations.append(f"{lighting}")
         
         # NSFW elements
         if kwargs.get('include_nsfw', False):
             nsfw_ratio = kwargs.get('nsfw_ratio', 0.3)
-            if random.random() < nsfw_ratio:
-                nsfw_element = random.choice(self.variation_pools['nsfw_elements'])
+            if rng.random() < nsfw_ratio:
+                nsfw_element = rng.choice(self.variation_pools['nsfw_elements'])
                 variations.append(f"{nsfw_element}")
         
         # Combine all elements
@@ -2345,11 +5182,14 @@ class PromptBuilderQuickNode:
         
         return f"{base_description}, {theme}"
     
-    def create_random_variation(self, base_description: str, iteration: int, **kwargs) -> str:
+    def create_random_variation(self, base_description: str, iteration: int,
+                                rng: Optional[random.Random] = None, **kwargs) -> str:
         """
         Create completely random variations
         """
         variations = []
+        if rng is None:
+            rng = item_rng(kwargs.get('randomization_seed', -1), iteration)
         creativity = kwargs.get('creativity_level', 0.7)
         
         # Add random elements based on creativity level
@@ -2359,7 +5199,7 @@ class PromptBuilderQuickNode:
         for pool in self.variation_pools.values():
             all_elements.extend(pool)
         
-        selected_elements = random.sample(all_elements, min(num_variations, len(all_elements)))
+        selected_elements = rng.sample(all_elements, min(num_variations, len(all_elements)))
         
         return f"{base_description}, {', '.join(selected_elements)}"
 
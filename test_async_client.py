@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Test script for the asyncio client layer, the shared connection pools and the
+async node entry points, run against a mock OpenAI-compatible server
+"""
+
+import sys
+import os
+import json
+import threading
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import (PromptBuilderLocalNode, PromptBuilderOnlineNode, PromptBuilderQuickNode,
+                                ConnectionPoolRegistry, get_async_runtime)
+from mock_llm_server import MockLLMServer
+
+
+def test_hundreds_of_requests_share_one_thread():
+    """Concurrent requests are tasks on the shared event loop, not threads"""
+    import asyncio
+    node = PromptBuilderLocalNode()
+    saved = promptbuilder_node._connection_pools
+    promptbuilder_node._connection_pools = ConnectionPoolRegistry(maxsize=256)
+    # The server holds every request until all 200 are in flight at once
+    with MockLLMServer(gate=200) as server:
+        config = {'api_url': server.url, 'model_name': 'mock-model', 'coalesce_requests': False}
+
+        async def fan_out():
+            return await asyncio.gather(*(
+                node.make_api_call_async(config, [{"role": "user", "content": f"item {i}"}]) for i in range(200)
+            ))
+
+        try:
+            contents = get_async_runtime().run(fan_out())
+        finally:
+            promptbuilder_node._connection_pools.close()
+            promptbuilder_node._connection_pools = saved
+
+    assert [json.loads(content)['positive'] for content in contents] == [f"item {i}" for i in range(200)]
+    assert server.max_in_flight == 200 and server.gate_timeouts == 0
+    client_threads = [t.name for t in threading.enumerate() if not t.name.startswith('Thread-')]
+    assert client_threads.count('promptbuilder-asyncio') == 1
+    assert not any(name.startswith('ThreadPoolExecutor') for name in client_threads)
+
+
+def test_async_entry_points_match_sync_path():
+    """The async node functions return what the sync fallback does, without blocking the host's event loop"""
+    import asyncio
+    local, online, quick = PromptBuilderLocalNode(), PromptBuilderOnlineNode(), PromptBuilderQuickNode()
+    with MockLLMServer(hold=True) as server:
+        online.api_endpoints['openai'] = f"{server.url}/v1/chat/completions"
+        local_args = ("a fox in the snow", server.url, "mock-model", "SDXL", "realistic", "professional", 1)
+        online_args = ("a fox in the snow", "openai", "test-key", "SDXL", "realistic", "professional", 1)
+        quick_args = ("a fox in the snow", "Portrait Woman", server.url, "mock-model")
+        quick_options = {'batch_count': 3, 'randomization_seed': 5, 'use_cache': False}
+
+        def host(coro, count):
+            # Stands in for ComfyUI's loop: responses are only released by the host loop
+            # itself, so a node function that blocked it would never see them
+            async def run():
+                expected = len(server.requests) + count
+                task = asyncio.ensure_future(coro)
+                while len(server.requests) < expected and not task.done():
+                    await asyncio.sleep(0.01)
+                server.release.set()
+                return await task
+            server.release.clear()
+            result = asyncio.run(run())
+            server.release.set()
+            return result
+
+        result = host(local.generate_prompts_async(*local_args, random_seed=1), 1)
+        assert result == local.generate_prompts(*local_args, random_seed=1)
+        assert "a fox in the snow" in result[0]
+
+        result = host(online.generate_prompts_async(*online_args), 1)
+        assert result == online.generate_prompts(*online_args)
+        assert "a fox in the snow" in result[0]
+
+        sequential = quick.generate_batch_prompts(*quick_args, **quick_options)
+        assert "❌" not in sequential[0] and sequential[0].count("a fox in the snow") == 3
+        server.max_in_flight = 0
+        result = host(quick.generate_batch_prompts_async(*quick_args, parallel_processing=True, **quick_options), 3)
+        assert result == sequential and server.max_in_flight == 3
+        assert server.release_timeouts == 0
+
+
+def test_async_nodes_follow_host():
+    """FUNCTION names the async entry point only on hosts whose executor awaits coroutines"""
+    import inspect
+    import types
+    for node_class in (PromptBuilderLocalNode, PromptBuilderOnlineNode, PromptBuilderQuickNode):
+        assert node_class.FUNCTION in ("generate_prompts", "generate_batch_prompts")
+        assert inspect.iscoroutinefunction(getattr(node_class, f"{node_class.FUNCTION}_async"))
+
+    saved = os.environ.pop('PROMPTBUILDER_ASYNC_NODES', None), sys.modules.pop('execution', None)
+    try:
+        assert not promptbuilder_node.host_awaits_node_functions()
+        sys.modules['execution'] = types.SimpleNamespace(map_node_over_list=None)
+        assert not promptbuilder_node.host_awaits_node_functions()
+        sys.modules['execution'] = types.SimpleNamespace(_async_map_node_over_list=None)
+        assert promptbuilder_node.host_awaits_node_functions()
+        os.environ['PROMPTBUILDER_ASYNC_NODES'] = '0'
+        assert not promptbuilder_node.host_awaits_node_functions()
+    finally:
+        os.environ.pop('PROMPTBUILDER_ASYNC_NODES', None)
+        sys.modules.pop('execution', None)
+        if saved[0] is not None:
+            os.environ['PROMPTBUILDER_ASYNC_NODES'] = saved[0]
+        if saved[1] is not None:
+            sys.modules['execution'] = saved[1]
+
+
+def test_connections_pooled_per_host_across_nodes():
+    """Every node shares one keep-alive connection pool, with per-host counters from aiohttp's tracing"""
+    saved = promptbuilder_node._connection_pools
+    promptbuilder_node._connection_pools = ConnectionPoolRegistry(maxsize=4)
+    try:
+        with MockLLMServer(keep_alive=True) as server, MockLLMServer(keep_alive=True) as other:
+            config = {'api_url': server.url, 'model_name': 'mock-model', 'coalesce_requests': False}
+            for i in range(3):
+                PromptBuilderLocalNode().make_api_call(config, [{"role": "user", "content": f"fox {i}"}])
+            online = PromptBuilderOnlineNode()
+            payload = {"model": "mock-model", "messages": [{"role": "user", "content": "owl"}]}
+            url = f"{server.url}/v1/chat/completions"
+            assert get_async_runtime().run(online.post_online_request_async("openai", url, {}, payload))
+            PromptBuilderLocalNode().make_api_call(dict(config, api_url=other.url), [{"role": "user", "content": "elk"}])
+
+            pools = promptbuilder_node.get_connection_pools()
+            stats = pools.stats()
+            assert set(stats) == {server.url, other.url}
+            idle = {'open': 1, 'idle': 1, 'in_use': 0}
+            assert stats[server.url] == dict(idle, requests=4, opened=1, reused=3, failed=0)
+            assert stats[other.url] == dict(idle, requests=1, opened=1, reused=0, failed=0)
+
+            # A closed session drops its connections, the next request opens a new one
+            pools.close()
+            assert pools.totals()['open'] == 0
+            PromptBuilderLocalNode().make_api_call(config, [{"role": "user", "content": "yak"}])
+            assert pools.stats()[server.url]['opened'] == 2 and pools.totals()['requests'] == 6
+    finally:
+        promptbuilder_node._connection_pools.close()
+        promptbuilder_node._connection_pools = saved
+
+
+def test_proxy_and_compression_follow_http_conventions():
+    """HTTP_PROXY/NO_PROXY from the environment are honoured and gzip bodies are decoded"""
+    import gzip
+    saved = {name: os.environ.pop(name, None) for name in ('HTTP_PROXY', 'http_proxy', 'NO_PROXY', 'no_proxy')}
+    try:
+        with MockLLMServer() as proxy, MockLLMServer() as server:
+            def gzipped(handler, payload):
+                content = json.dumps({"positive": payload['messages'][-1]['content']})
+                body = gzip.compress(json.dumps({"choices": [{"message": {"content": content}}]}).encode())
+                handler.send_response(200)
+                handler.send_header('Content-Encoding', 'gzip')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            proxy.respond = gzipped
+            os.environ['HTTP_PROXY'] = proxy.url
+            node = PromptBuilderLocalNode()
+            messages = [{"role": "user", "content": "a wren"}]
+            config = {'api_url': 'http://llm.invalid:8080', 'model_name': 'mock-model', 'max_retries': 0}
+            assert json.loads(node.make_api_call(config, messages))['positive'] == "a wren"
+            assert len(proxy.requests) == 1
+
+            os.environ['NO_PROXY'] = '127.0.0.1'
+            node.make_api_call(dict(config, api_url=server.url), messages)
+            assert len(proxy.requests) == 1 and len(server.requests) == 1
+    finally:
+        for name, value in saved.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting async client tests...")
+    print("=" * 60)
+
+    try:
+        test_hundreds_of_requests_share_one_thread()
+        test_async_entry_points_match_sync_path()
+        test_async_nodes_follow_host()
+        test_connections_pooled_per_host_across_nodes()
+        test_proxy_and_compression_follow_http_conventions()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
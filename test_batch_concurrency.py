@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test script for concurrent batch dispatch in the Local node, run against a
+mock OpenAI-compatible server
+"""
+
+import sys
+import os
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer, run_batch
+
+
+def test_concurrent_batch_keeps_order():
+    """Concurrent batch dispatch returns items in their original order"""
+    # Every request is held until all six are in flight, so this only passes when they run concurrently
+    with MockLLMServer(gate=6) as server:
+        result = run_batch(server.url, batch_count=6, max_concurrency=6,
+                           full_randomize_batch=True, random_seed=42)
+
+        assert server.max_in_flight == 6 and server.gate_timeouts == 0
+        items = result[0].split("\n\n")
+        assert [item.split(']')[0] for item in items] == [f"[{i}" for i in range(1, 7)]
+        sent = [r['messages'][-1]['content'] for r in server.requests]
+        for item in items:
+            assert item.split('] ', 1)[1] in sent
+
+
+def test_concurrent_batch_matches_sequential():
+    """Seeded batches produce the same items with and without concurrency"""
+    with MockLLMServer() as server:
+        sequential = run_batch(server.url, batch_count=5, max_concurrency=1,
+                               full_randomize_batch=True, random_seed=3)
+        concurrent = run_batch(server.url, batch_count=5, max_concurrency=4,
+                               full_randomize_batch=True, random_seed=3)
+        assert sequential[:4] == concurrent[:4]
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting batch concurrency tests...")
+    print("=" * 60)
+
+    try:
+        test_concurrent_batch_keeps_order()
+        test_concurrent_batch_matches_sequential()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared aiohttp connection pools: the per-host limit,
+connections the server closes, and TLS session reuse
+"""
+
+import sys
+import os
+import ssl
+import shutil
+import subprocess
+import tempfile
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import PromptBuilderLocalNode, ConnectionPoolRegistry, get_async_runtime
+from mock_llm_server import MockLLMServer
+
+
+def use_pools(pools: ConnectionPoolRegistry) -> ConnectionPoolRegistry:
+    saved = promptbuilder_node._connection_pools
+    promptbuilder_node._connection_pools = pools
+    return saved
+
+
+def restore_pools(saved: ConnectionPoolRegistry):
+    promptbuilder_node._connection_pools.close()
+    promptbuilder_node._connection_pools = saved
+
+
+def test_pool_limits_connections_per_host():
+    """No more than maxsize requests reach one host at once, the rest wait for a connection"""
+    import asyncio
+    saved = use_pools(ConnectionPoolRegistry(maxsize=2))
+    try:
+        with MockLLMServer(keep_alive=True, hold=True) as server:
+            node = PromptBuilderLocalNode()
+            config = {'api_url': server.url, 'model_name': 'mock-model', 'coalesce_requests': False}
+
+            async def fan_out():
+                calls = [asyncio.ensure_future(node.make_api_call_async(config, [{"role": "user", "content": f"ant {i}"}]))
+                         for i in range(6)]
+                # Let every call reach the connector before the server answers
+                while len(server.requests) < 2:
+                    await asyncio.sleep(0.01)
+                held = promptbuilder_node.get_connection_pools().stats()[server.url]
+                assert held['in_use'] == 2 and held['open'] == 2
+                server.release.set()
+                return await asyncio.gather(*calls)
+
+            assert len(get_async_runtime().run(fan_out())) == 6
+            assert server.max_in_flight == 2
+            stats = promptbuilder_node.get_connection_pools().stats()[server.url]
+            assert stats['opened'] == 2 and stats['reused'] == 4
+            assert stats['idle'] == 2 and stats['in_use'] == 0
+    finally:
+        restore_pools(saved)
+
+
+def test_pool_recovers_from_server_closed_connection():
+    """A kept-alive connection the server has closed is replaced, and no request is sent twice"""
+    saved = use_pools(ConnectionPoolRegistry(maxsize=1))
+    try:
+        with MockLLMServer(keep_alive=True) as server:
+            answer = server.respond
+
+            def answer_then_hang_up(handler, payload):
+                # Advertises keep-alive, then closes its end of the socket
+                answer(handler, payload)
+                handler.close_connection = True
+
+            server.respond = answer_then_hang_up
+            node = PromptBuilderLocalNode()
+            config = {'api_url': server.url, 'model_name': 'mock-model', 'max_retries': 1, 'coalesce_requests': False}
+            for animal in ("bee", "cat", "dog"):
+                assert animal in node.make_api_call(config, [{"role": "user", "content": animal}])
+            assert [request['messages'][-1]['content'] for request in server.requests] == ["bee", "cat", "dog"]
+            assert promptbuilder_node.get_connection_pools().stats()[server.url]['opened'] >= 3
+    finally:
+        restore_pools(saved)
+
+
+def test_tls_connections_reused():
+    """HTTPS requests to one host share a single TLS handshake"""
+    if shutil.which('openssl') is None:
+        print("openssl not found, skipping the TLS test")
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        cert, key = os.path.join(folder, 'cert.pem'), os.path.join(folder, 'key.pem')
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                        '-keyout', key, '-out', cert], check=True, capture_output=True)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+        client_context = ssl.create_default_context(cafile=cert)
+
+        saved = use_pools(ConnectionPoolRegistry(maxsize=4, ssl=client_context))
+        try:
+            with MockLLMServer(keep_alive=True, ssl_context=server_context) as server:
+                node = PromptBuilderLocalNode()
+                config = {'api_url': server.url, 'model_name': 'mock-model', 'coalesce_requests': False}
+                for i in range(3):
+                    assert f"elk {i}" in node.make_api_call(config, [{"role": "user", "content": f"elk {i}"}])
+                stats = promptbuilder_node.get_connection_pools().stats()[server.url]
+                assert stats == {'requests': 3, 'opened': 1, 'reused': 2, 'failed': 0, 'open': 1, 'idle': 1, 'in_use': 0}
+        finally:
+            restore_pools(saved)
+
+
+def test_pool_settings_tolerate_bad_values():
+    """A non-numeric pool setting falls back to the default instead of failing the import"""
+    saved = os.environ.get('PROMPTBUILDER_HTTP_POOL_SIZE')
+    try:
+        os.environ['PROMPTBUILDER_HTTP_POOL_SIZE'] = 'lots'
+        assert promptbuilder_node.env_number('PROMPTBUILDER_HTTP_POOL_SIZE', 32, int) == 32
+        os.environ['PROMPTBUILDER_HTTP_POOL_SIZE'] = '8'
+        assert promptbuilder_node.env_number('PROMPTBUILDER_HTTP_POOL_SIZE', 32, int) == 8
+    finally:
+        os.environ.pop('PROMPTBUILDER_HTTP_POOL_SIZE', None)
+        if saved is not None:
+            os.environ['PROMPTBUILDER_HTTP_POOL_SIZE'] = saved
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting connection pool tests...")
+    print("=" * 60)
+
+    try:
+        test_pool_limits_connections_per_host()
+        test_pool_recovers_from_server_closed_connection()
+        test_tls_connections_reused()
+        test_pool_settings_tolerate_bad_values()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
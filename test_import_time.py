@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test script for PromptBuilder import cost
+"""
+
+import sys
+import os
+import subprocess
+
+# Add the current directory and the benchmarks to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+from bench_import_time import measure_import_time, IMPORT_TIME_BUDGET_MS, PACKAGE_DIR
+
+
+def test_import_defers_tags_and_network():
+    """Importing or creating a node neither reads tags_db.json nor starts the asyncio client; the first request does"""
+    script = (
+        "import sys, promptbuilder_node as pb\n"
+        "assert 'asyncio' not in sys.modules\n"
+        "assert 'TAGS_DB' not in vars(pb)\n"
+        "assert pb.TAGS_DB is pb.get_tags_db() and pb.TAGS_DB\n"
+        "pb.PromptBuilderLocalNode()\n"
+        "assert 'asyncio' not in sys.modules\n"
+        "node = pb.PromptBuilderLocalNode()\n"
+        "config = {'api_url': 'http://127.0.0.1:1', 'model_name': 'm', 'max_retries': 0}\n"
+        "try: node.make_api_call(config, [])\n"
+        "except Exception: pass\n"
+        "assert 'asyncio' in sys.modules\n"
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=PACKAGE_DIR, check=True)
+
+
+def test_import_time_budget():
+    """Median import time stays under the startup budget"""
+    totals = sorted(measure_import_time()[0] for _ in range(3))
+    assert totals[1] / 1000 < IMPORT_TIME_BUDGET_MS, f"import took {totals[1] / 1000:.1f} ms"
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting import time tests...")
+    print("=" * 60)
+
+    try:
+        test_import_defers_tags_and_network()
+        test_import_time_budget()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script for keyword extraction and batched offline enhancement
+"""
+
+import sys
+import os
+import random
+
+# Add the current directory and the benchmarks to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import promptbuilder_node
+from promptbuilder_node import (PromptBuilderLocalNode, KeywordMatcher, extract_prompt_elements,
+                                ELEMENT_KEYWORDS, DETAIL_KEYWORDS, enhance_prompts_batch)
+from bench_keyword_extraction import legacy_extract_elements, SAMPLE
+
+
+def test_matcher_follows_findall_rules():
+    """Per group: non-overlapping, left to right, first listed keyword wins, overlaps across groups allowed"""
+    matcher = KeywordMatcher({'a': ('light', 'lighting', 'ambient light'), 'b': ('lighting', 'ting')})
+    text = "Ambient LIGHTING"
+    spans = matcher.find_spans(text)
+    assert [text[s:e] for s, e in spans['a']] == ['Ambient LIGHT']
+    assert [text[s:e] for s, e in spans['b']] == ['LIGHTING']
+    assert matcher.find_spans("")['a'] == []
+
+
+def test_elements_match_regex_extraction():
+    """The single-pass extraction returns exactly what the per-category regexes did"""
+    cases = [
+        SAMPLE,
+        "A WOMAN WITH red hair, a man. Human being, female,male character (tall)",
+        "womanly figure\nwoman",
+        "Cozy, COZY and cozy; warm, Warm light and sunset glow",
+        "ſunlight on a Kneeling gİrl, ıntimate",
+        "three word thing",
+        "",
+    ]
+    vocabulary = [keyword for group in list(ELEMENT_KEYWORDS.values()) + list(DETAIL_KEYWORDS.values())
+                  for keyword in group] + ["with", "who", "that", "(", ",", "the", "a", "hu", "\n", "."]
+    rng = random.Random(3)
+    for _ in range(300):
+        words = [rng.choice(vocabulary) for _ in range(rng.randint(0, 30))]
+        cases.append(rng.choice([" ", "", ", "]).join(word.upper() if rng.random() < 0.2 else word for word in words))
+    for text in cases:
+        assert extract_prompt_elements(text) == legacy_extract_elements(text), text
+
+    prompt = PromptBuilderLocalNode().enhance_prompt_advanced(SAMPLE, 'realistic', 'any')
+    assert prompt.startswith("playful, cozy, intimate, natural, expressive young woman, squats")
+
+
+def test_batch_matches_single_calls():
+    """enhance_prompts_batch returns what enhance_prompt_advanced returns per description, also from worker processes"""
+    node = PromptBuilderLocalNode()
+    rng = random.Random(5)
+    words = SAMPLE.split() + ["man", "WOMAN,", "light"]
+    descriptions = [SAMPLE, "", "a b"] + [" ".join(rng.sample(words, rng.randint(1, 20))) for _ in range(17)]
+    settings = [('realistic', 'portrait', {}), ('anime', 'any', {'anime_style': 'naruto', 'nsfw_mode': 'nsfw',
+                                                                 'nsfw_level': 7})]
+    for style_main, style_sub, kwargs in settings:
+        expected = [node.enhance_prompt_advanced(text, style_main, style_sub, **kwargs) for text in descriptions]
+        assert enhance_prompts_batch(descriptions, style_main, style_sub, **kwargs) == expected
+    assert enhance_prompts_batch([], 'realistic', 'any') == []
+
+    saved = promptbuilder_node.ENHANCE_BATCH_MIN_PER_PROCESS
+    try:
+        promptbuilder_node.ENHANCE_BATCH_MIN_PER_PROCESS = 5
+        assert enhance_prompts_batch(descriptions, 'anime', 'any', processes=2, **settings[1][2]) == expected
+    finally:
+        promptbuilder_node.ENHANCE_BATCH_MIN_PER_PROCESS = saved
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting keyword extraction tests...")
+    print("=" * 60)
+
+    try:
+        test_matcher_follows_findall_rules()
+        test_elements_match_regex_extraction()
+        test_batch_matches_single_calls()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
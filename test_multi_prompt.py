@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script for packing several batch items into one LLM request, run
+against a mock OpenAI-compatible server
+"""
+
+import sys
+import os
+import json
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockLLMServer, run_batch
+
+
+def test_multi_prompt_requests_retry_only_failed_items():
+    """Packed requests map array entries back to items and retry the broken ones"""
+    with MockLLMServer() as server:
+        answer = server.respond
+
+        def packed(handler, payload):
+            lines = payload['messages'][-1]['content'].split("\n")[1:]
+            if not lines:
+                return answer(handler, payload)
+            entries = [{"positive": f"packed {line}", "negative": "n", "enhanced_description": line}
+                       for line in lines]
+            entries[1] = {"oops": True}
+            content = "```json\n" + json.dumps(entries) + "\n```"
+            body = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+            handler.send_response(200)
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+
+        server.respond = packed
+        result = run_batch(server.url, batch_count=5, prompts_per_request=3, full_randomize_batch=True)
+        items = result[0].split("\n\n")
+        assert len(items) == 5
+        # Two packed calls (3 + 2 items) plus one retry for each broken second entry
+        assert len(server.requests) == 4
+        assert items[0].startswith("[1] packed 1. ")
+        assert items[1].startswith("[2] Create enhanced prompts for: ")
+        assert items[3].startswith("[4] packed 1. ")
+        assert items[4].startswith("[5] Create enhanced prompts for: ")
+
+
+def test_packed_requests_fit_the_token_ceiling():
+    """Groups shrink so items x max_tokens stays within multi_prompt_max_tokens"""
+    with MockLLMServer() as server:
+        result = run_batch(server.url, batch_count=6, prompts_per_request=4, max_tokens=1000,
+                           multi_prompt_max_tokens=2500, full_randomize_batch=True)
+        assert len(result[0].split("\n\n")) == 6
+        assert "Prompts per LLM call: 2" in result[4]
+        # The echo server answers packed calls with a single object, so items are then retried one by one
+        packed = [r for r in server.requests if "each of these" in r['messages'][-1]['content']]
+        assert len(packed) == 3
+        assert all(r['max_tokens'] == 2000 for r in packed)
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting multi-prompt tests...")
+    print("=" * 60)
+
+    try:
+        test_multi_prompt_requests_retry_only_failed_items()
+        test_packed_requests_fit_the_token_ceiling()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test script for the KV-cache-friendly system prompt layout and llama.cpp
+prefix cache hints, run against a mock OpenAI-compatible server
+"""
+
+import sys
+import os
+import json
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from promptbuilder_node import PromptBuilderLocalNode
+from mock_llm_server import MockLLMServer, run_batch
+
+
+def test_cache_friendly_prompt_shares_prefix():
+    """The stable system prompt prefix does not depend on per-request settings"""
+    node = PromptBuilderLocalNode()
+    first = node.create_system_prompt_parts('SDXL', 'realistic', 'any', 'off', gender='female')
+    second = node.create_system_prompt_parts('Pony', 'realistic', 'any', 'nsfw', gender='male',
+                                             nsfw_level=8, scene_type='couple')
+    assert first[0] == second[0]
+    assert first[1] != second[1]
+    assert "Target Model: Pony" in second[1] and "Pony" not in second[0]
+    assert node.create_system_prompt('Pony', 'realistic', 'any', 'nsfw', cache_friendly_prompt=True,
+                                     gender='male', nsfw_level=8, scene_type='couple') == ''.join(second)
+
+
+def test_cache_prompt_hints_and_reuse_report():
+    """Requests carry cache_prompt/id_slot and the batch reports reused prefill"""
+    with MockLLMServer() as server:
+        answer = server.respond
+
+        def with_timings(handler, payload):
+            content = json.dumps({"positive": "p", "negative": "n", "enhanced_description": "e"})
+            body = json.dumps({"choices": [{"message": {"content": content}}],
+                               "timings": {"cache_n": 500, "prompt_n": 20}}).encode()
+            handler.send_response(200)
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+
+        server.respond = with_timings
+        result = run_batch(server.url, batch_count=3, full_randomize_batch=True,
+                           cache_friendly_prompt=True, llama_slot_id=2)
+        assert all(r['cache_prompt'] is True and r['id_slot'] == 2 for r in server.requests)
+        assert "Prefill reused: 1500 tokens (server-reported)" in result[4]
+
+        server.respond = answer
+        result = run_batch(server.url, batch_count=3, full_randomize_batch=True, cache_friendly_prompt=True)
+        assert "id_slot" not in server.requests[-1]
+        assert "(estimated)" in result[4]
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting prefix cache tests...")
+    print("=" * 60)
+
+    try:
+        test_cache_friendly_prompt_shares_prefix()
+        test_cache_prompt_hints_and_reuse_report()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared prompt engine
+"""
+
+import sys
+import os
+
+# Add the current directory and the benchmarks to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+from promptbuilder_node import PROMPT_ENGINE, PromptBuilderLocalNode, PromptBuilderOnlineNode
+from bench_node_overhead import helper_calls, peak_allocation
+
+
+def test_engine_is_immutable():
+    """The shared engine has no instance state and read-only presets"""
+    for attempt in (lambda: setattr(PROMPT_ENGINE, 'cache', {}),
+                    lambda: PROMPT_ENGINE.shot_presets.__setitem__('new', 'x')):
+        try:
+            attempt()
+        except (AttributeError, TypeError):
+            continue
+        raise AssertionError("engine state was modified")
+    assert PromptBuilderLocalNode().shot_presets is PROMPT_ENGINE.shot_presets
+
+
+def test_online_node_builds_no_local_nodes():
+    """Online helpers and generate_prompts delegate to the engine instead of constructing local nodes"""
+    created = []
+    original_init = PromptBuilderLocalNode.__init__
+
+    def counting_init(self):
+        created.append(self)
+        original_init(self)
+
+    online = PromptBuilderOnlineNode()
+    PromptBuilderLocalNode.__init__ = counting_init
+    try:
+        results = [call() for _, call in helper_calls(online)]
+        # No API key: the prompt is assembled, then the call fails without touching the network
+        online.generate_prompts("a red fox", "openai", "", "SDXL", "realistic", "professional", 1,
+                                nsfw_mode='nsfw', gender='female')
+    finally:
+        PromptBuilderLocalNode.__init__ = original_init
+    assert created == []
+    assert results[0] == PromptBuilderLocalNode().get_quality_tags('SDXL', 'realistic', 'professional')
+
+    for name, call in helper_calls(online):
+        if name != 'build_character_description':
+            assert peak_allocation(call) < 2048, name
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting prompt engine tests...")
+    print("=" * 60)
+
+    try:
+        test_engine_is_immutable()
+        test_online_node_builds_no_local_nodes()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for parsing LLM responses into prompt fields
+"""
+
+import sys
+import os
+import json
+import time
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from promptbuilder_node import parse_llama_json_response, scan_json_candidates, StreamingPromptParser
+
+PROMPT = {"positive": "a fox {in} snow", "negative": "blurry", "enhanced_description": "winter [scene]"}
+
+
+def test_parse_plain_and_fenced_json():
+    """Plain JSON and JSON wrapped in prose and code fences parse the same"""
+    text = json.dumps(PROMPT)
+    assert parse_llama_json_response(text) == PROMPT
+    wrapped = f"Sure! Here it is:\n```json\n{json.dumps(PROMPT, indent=2)}\n```\nI hope you like it's mood."
+    assert parse_llama_json_response(wrapped) == PROMPT
+
+
+def test_parse_repairs_common_mistakes():
+    """Trailing commas, single quotes, bare keys and raw newlines are repaired"""
+    text = "{positive: 'a fox {in} snow', \"negative\": \"blurry\",\n enhanced_description: 'winter [scene]',\n}"
+    assert parse_llama_json_response(text) == PROMPT
+    assert parse_llama_json_response("{'positive': 'it\\'s \"late\"'}") == {"positive": 'it\'s "late"'}
+    assert parse_llama_json_response('{"positive": "line one\nline two"}') == {"positive": "line one\nline two"}
+    # Apostrophes inside double-quoted strings are left alone
+    assert parse_llama_json_response('Note: {"positive": "don\'t stop",}') == {"positive": "don't stop"}
+
+
+def test_parse_arrays_and_truncated_output():
+    """Arrays come back as structuredPrompts, complete objects inside truncated output are found"""
+    parsed = parse_llama_json_response('Results: [{"positive": "a"}, {"positive": "b"},] done')
+    assert parsed == {"structuredPrompts": [{"positive": "a"}, {"positive": "b"}]}
+    assert parse_llama_json_response('{"result": {"positive": "a"}, "extra": "cut of') == {"positive": "a"}
+    assert parse_llama_json_response("no json at all") is None
+    assert parse_llama_json_response("") is None
+
+
+def test_scanner_is_linear_on_adversarial_input():
+    """Unbalanced and deeply nested brackets neither blow up nor hang"""
+    for text in ["{" * 20000, '{"a": ' * 5000, "[" * 5000 + "]" * 5000, "{x} " * 5000, '"' * 20000]:
+        started = time.perf_counter()
+        parse_llama_json_response(text)
+        assert time.perf_counter() - started < 1.0
+    candidates, unclosed = scan_json_candidates('{"a": 1} {"b": [1, 2,]} {"c": ')
+    assert [repaired for _, repaired in candidates] == ['{"a": 1}', '{"b": [1, 2]}']
+    assert unclosed == 24
+
+
+def test_streaming_parser_emits_fields_in_order():
+    """Fields are emitted as their strings close, completion is signalled once"""
+    text = 'Sure:\n```json\n{"positive": "a \\"fox\\" {in} snow", "meta": {"seed": [1, "x"]}, ' \
+           '"negative": "blur\\u00e9", "enhanced_description": "winter"}\n```\nEnjoy!'
+    parser = StreamingPromptParser()
+    emitted = []
+    for i in range(0, len(text), 5):
+        emitted.append(parser.feed(text[i:i + 5]))
+        if parser.complete:
+            break
+    fields = [field for chunk in emitted for field in chunk]
+    assert fields == [("positive", 'a "fox" {in} snow'), ("negative", "blur\u00e9"), ("enhanced_description", "winter")]
+    # Each field shows up in the chunk where its closing quote arrived
+    assert len([chunk for chunk in emitted if chunk]) == 3
+    assert parser.complete and i < len(text) - 5
+
+    packed = StreamingPromptParser()
+    packed.feed('[{"positive": "a"}, {"positive": "b"}]')
+    assert packed.ignored and not packed.complete
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting prompt parsing tests...")
+    print("=" * 60)
+
+    try:
+        test_parse_plain_and_fenced_json()
+        test_parse_repairs_common_mistakes()
+        test_parse_arrays_and_truncated_output()
+        test_scanner_is_linear_on_adversarial_input()
+        test_streaming_parser_emits_fields_in_order()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script for coalescing identical in-flight LLM requests, run against a
+mock OpenAI-compatible server
+"""
+
+import sys
+import os
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import PromptBuilderLocalNode, get_async_runtime
+from mock_llm_server import MockLLMServer, run_batch
+
+
+def send_concurrently(configs):
+    """Send the same user message once per config, all in flight together"""
+    import asyncio
+    messages = [{"role": "user", "content": "a heron"}]
+
+    async def fan_out():
+        return await asyncio.gather(*(PromptBuilderLocalNode().make_api_call_async(config, messages)
+                                      for config in configs))
+
+    return get_async_runtime().run(fan_out())
+
+
+def test_identical_requests_are_coalesced():
+    """Concurrent identical requests from several nodes share a single upstream call"""
+    with MockLLMServer() as server:
+        config = {'api_url': server.url, 'model_name': 'mock-model'}
+        coalesced_before = promptbuilder_node._single_flight.stats()['coalesced']
+        contents = send_concurrently([config] * 6)
+        assert len(server.requests) == 1
+        assert promptbuilder_node._single_flight.stats()['coalesced'] - coalesced_before == 5
+        assert len(set(contents)) == 1
+
+
+def test_different_requests_are_not_coalesced():
+    """Requests aimed at other servers or sent in another mode get their own call"""
+    with MockLLMServer() as first, MockLLMServer() as second:
+        base = {'api_url': first.url, 'model_name': 'mock-model'}
+        send_concurrently([
+            base,
+            dict(base, api_url=second.url),
+            dict(base, stream=True),
+            dict(base, cache_prompt=True, slot_id=1),
+            dict(base, structured_output='json_schema'),
+            dict(base, api_key='other-key'),
+        ])
+        assert len(first.requests) == 5 and len(second.requests) == 1
+
+
+def test_batch_items_are_not_coalesced():
+    """Every batch item is its own LLM call, even when the requests are identical"""
+    with MockLLMServer() as server:
+        result = run_batch(server.url, batch_count=6, max_concurrency=6)
+        assert len(server.requests) == 6
+        assert "Coalesced" not in result[4]
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting request coalescing tests...")
+    print("=" * 60)
+
+    try:
+        test_identical_requests_are_coalesced()
+        test_different_requests_are_not_coalesced()
+        test_batch_items_are_not_coalesced()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
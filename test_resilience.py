@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Test script for retries, the circuit breaker and load balancing of the local
+LLM client, run against a mock OpenAI-compatible server
+"""
+
+import sys
+import os
+import json
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import PromptBuilderLocalNode
+from mock_llm_server import MockLLMServer, run_batch
+
+
+def test_retry_on_transient_server_error():
+    """5xx answers are retried and the retry's response is used"""
+    with MockLLMServer() as server:
+        answer = server.respond
+        failures = []
+
+        def flaky(handler, payload):
+            if not failures:
+                failures.append(payload)
+                handler.send_response(503)
+                handler.send_header('Content-Length', '0')
+                handler.end_headers()
+                return
+            answer(handler, payload)
+
+        server.respond = flaky
+        node = PromptBuilderLocalNode()
+        config = {'api_url': server.url, 'model_name': 'mock-model', 'max_retries': 2}
+        content = node.make_api_call(config, [{"role": "user", "content": "a lighthouse"}])
+        assert json.loads(content)['positive'] == "a lighthouse"
+        assert len(server.requests) == 2
+
+
+def test_circuit_breaker_fails_fast():
+    """A failing server trips the breaker, later calls skip the network entirely"""
+    with MockLLMServer() as server:
+        def broken(handler, payload):
+            handler.send_response(500)
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+
+        server.respond = broken
+        node = PromptBuilderLocalNode()
+        config = {'api_url': server.url, 'model_name': 'mock-model', 'max_retries': 0,
+                  'circuit_breaker_threshold': 2, 'circuit_breaker_cooldown': 30}
+        messages = [{"role": "user", "content": "hi"}]
+        for _ in range(2):
+            try:
+                node.make_api_call(config, messages)
+                assert False, "expected the server error to surface"
+            except Exception as e:
+                assert "internal error" in str(e)
+
+        breaker = promptbuilder_node.get_circuit_breaker(server.url, 2, 30)
+        assert breaker.state == breaker.OPEN
+        try:
+            node.make_api_call(config, messages)
+            assert False, "expected the open circuit to reject the call"
+        except Exception as e:
+            assert "marked offline" in str(e)
+        assert len(server.requests) == 2
+
+    # After the cool-down (moved back instead of waited for) a single probe goes through
+    breaker.opened_at -= 30
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+
+def test_connection_refused_is_transient():
+    """An unreachable server is reported as such"""
+    with MockLLMServer() as server:
+        dead_url = server.url
+    node = PromptBuilderLocalNode()
+    config = {'api_url': dead_url, 'model_name': 'mock-model', 'max_retries': 0}
+    try:
+        node.make_api_call(config, [{"role": "user", "content": "hi"}])
+        assert False, "expected the connection to fail"
+    except Exception as e:
+        assert "Cannot connect" in str(e)
+
+
+def test_malformed_response_is_transient():
+    """A broken status line is counted against the server's breaker but not sent again"""
+    with MockLLMServer() as server:
+        def garbled(handler, payload):
+            handler.wfile.write(b"HTTP/1.1 two-hundred OK\r\n\r\n")
+            handler.close_connection = True
+
+        server.respond = garbled
+        node = PromptBuilderLocalNode()
+        config = {'api_url': server.url, 'model_name': 'mock-model', 'max_retries': 1,
+                  'circuit_breaker_threshold': 5}
+        try:
+            node.make_api_call(config, [{"role": "user", "content": "hi"}])
+            assert False, "expected the broken response to surface"
+        except Exception as e:
+            assert "broken response" in str(e)
+        assert len(server.requests) == 1
+        assert promptbuilder_node.get_circuit_breaker(server.url).failures == 1
+
+
+def test_read_timeout_is_not_retried():
+    """A server that accepts but never answers gets one attempt per item, and every one counts"""
+    with MockLLMServer(hold=True) as server:
+        node = PromptBuilderLocalNode()
+        config = {'api_url': server.url, 'model_name': 'mock-model', 'max_retries': 2, 'read_timeout': 0.2,
+                  'circuit_breaker_threshold': 5}
+        try:
+            node.make_api_call(config, [{"role": "user", "content": "hi"}])
+            assert False, "expected the read timeout to surface"
+        except Exception as e:
+            assert "not responding" in str(e)
+        assert len(server.requests) == 1
+        assert promptbuilder_node.get_circuit_breaker(server.url).failures == 1
+
+    # In a batch the breaker opens after threshold hung requests, the other items skip the server
+    with MockLLMServer(hold=True) as server:
+        promptbuilder_node._circuit_breakers.pop(server.url, None)
+        result = run_batch(server.url, batch_count=4, max_concurrency=1, max_retries=2, read_timeout=0.2,
+                           circuit_breaker_threshold=2, full_randomize_batch=True)
+        assert len(server.requests) == 2
+        assert result[2].count("LLM Offline") == 4
+
+
+def test_load_balancing_across_servers():
+    """Batch items spread over several servers and skip a dead one"""
+    with MockLLMServer() as dead:
+        dead_url = dead.url
+    with MockLLMServer() as first, MockLLMServer() as second:
+        api_url = f"{first.url}, {dead_url}, {second.url}"
+        result = run_batch(api_url, batch_count=8, max_concurrency=1, max_retries=0,
+                           full_randomize_batch=True)
+        assert "LLM Offline" not in result[2]
+        assert len(first.requests) + len(second.requests) == 8
+        assert first.requests and second.requests
+        assert promptbuilder_node._endpoint_balancer.stats()[dead_url]['failures'] >= 1
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting resilience tests...")
+    print("=" * 60)
+
+    try:
+        test_retry_on_transient_server_error()
+        test_circuit_breaker_fails_fast()
+        test_connection_refused_is_transient()
+        test_malformed_response_is_transient()
+        test_read_timeout_is_not_retried()
+        test_load_balancing_across_servers()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test script for the LLM response cache and the finished-prompt result cache,
+run against a mock OpenAI-compatible server
+"""
+
+import sys
+import os
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import (PromptBuilderLocalNode, LLMResponseCache, canonical_request_key, ResultCache,
+                                canonical_result_key, get_async_runtime)
+from mock_llm_server import MockLLMServer, run_batch
+
+
+def test_response_cache_skips_repeat_calls(tmp_path=None):
+    """Identical requests are served from the on-disk cache"""
+    import tempfile
+    cache_dir = tmp_path or tempfile.mkdtemp()
+    promptbuilder_node._response_cache = LLMResponseCache(os.path.join(str(cache_dir), 'cache.sqlite3'))
+    try:
+        with MockLLMServer() as server:
+            node = PromptBuilderLocalNode()
+            config = {'api_url': server.url, 'model_name': 'mock-model', 'response_cache': True}
+            messages = [{"role": "user", "content": "a red fox"}]
+            first = node.make_api_call(config, messages)
+            second = node.make_api_call(config, messages)
+            assert first == second
+            assert len(server.requests) == 1
+            stats = promptbuilder_node.get_response_cache().stats()
+            assert stats['hits'] == 1 and stats['misses'] == 1 and stats['entries'] == 1
+    finally:
+        promptbuilder_node._response_cache = None
+
+
+def test_response_cache_ttl_and_eviction(tmp_path=None):
+    """Expired entries miss and the least recently used entries are evicted"""
+    import tempfile
+    cache_dir = tmp_path or tempfile.mkdtemp()
+    cache = LLMResponseCache(os.path.join(str(cache_dir), 'cache.sqlite3'), max_entries=2)
+    keys = [canonical_request_key("local", "m", [{"role": "user", "content": str(i)}], 0.7, 100) for i in range(3)]
+    assert len(set(keys)) == 3
+
+    cache.put(keys[0], "expired", ttl=-1)
+    assert cache.get(keys[0]) is None
+
+    cache.put(keys[0], "a")
+    cache.put(keys[1], "b")
+    assert cache.get(keys[0]) == "a"
+    cache.put(keys[2], "c")
+    cache.evict()
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "a" and cache.get(keys[2]) == "c"
+
+
+def test_busy_response_cache_does_not_stall_the_loop(tmp_path=None):
+    """While one request waits on the SQLite cache, other requests on the event loop carry on"""
+    import tempfile
+    import threading
+    from mock_llm_server import GATE_TIMEOUT
+    cache_dir = tmp_path or tempfile.mkdtemp()
+    cache = promptbuilder_node._response_cache = LLMResponseCache(os.path.join(str(cache_dir), 'cache.sqlite3'))
+    writing, release = threading.Event(), threading.Event()
+    store = cache.put
+
+    def busy_put(*args):
+        # Stands in for another process holding the database's write lock
+        writing.set()
+        release.wait(GATE_TIMEOUT)
+        store(*args)
+
+    cache.put = busy_put
+    try:
+        with MockLLMServer() as server:
+            node = PromptBuilderLocalNode()
+            config = {'api_url': server.url, 'model_name': 'mock-model', 'response_cache': True}
+            messages = [{"role": "user", "content": "a slow owl"}]
+            cached = threading.Thread(target=node.make_api_call, args=(config, messages))
+            cached.start()
+            assert writing.wait(GATE_TIMEOUT)
+            # Raises a timeout instead of finishing if the loop is blocked
+            other = get_async_runtime().run(node.make_api_call_async(
+                dict(config, response_cache=False), [{"role": "user", "content": "a quick hare"}]), GATE_TIMEOUT / 2)
+            assert "a quick hare" in other and not release.is_set()
+            release.set()
+            cached.join(GATE_TIMEOUT)
+            assert cache.get(canonical_request_key("local", "mock-model", messages, 0.7, 2000)) is not None
+    finally:
+        release.set()
+        promptbuilder_node._response_cache = None
+
+
+def test_result_cache_bounds_and_keys():
+    """LRU eviction by entries and bytes, TTL expiry, order-independent keys"""
+    cache = ResultCache(max_entries=2, max_bytes=200)
+    cache.put("a", ("x" * 10,))
+    cache.put("b", ("y" * 10,))
+    assert cache.get("a") == ("x" * 10,)
+    cache.put("c", ("z" * 10,))
+    assert cache.get("b") is None and "a" in cache and "c" in cache
+    cache.put("d", ("é" * 95,))
+    assert cache.stats()['entries'] == 1 and cache.stats()['bytes'] == 1 + 190
+    cache.put("e", ("too big" * 50,))
+    assert "e" not in cache and "d" in cache
+    cache.put("f", ("gone",), ttl=-1)
+    assert cache.get("f") is None
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 2 and stats['evictions'] == 3
+
+    first = canonical_result_key("quick", {'description': "a fox", 'options': {'a': 1, 'b': 0.1 + 0.2}})
+    second = canonical_result_key("quick", {'options': {'b': 0.3, 'a': 1, 'use_cache': False}, 'description': "a fox"})
+    assert first == second
+    assert first != canonical_result_key("local", {'description': "a fox", 'options': {'a': 1, 'b': 0.3}})
+
+
+def test_result_cache_shared_by_generation_paths():
+    """Single, packed batch and Quick generation reuse finished prompts, offline fallbacks are not kept"""
+    saved = promptbuilder_node._result_cache
+    promptbuilder_node._result_cache = ResultCache()
+    try:
+        with MockLLMServer() as server:
+            node = PromptBuilderLocalNode()
+            args = ("a heron at dawn", server.url, "mock-model", "SDXL", "realistic", "professional", 1)
+            first = node.generate_prompts(*args, result_cache=True)
+            assert node.generate_prompts(*args, result_cache=True) == first
+            assert len(server.requests) == 1
+
+            batch = run_batch(server.url, batch_count=4, prompts_per_request=2, full_randomize_batch=True,
+                              random_seed=3, result_cache=True)
+            sent = len(server.requests)
+            assert run_batch(server.url, batch_count=4, prompts_per_request=2, full_randomize_batch=True,
+                             random_seed=3, result_cache=True)[0] == batch[0]
+            assert len(server.requests) == sent
+            stats = promptbuilder_node.get_result_cache().stats()
+            assert stats['entries'] == 5 and stats['hits'] == 5
+
+        offline = node.generate_prompts("a heron at dusk", "http://127.0.0.1:1", "mock-model", "SDXL",
+                                        "realistic", "professional", 1, result_cache=True, max_retries=0)
+        assert "LLM Offline" in offline[2]
+        assert promptbuilder_node.get_result_cache().stats()['entries'] == 5
+    finally:
+        promptbuilder_node._result_cache = saved
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting response cache tests...")
+    print("=" * 60)
+
+    try:
+        test_response_cache_skips_repeat_calls()
+        test_response_cache_ttl_and_eviction()
+        test_busy_response_cache_does_not_stall_the_loop()
+        test_result_cache_bounds_and_keys()
+        test_result_cache_shared_by_generation_paths()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for streamed (server-sent-event) chat completions, run against a
+mock OpenAI-compatible server
+"""
+
+import sys
+import os
+import json
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import PromptBuilderLocalNode
+from mock_llm_server import MockLLMServer, GATE_TIMEOUT
+
+
+def test_streaming_response():
+    """Streamed completions are reassembled and parsed like normal ones"""
+    with MockLLMServer() as server:
+        node = PromptBuilderLocalNode()
+        result = node.generate_prompts(
+            "a cat on a windowsill", server.url, "mock-model", "SDXL", "realistic", "professional", 1,
+            quality_tags=False, stream_response=True
+        )
+        assert server.requests[-1]['stream'] is True
+        assert result[0].startswith("Create enhanced prompts for: a cat on a windowsill")
+        assert result[1] == "blurry"
+
+
+def test_streaming_aborts_runaway_output():
+    """Streams longer than the character budget are cut off"""
+    with MockLLMServer() as server:
+        node = PromptBuilderLocalNode()
+        config = {'api_url': server.url, 'model_name': 'mock-model', 'max_tokens': 100, 'stream': True}
+        server.respond = lambda handler, payload: server.respond_stream(handler, "x" * 5000)
+        content = node.make_api_call(config, [{"role": "user", "content": "hi"}])
+        assert 100 * 8 < len(content) < 5000
+
+
+def test_streaming_stops_after_prompt_object():
+    """The stream is closed once the JSON object is complete, trailing text is never waited for"""
+    with MockLLMServer() as server:
+        prompt = {"positive": "a {lighthouse}", "negative": "blurry", "enhanced_description": "a lighthouse"}
+        content = "```json\n" + json.dumps(prompt) + "\n```\n"
+        trailing = "Here is why I chose this. " * 40
+
+        def chatty(handler, payload):
+            try:
+                server.respond_stream(handler, content, done=False)
+                # The rest only arrives after the client returned (or the test has failed)
+                server.release.wait(GATE_TIMEOUT)
+                server.stream_chunks(handler, trailing)
+                handler.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        server.respond = chatty
+        fields = []
+        node = PromptBuilderLocalNode()
+        config = {'api_url': server.url, 'model_name': 'mock-model', 'stream': True,
+                  'on_prompt_field': lambda key, value: fields.append(key)}
+        text = node.make_api_call(config, [{"role": "user", "content": "hi"}])
+        assert not server.release.is_set()
+        server.release.set()
+
+        assert promptbuilder_node.parse_llama_json_response(text) == prompt
+        assert "Here is why" not in text
+        assert fields == ["positive", "negative", "enhanced_description"]
+
+
+def test_partial_streams_are_not_cached():
+    """Streams cut off before [DONE] or aborted as runaway are used but never stored in the response cache"""
+    import tempfile
+    cache_dir = tempfile.mkdtemp()
+    promptbuilder_node._response_cache = promptbuilder_node.LLMResponseCache(os.path.join(cache_dir, 'cache.sqlite3'))
+    try:
+        with MockLLMServer() as server:
+            node = PromptBuilderLocalNode()
+            config = {'api_url': server.url, 'model_name': 'mock-model', 'stream': True, 'response_cache': True,
+                      'stream_early_stop': False, 'max_tokens': 100}
+            messages = [{"role": "user", "content": "a gull"}]
+            server.respond = lambda handler, payload: server.respond_stream(handler, '{"positive": "a gu', done=False)
+            for _ in range(2):
+                content = node.make_api_call(config, messages)
+                assert content == '{"positive": "a gu' and isinstance(content, promptbuilder_node.PartialResponse)
+            assert len(server.requests) == 2
+
+            server.respond = lambda handler, payload: server.respond_stream(handler, "x" * 5000)
+            for _ in range(2):
+                assert len(node.make_api_call(config, messages)) < 5000
+            assert len(server.requests) == 4
+
+            # A stream that ends with [DONE] is complete and cached
+            server.respond = lambda handler, payload: server.respond_stream(handler, '{"positive": "a gull"}')
+            assert node.make_api_call(config, messages) == node.make_api_call(config, messages)
+            assert len(server.requests) == 5
+    finally:
+        promptbuilder_node._response_cache = None
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting streaming tests...")
+    print("=" * 60)
+
+    try:
+        test_streaming_response()
+        test_streaming_aborts_runaway_output()
+        test_streaming_stops_after_prompt_object()
+        test_partial_streams_are_not_cached()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
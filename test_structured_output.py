@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test script for schema-constrained JSON output of the local LLM, run against
+a mock OpenAI-compatible server
+"""
+
+import sys
+import os
+import json
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import PromptBuilderLocalNode, LLMResponseCache
+from mock_llm_server import MockLLMServer, run_batch
+
+
+def test_structured_output_retries_schema_mismatch(tmp_path=None):
+    """Schema-constrained requests parse with json.loads and retry bad answers"""
+    import tempfile
+    cache_dir = tmp_path or tempfile.mkdtemp()
+    promptbuilder_node._response_cache = LLMResponseCache(os.path.join(str(cache_dir), 'cache.sqlite3'))
+    try:
+        with MockLLMServer() as server:
+            def constrained(handler, payload):
+                if len(server.requests) == 1:
+                    content = 'Sure! Here is your prompt: {"positive": "x"}'
+                else:
+                    content = json.dumps({"positive": "a castle", "negative": "blurry",
+                                          "enhanced_description": "a castle at dusk"})
+                body = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+                handler.send_response(200)
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            server.respond = constrained
+            node = PromptBuilderLocalNode()
+            for _ in range(2):
+                result = node.generate_prompts(
+                    "a castle", server.url, "mock-model", "SDXL", "realistic", "professional", 1,
+                    quality_tags=False, structured_output="json_schema", response_cache=True
+                )
+                assert result[0] == "a castle" and result[2] == "a castle at dusk"
+            # The invalid first answer was retried and never cached
+            assert len(server.requests) == 2
+            schema = server.requests[0]['response_format']['json_schema']['schema']
+            assert schema['required'] == ['positive', 'negative', 'enhanced_description']
+    finally:
+        promptbuilder_node._response_cache = None
+
+    with MockLLMServer() as server:
+        run_batch(server.url, batch_count=2, structured_output="gbnf", full_randomize_batch=True)
+        assert all(r['grammar'].startswith("root ::=") for r in server.requests)
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting structured output tests...")
+    print("=" * 60)
+
+    try:
+        test_structured_output_retries_schema_mismatch()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
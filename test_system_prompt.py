@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Test script for system prompt compilation in PromptBuilder
+"""
+
+import sys
+import os
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import (PromptBuilderLocalNode, PromptBuilderOnlineNode, build_system_prompt_fragments,
+                                assemble_system_prompt, estimate_tokens, describe_system_prompt)
+
+
+def test_system_prompt_is_memoized_across_nodes():
+    """Identical settings reuse one compiled prompt, whichever node asks"""
+    promptbuilder_node._compile_system_prompt.cache_clear()
+    kwargs = {'gender': 'female', 'nsfw_level': 7, 'scene_type': 'couple'}
+    local = PromptBuilderLocalNode().create_system_prompt('SDXL', 'realistic', 'any', 'nsfw', **kwargs)
+    # Kwargs that do not affect the system prompt do not split the cache
+    online = PromptBuilderOnlineNode().create_system_prompt('SDXL', 'realistic', 'any', 'nsfw',
+                                                            temperature=0.2, batch_count=9, **kwargs)
+    info = promptbuilder_node._compile_system_prompt.cache_info()
+    assert local == online
+    assert info.misses == 1 and info.hits == 1
+
+    uncached = assemble_system_prompt(build_system_prompt_fragments('SDXL', 'realistic', 'any', 'nsfw', **kwargs),
+                                      'SDXL', 'realistic')
+    assert local == uncached
+
+
+def test_system_prompt_follows_tags_database():
+    """Replacing TAGS_DB yields a prompt with the new category counts"""
+    node = PromptBuilderLocalNode()
+    original = promptbuilder_node.TAGS_DB
+    try:
+        promptbuilder_node.TAGS_DB = {'quality_tags': ['a', 'b', 'c']}
+        prompt = node.create_system_prompt('SDXL', 'realistic', 'any', 'off')
+        assert "Quality Tags: 3 professional quality descriptors" in prompt
+        promptbuilder_node.TAGS_DB = {}
+        assert "Tags Database Reference" not in node.create_system_prompt('SDXL', 'realistic', 'any', 'off')
+    finally:
+        promptbuilder_node.TAGS_DB = original
+    assert node.create_system_prompt('SDXL', 'realistic', 'any', 'off') == \
+        assemble_system_prompt(build_system_prompt_fragments('SDXL', 'realistic', 'any', 'off'), 'SDXL', 'realistic')
+
+
+def test_system_prompt_budget():
+    """Budgeted prompts stay under the target and keep high-priority sections"""
+    node = PromptBuilderLocalNode()
+    kwargs = {'gender': 'female', 'breast_size': 'large', 'roleplay': 'maid_master'}
+    full = node.create_system_prompt('SDXL', 'realistic', 'any', 'nsfw', **kwargs)
+    sizes = []
+    for budget in (150, 300, 600, 1200):
+        prompt = node.create_system_prompt('SDXL', 'realistic', 'any', 'nsfw', system_prompt_budget=budget, **kwargs)
+        assert estimate_tokens(prompt) <= budget
+        assert '"enhanced_description"' in prompt and "NSFW Mode: nsfw" in prompt
+        sizes.append(len(prompt))
+        if budget >= 300:
+            # Content rules and constraints survive before any glossary terms
+            assert "ALWAYS include these specific elements" in prompt
+            assert "**Roleplay Constraint**" in prompt
+    assert sizes == sorted(sizes) and sizes[-1] < len(full)
+    assert " shift" not in node.create_system_prompt('SDXL', 'realistic', 'any', 'off', system_prompt_budget=4000)
+
+    info = describe_system_prompt("x" * 400, 120)
+    assert info == "🧮 System prompt: 400 chars, ~100 tokens (budget 120)"
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting system prompt tests...")
+    print("=" * 60)
+
+    try:
+        test_system_prompt_is_memoized_across_nodes()
+        test_system_prompt_follows_tags_database()
+        test_system_prompt_budget()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
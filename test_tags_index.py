@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Test script for tags retrieval in PromptBuilder
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+# Add the current directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import promptbuilder_node
+from promptbuilder_node import (PromptBuilderLocalNode, TagsIndex, get_tags_index, tag_retrieval_exclusions,
+                                format_relevant_tags, tokenize_tag_text, CompiledTagsIndex, compile_tags_index,
+                                get_compiled_tags_index, current_compiled_tags_index, exact_tag_matches, get_tags_db,
+                                reload_tags_database, tags_db_snapshot)
+
+SMALL_DB = {
+    'hair_styles': ['long red hair', 'short hair', 'red ribbon in hair', 'twin tails'],
+    'lighting': ['neon lighting', 'soft lighting', 'golden hour'],
+    'clothing_lingerie': ['red lace lingerie'],
+    'quality_tags': ['masterpiece', 'red'],
+    'version': '1.0'
+}
+
+
+def test_ranking_and_top_k():
+    """Tags matching more (and rarer) query words rank first, top-k applies per category"""
+    index = TagsIndex(SMALL_DB)
+    assert tokenize_tag_text("The Ribbons in her hair") == ['ribbon', 'hair']
+
+    result = index.search("woman with long red hair under neon lights", top_k=2)
+    assert result['hair_styles'][0] == 'long red hair'
+    assert len(result['hair_styles']) <= 2
+    assert result['lighting'] == ['neon lighting']
+    assert 'version' not in result
+
+    excluded = index.search("red lingerie", top_k=3, exclude=tag_retrieval_exclusions('off'))
+    assert 'clothing_lingerie' not in excluded and 'quality_tags' not in excluded
+    assert 'clothing_lingerie' in index.search("red lingerie", top_k=3, exclude=tag_retrieval_exclusions('nsfw'))
+    assert index.search("", top_k=3) == {} and index.search("zzz", top_k=3) == {}
+
+
+def test_batch_matches_single_lookups():
+    """A batch lookup returns exactly what one lookup per text would"""
+    index = get_tags_index()
+    texts = ["girl with a ribbon at the beach at sunset", "cyberpunk city at night, rain", "", "portrait, smiling"]
+    exclude = tag_retrieval_exclusions('off')
+    assert index.search_batch(texts, 3, exclude) == [index.search(text, 3, exclude) for text in texts]
+
+
+def test_index_follows_tags_database():
+    """Replacing TAGS_DB rebuilds the index once"""
+    original = promptbuilder_node.TAGS_DB
+    try:
+        promptbuilder_node.TAGS_DB = SMALL_DB
+        index = get_tags_index()
+        assert get_tags_index() is index
+        assert index.search("twin tails")['hair_styles'] == ['twin tails']
+    finally:
+        promptbuilder_node.TAGS_DB = original
+    assert get_tags_index() is not index
+
+
+def test_relevant_tags_in_system_prompt():
+    """Retrieved tags are appended to the system prompt only when enabled"""
+    node = PromptBuilderLocalNode()
+    original = promptbuilder_node.TAGS_DB
+    try:
+        promptbuilder_node.TAGS_DB = SMALL_DB
+        args = ("woman with twin tails", "http://localhost:8080", "local-model", "SDXL", "realistic", "any")
+        plain = node.prepare_prompt_request(*args, gender='female')
+        request = node.prepare_prompt_request(*args, gender='female', tag_retrieval_top_k=3)
+        system_prompt = request['messages'][0]['content']
+        assert "RELEVANT TAGS" not in plain['messages'][0]['content']
+        assert system_prompt.startswith(plain['messages'][0]['content'])
+        assert system_prompt.endswith("- hair styles: twin tails")
+    finally:
+        promptbuilder_node.TAGS_DB = original
+    assert format_relevant_tags({}) == ""
+
+
+def test_compiled_index_lookups():
+    """Exact, category and prefix lookups on the compiled index"""
+    index = CompiledTagsIndex(compile_tags_index(SMALL_DB))
+    assert len(index) == 10 and 'version' not in index.categories
+    assert index.lookup("  LONG red   hair ") == 'long red hair'
+    assert index.categories_of('red') == ['quality_tags']
+    assert 'long red' not in index and index.categories_of('nope') == []
+    assert index.complete('red') == ['red', 'red lace lingerie', 'red ribbon in hair']
+    assert index.complete('red ', limit=1) == ['red lace lingerie']
+    assert index.complete('x') == [] and len(index.complete('')) == 10
+
+    shared = CompiledTagsIndex(compile_tags_index({'a': ['Tag'], 'b': ['tag', 'other']}))
+    assert shared.categories_of('TAG') == ['a', 'b'] and len(shared) == 2
+
+
+def test_compiled_index_follows_json_mtime():
+    """The index file is memory-mapped, reused while the JSON is unchanged and rebuilt when it changes"""
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'tags_db.json')
+        target = os.path.join(tmp, 'cache', 'tags_db.idx')
+        with open(source, 'w', encoding='utf-8') as f:
+            json.dump(SMALL_DB, f)
+        index = get_compiled_tags_index(source, target)
+        assert os.path.exists(target) and 'twin tails' in index
+        assert get_compiled_tags_index(source, target) is index
+        assert CompiledTagsIndex.open(target).complete('twin') == ['twin tails']
+
+        with open(source, 'w', encoding='utf-8') as f:
+            json.dump({'hair_styles': ['twin braids']}, f)
+        stat = os.stat(source)
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        rebuilt = get_compiled_tags_index(source, target)
+        assert rebuilt is not index and 'twin tails' not in rebuilt
+        assert rebuilt.categories_of('twin braids') == ['hair_styles']
+        # The old mapping stays readable after the file was replaced
+        assert 'twin tails' in index
+        del index, rebuilt
+
+
+def test_exact_tags_lead_retrieval():
+    """Tags named verbatim in the description come first in their category, excluded categories stay out"""
+    index = CompiledTagsIndex(compile_tags_index(SMALL_DB))
+    text = "a girl, Twin  Tails, soft lighting; red lace lingerie\nnot a tag"
+    assert exact_tag_matches(text, index) == {
+        'hair_styles': ['twin tails'], 'lighting': ['soft lighting'], 'clothing_lingerie': ['red lace lingerie']
+    }
+    assert 'clothing_lingerie' not in exact_tag_matches(text, index, tag_retrieval_exclusions('off'))
+
+    node = PromptBuilderLocalNode()
+    original = promptbuilder_node.TAGS_DB
+    try:
+        promptbuilder_node.TAGS_DB = SMALL_DB
+        # An assigned database is compiled in memory, not read from the index file
+        assert current_compiled_tags_index().lookup('twin tails') == 'twin tails'
+        relevant = node.retrieve_relevant_tags(["long red hair with twin tails, red ribbon"], tag_retrieval_top_k=2)[0]
+        assert relevant['hair_styles'][0] == 'twin tails' and len(relevant['hair_styles']) == 2
+        assert node.retrieve_relevant_tags(["twin tails"], tag_retrieval_top_k=0) == [{}]
+    finally:
+        promptbuilder_node.TAGS_DB = original
+
+
+def test_retrieval_uses_shared_index_file():
+    """While TAGS_DB is tags_db.json as loaded, lookups go through the memory-mapped index file"""
+    saved = (promptbuilder_node.TAGS_DB_PATH, promptbuilder_node.TAGS_INDEX_PATH)
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            promptbuilder_node.TAGS_DB_PATH = os.path.join(tmp, 'tags_db.json')
+            promptbuilder_node.TAGS_INDEX_PATH = os.path.join(tmp, 'tags_db.idx')
+            write_tags_file(promptbuilder_node.TAGS_DB_PATH, SMALL_DB)
+            reload_tags_database()
+            index = current_compiled_tags_index()
+            assert index is get_compiled_tags_index() and os.path.exists(promptbuilder_node.TAGS_INDEX_PATH)
+            assert index.categories_of('RED') == ['quality_tags']
+        finally:
+            promptbuilder_node.TAGS_DB_PATH, promptbuilder_node.TAGS_INDEX_PATH = saved
+            reload_tags_database()
+    assert current_compiled_tags_index() is not index
+
+
+def write_tags_file(path, tags_db, bump=0):
+    """Write a tags file and move its mtime forward so the change is always visible"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(tags_db, f)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump * 1_000_000_000))
+
+
+def test_tags_db_hot_reload():
+    """A changed tags_db.json is swapped in, derived caches follow, snapshots stay put"""
+    node = PromptBuilderLocalNode()
+    saved = (promptbuilder_node.TAGS_DB_PATH, promptbuilder_node.TAGS_DB_RELOAD_INTERVAL)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tags_db.json')
+        try:
+            write_tags_file(path, {'quality_tags': ['fox', 'owl']})
+            promptbuilder_node.TAGS_DB_PATH = path
+            promptbuilder_node.TAGS_DB_RELOAD_INTERVAL = 0
+            first = reload_tags_database()
+            assert get_tags_db() is first and promptbuilder_node.TAGS_DB is first
+            assert "Quality Tags: 2 " in node.create_system_prompt('SDXL', 'realistic', 'any', 'off')
+            assert get_tags_index().search("fox")['quality_tags'] == ['fox']
+
+            with tags_db_snapshot() as snapshot:
+                write_tags_file(path, {'quality_tags': ['fox', 'owl', 'elk']}, bump=1)
+                # A request that is already running keeps its database
+                assert snapshot is first and get_tags_db() is first
+                assert "Quality Tags: 2 " in node.create_system_prompt('SDXL', 'realistic', 'any', 'off')
+            second = get_tags_db()
+            assert second is not first and second['quality_tags'] == ['fox', 'owl', 'elk']
+            assert "Quality Tags: 3 " in node.create_system_prompt('SDXL', 'realistic', 'any', 'off')
+            assert get_tags_index().search("elk")['quality_tags'] == ['elk']
+
+            # Half-written files are ignored, the interval limits how often the file is checked
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('{"quality_tags": [')
+            assert get_tags_db() is second
+            promptbuilder_node.TAGS_DB_RELOAD_INTERVAL = 3600
+            assert get_tags_db() is second
+            write_tags_file(path, {'quality_tags': ['yak']}, bump=2)
+            assert get_tags_db() is second
+            assert reload_tags_database()['quality_tags'] == ['yak']
+        finally:
+            promptbuilder_node.TAGS_DB_PATH, promptbuilder_node.TAGS_DB_RELOAD_INTERVAL = saved
+            reload_tags_database()
+    assert len(get_tags_db()) > 10
+
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting tags retrieval tests...")
+    print("=" * 60)
+
+    try:
+        test_ranking_and_top_k()
+        test_batch_matches_single_lookups()
+        test_index_follows_tags_database()
+        test_relevant_tags_in_system_prompt()
+        test_compiled_index_lookups()
+        test_compiled_index_follows_json_mtime()
+        test_exact_tags_lead_retrieval()
+        test_retrieval_uses_shared_index_file()
+        test_tags_db_hot_reload()
+
+        print("\n✅ All tests completed successfully!")
+
+    except Exception as e:
+        print(f"❌ Test failed with error: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())